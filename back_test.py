@@ -1,9 +1,13 @@
 # backtest.py
-import akshare as ak
+from data_source import ak, local_caches_enabled
+import argparse
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+
+from charts import CHART_FORMAT, chart_path, plot_score_chart, render_charts
+from nav_panel import open_panel
+from panel_score import rolling_score_panel
+from trade_calendar import trade_dates_between
 
 # ================= 复用你的配置参数 =================
 HOLD_DAYS = 7
@@ -26,8 +30,40 @@ SCORE_W_BIAS_20 = 5.0
 TARGET_CODE = "512480" 
 START_DATE = "20240101"
 END_DATE = "20251231"
+# 打分方式: "rolling"=滚动窗口一次性计算全部日期 (O(n)); "loop"=逐日切片调用 calc_score_for_row (旧逻辑, 用于核对)
+SCORE_MODE = "rolling"
+# 按交易日历对齐 (停牌日沿用前收盘)：HOLD_DAYS 与 20 日窗口都按交易日计，而不是按数据行数
+ALIGN_TO_TRADE_CALENDAR = True
+# 优先从历史价格面板（panel_backtest 生成的 cache/panel/<名>，后复权收盘价）读取，只映射这一列；None = 直接拉取
+PRICE_PANEL_NAME = "etf_hfq"
+# 图表输出：None = 弹窗显示（需要显示器，会阻塞）；填目录则无界面渲染（Agg），写出 <目录>/<代码>.<PLOT_FORMAT>
+# 批量出图：python back_test.py --codes 512480,513100 --out reports/charts （多个标的并行渲染）
+PLOT_OUTPUT_DIR = None
+PLOT_FORMAT = CHART_FORMAT
+
+def load_from_panel(code, start, end):
+    """
+    面板的拉取区间覆盖 [start, end] 且含该标的时，直接返回其收盘价 (只读这一列)；否则返回 None。
+    注意面板按 float32 存储，读出的后复权价约 7 位有效数字，与直接拉取的 float64 可能有末位差异；
+    需要逐位核对时把 PRICE_PANEL_NAME 设为 None
+    """
+    if not PRICE_PANEL_NAME or not local_caches_enabled():
+        return None
+    panel = open_panel(PRICE_PANEL_NAME)
+    if panel is None or not panel.covers([code], start, end):
+        return None
+    close = panel.series(code, start, end)
+    if close is None or len(close) == 0:
+        return None
+    df = close.rename('close').to_frame()
+    df.index.name = 'date'
+    return df
 
 def get_data(code, start, end):
+    df = load_from_panel(code, start, end)
+    if df is not None:
+        print(f"📦 从价格面板读取 {code} 的历史数据")
+        return df
     print(f"⏳ 正在拉取 {code} 的历史数据...")
     try:
         # 使用 ETF 接口，数据更全
@@ -41,6 +77,15 @@ def get_data(code, start, end):
         print(f"❌ 数据获取失败: {e}")
         return None
 
+def align_to_trade_calendar(df):
+    """
+    以交易日历为索引重建行情（停牌缺失的交易日用前一日收盘价填充）
+    """
+    dates = trade_dates_between(df.index[0], df.index[-1])
+    if len(dates) == 0:
+        return df
+    return df.reindex(dates).ffill()
+
 def calc_score_for_row(current_idx, full_df):
     """
     模拟站在 current_idx 这一天，利用过去的数据计算分数
@@ -95,32 +140,71 @@ def calc_score_for_row(current_idx, full_df):
     
     return score
 
-def run_backtest():
+def calc_score_series(full_df):
+    """
+    滚动窗口版打分：一次遍历算出每一天的分数，结果与逐日调用 calc_score_for_row 一致
+    """
+    weights = {
+        "ret_hold": SCORE_W_RET_HOLD,
+        "ret_20": SCORE_W_RET_20,
+        "vol_20": SCORE_W_VOL_20,
+        "mdd_20": SCORE_W_MDD_20,
+        "pos_20": SCORE_W_POS_20,
+        "ret_hold_cap": SCORE_W_RET_HOLD_CAP,
+        "bias_20": SCORE_W_BIAS_20,
+    }
+    result = rolling_score_panel(
+        full_df['close'].to_numpy(dtype=float),
+        weights,
+        hold_days=HOLD_DAYS,
+        ret_hold_soft_cap=RET_HOLD_SOFT_CAP,
+        bias_threshold=BIAS_20_THRESHOLD,
+        enable_bias_penalty=ENABLE_BIAS_20_PENALTY,
+    )
+    score = result["score"][:, 0]
+    # 与 calc_score_for_row 一致：前 21 天不出分
+    score[:21] = np.nan
+    return pd.Series(score, index=full_df.index)
+
+def backtest_frame(code):
+    """
+    拉取行情并逐日打分，返回含 close / score / future_7d_ret 的 DataFrame；数据获取失败时返回 None
+    """
     # 1. 获取数据
-    df = get_data(TARGET_CODE, START_DATE, END_DATE)
-    if df is None: return
+    df = get_data(code, START_DATE, END_DATE)
+    if df is None: return None
+    if ALIGN_TO_TRADE_CALENDAR:
+        df = align_to_trade_calendar(df)
 
     # 2. 逐日计算分数
-    scores = []
     print("🔄 开始逐日计算策略分数...")
     
-    # 从第 22 天开始算，因为前面数据不够算指标
-    for i in range(len(df)):
-        s = calc_score_for_row(i, df)
-        scores.append(s if s is not None else np.nan)
-        
-    df['score'] = scores
+    if SCORE_MODE == "rolling":
+        df['score'] = calc_score_series(df)
+    else:
+        # 每天都调用一次，前 21 天数据不够算指标，calc_score_for_row 返回 None（记为 NaN）
+        scores = []
+        for i in range(len(df)):
+            s = calc_score_for_row(i, df)
+            scores.append(s if s is not None else np.nan)
+
+        df['score'] = scores
     
     # 3. 计算“未来7日真实收益”（用于验证预测能力）
-    # shift(-7) 表示把未来的数据拉到今天，让我们知道今天如果买入，7天后赚多少
+    # shift(-7) 表示把未来的数据拉到今天，让我们知道今天如果买入，7个交易日后赚多少
     df['future_7d_ret'] = df['close'].shift(-HOLD_DAYS) / df['close'] - 1
     
     # 清洗数据
     df.dropna(inplace=True)
-    
+    return df
+
+def run_backtest(code=TARGET_CODE):
+    df = backtest_frame(code)
+    if df is None: return
+
     # 4. 分析结果
     print("-" * 30)
-    print(f"📊 回测统计 ({TARGET_CODE})")
+    print(f"📊 回测统计 ({code})")
     print(f"样本天数: {len(df)}")
     
     # 计算 IC (Information Coefficient): 分数和未来收益的相关性
@@ -133,43 +217,39 @@ def run_backtest():
     else: print("   ⚠️ 指标与未来涨跌基本无关（随机）。")
 
     # 5. 可视化
-    plot_results(df)
+    path = plot_results(df, code, PLOT_OUTPUT_DIR, PLOT_FORMAT)
+    if path:
+        print(f"🖼️ 图表已保存: {path}")
 
-def plot_results(df):
-    # 设置中文字体
-    plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS'] 
-    plt.rcParams['axes.unicode_minus'] = False
-    
-    fig, ax1 = plt.subplots(figsize=(12, 6))
-
-    # 画净值曲线
-    color = 'tab:blue'
-    ax1.set_xlabel('日期')
-    ax1.set_ylabel('基金净值', color=color)
-    ax1.plot(df.index, df['close'], color=color, label='净值', alpha=0.6)
-    ax1.tick_params(axis='y', labelcolor=color)
-
-    # 画分数值
-    ax2 = ax1.twinx()  
-    color = 'tab:orange'
-    ax2.set_ylabel('策略打分', color=color)
-    ax2.plot(df.index, df['score'], color=color, label='打分', linewidth=1.5)
-    ax2.tick_params(axis='y', labelcolor=color)
-    
-    # 画一条 0 分线
-    ax2.axhline(0, color='gray', linestyle='--', alpha=0.5)
+def plot_results(df, code=TARGET_CODE, out_dir=PLOT_OUTPUT_DIR, fmt=PLOT_FORMAT):
+    """
+    净值与打分双轴图；out_dir 为 None 时弹窗显示，否则写出图片文件并返回路径
+    """
+    path = chart_path(code, out_dir, fmt) if out_dir else None
+    return plot_score_chart(df, f'策略打分 vs 基金走势 ({code})', path=path)
 
-    # 标记高分时刻 (买点) 和 低分时刻 (卖点/风险点)
-    # 假设 score > 0.5 为高分区间 (Top candidates usually have high scores)
-    high_score_mask = df['score'] > df['score'].quantile(0.90) # 前10%的高分
-    low_score_mask = df['score'] < df['score'].quantile(0.10)  # 后10%的低分
-    
-    ax1.scatter(df.index[high_score_mask], df['close'][high_score_mask], 
-                color='red', marker='^', s=50, label='高分时刻(前10%)', zorder=10)
-    
-    plt.title(f'策略打分 vs 基金走势 ({TARGET_CODE})')
-    fig.tight_layout()
-    plt.show()
+def render_backtests(codes, out_dir, fmt=PLOT_FORMAT):
+    """
+    批量出图：逐只拉取并打分（网络 I/O 在主进程），再交给进程池并行渲染；返回成功写出的路径
+    """
+    jobs = []
+    for code in codes:
+        df = backtest_frame(code)
+        if df is not None and len(df) > 0:
+            jobs.append((code, df, f'策略打分 vs 基金走势 ({code})'))
+    return [p for p in render_charts(jobs, out_dir=out_dir, fmt=fmt) if p]
 
 if __name__ == "__main__":
-    run_backtest()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="单标的打分回测 / 批量出图")
+    parser.add_argument("--codes", help="逗号分隔的多个代码：批量无界面出图（不弹窗）")
+    parser.add_argument("--out", default=PLOT_OUTPUT_DIR, help="图表输出目录（不填则弹窗显示）")
+    parser.add_argument("--format", default=PLOT_FORMAT, choices=("png", "svg"))
+    args = parser.parse_args()
+
+    if args.codes:
+        paths = render_backtests([c.strip() for c in args.codes.split(",") if c.strip()],
+                                 args.out or "reports/charts", args.format)
+        print(f"🖼️ 已生成 {len(paths)} 张图表")
+    else:
+        PLOT_OUTPUT_DIR, PLOT_FORMAT = args.out, args.format
+        run_backtest()
\ No newline at end of file
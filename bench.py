@@ -0,0 +1,243 @@
+# bench.py
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import index08 as strategy
+from candidates import CandidateTable
+from diversify import build_corr_matrix
+from panel_score import build_nav_panel, rolling_score_panel
+from updown_pattern import PATTERN_POINTS, PatternMatcher, updown_bits_panel
+
+# ================= 基准测试设置 =================
+# 用合成净值面板（不联网）分阶段计时选基流程，输出吞吐 (funds/s) 与峰值内存，结果存盘便于前后对比
+
+# 规模：基金数 x 交易日数
+DEFAULT_SIZES = ["100x90", "1000x250", "10000x90", "1000x2000"]
+# 分散化阶段的候选上限（相关矩阵是 N^2，实盘里也只对过滤后的头部候选做分散化）
+DIVERSIFY_POOL = 500
+RESULTS_DIR = "bench_results"
+
+STAGES = ("score_loop", "score_panel", "pattern", "pattern_bits", "returns", "diversify", "rolling")
+# 多形态位运算匹配用的形态组（index02–index08 里出现过的几种底部形态）
+BENCH_PATTERNS = ["1001", "100111", "101111", "00011111", "000111111"]
+
+# ===========================================
+
+def make_synthetic_panel(n_funds, n_days, seed=0):
+    """
+    合成 (日期, 基金) 净值面板：市场因子 + 行业因子 + 个体噪声，部分基金成立较晚（前段为 NaN）
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=pd.Timestamp("2025-12-31"), periods=n_days)
+    n_sectors = 12
+
+    market = rng.normal(0.0003, 0.010, n_days)
+    sectors = rng.normal(0.0, 0.008, (n_days, n_sectors))
+    sector_of = rng.integers(0, n_sectors, n_funds)
+    beta = rng.uniform(0.2, 1.5, n_funds)
+
+    daily = (
+        market[:, None] * beta
+        + sectors[:, sector_of]
+        + rng.normal(0.0, 0.006, (n_days, n_funds))
+    )
+    nav = np.round(np.exp(np.cumsum(daily, axis=0)), 4)
+
+    # 约 10% 基金成立时间较晚
+    late = rng.random(n_funds) < 0.10
+    starts = rng.integers(0, max(1, n_days - 30), n_funds)
+    for j in np.flatnonzero(late):
+        nav[:starts[j], j] = np.nan
+
+    codes = [f"{i:06d}" for i in range(n_funds)]
+    return dates, codes, nav
+
+
+def panel_to_frames(dates, nav, points):
+    """
+    模拟 fetch_fund_nav_df 的输出：每只基金一个 (净值日期, 单位净值) DataFrame，只保留最近 points 行
+    """
+    dates = dates[-points:]
+    frames = []
+    for j in range(nav.shape[1]):
+        values = nav[-points:, j]
+        ok = ~np.isnan(values)
+        if ok.sum() == 0:
+            frames.append(None)
+            continue
+        frames.append(pd.DataFrame({'净值日期': dates[ok], '单位净值': values[ok]}))
+    return frames
+
+
+def _stage_runner(stage, dates, codes, nav, frames):
+    """
+    返回一个无参函数，执行该阶段一次
+    """
+    if stage == "score_loop":
+        return lambda: [strategy.calc_7d_score(df) for df in frames]
+
+    if stage == "score_panel":
+        return lambda: strategy.score_nav_panel(frames)
+
+    if stage == "pattern":
+        return lambda: [strategy.calc_updown_pattern(df) for df in frames]
+
+    if stage == "pattern_bits":
+        matcher = PatternMatcher(BENCH_PATTERNS)
+        return lambda: matcher.match_panel(*updown_bits_panel(build_nav_panel(frames, PATTERN_POINTS)))
+
+    if stage == "returns":
+        return lambda: [strategy._extract_return_series(df) for df in frames]
+
+    if stage == "diversify":
+        results = strategy.score_nav_panel(frames)
+        scored = [
+            {"code": code, "score": res[0]}
+            for code, res in zip(codes, results) if res is not None
+        ]
+        scored.sort(key=lambda x: x["score"], reverse=True)
+        scored = scored[:DIVERSIFY_POOL]
+        frame_of = dict(zip(codes, frames))
+        returns_map = {f["code"]: strategy._extract_return_series(frame_of[f["code"]]) for f in scored}
+
+        table = CandidateTable.from_records(scored)
+
+        def _run():
+            corr_matrix = build_corr_matrix(returns_map, table.codes,
+                                            min_overlap=strategy.DIVERSIFY_MIN_OVERLAP)
+            return strategy.select_diversified_top(table, returns_map, corr_matrix=corr_matrix)
+        return _run
+
+    if stage == "rolling":
+        weights = {
+            "ret_hold": strategy.SCORE_W_RET_HOLD,
+            "ret_20": strategy.SCORE_W_RET_20,
+            "vol_20": strategy.SCORE_W_VOL_20,
+            "mdd_20": strategy.SCORE_W_MDD_20,
+            "pos_20": strategy.SCORE_W_POS_20,
+            "ret_hold_cap": strategy.SCORE_W_RET_HOLD_CAP,
+            "bias_20": strategy.SCORE_W_BIAS_20,
+        }
+        return lambda: rolling_score_panel(nav, weights, hold_days=strategy.HOLD_DAYS)
+
+    raise ValueError(f"unknown stage: {stage}")
+
+
+def time_stage(func, repeat=3, measure_memory=True):
+    """
+    计时（取 repeat 次中的最快一次）；另跑一次 tracemalloc 统计峰值内存（MB）
+    """
+    best = float("inf")
+    for _ in range(max(1, int(repeat))):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+
+    peak_mb = None
+    if measure_memory:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return best, peak_mb
+
+
+def parse_size(text):
+    funds, days = text.lower().split("x")
+    return int(funds), int(days)
+
+
+def run_benchmarks(sizes, stages, repeat=3, measure_memory=True, seed=0):
+    results = []
+    for size in sizes:
+        n_funds, n_days = parse_size(size)
+        dates, codes, nav = make_synthetic_panel(n_funds, n_days, seed=seed)
+        frames = panel_to_frames(dates, nav, min(n_days, strategy.NAV_LOOKBACK_POINTS))
+
+        for stage in stages:
+            func = _stage_runner(stage, dates, codes, nav, frames)
+            seconds, peak_mb = time_stage(func, repeat=repeat, measure_memory=measure_memory)
+            n_items = min(n_funds, DIVERSIFY_POOL) if stage == "diversify" else n_funds
+            row = {
+                "size": size,
+                "funds": n_funds,
+                "days": n_days,
+                "stage": stage,
+                "seconds": seconds,
+                "funds_per_s": n_items / seconds if seconds > 0 else float("inf"),
+                "peak_mb": peak_mb,
+            }
+            results.append(row)
+            mem = f"{peak_mb:9.1f} MB" if peak_mb is not None else "        - "
+            print(f"{size:>12} | {stage:<12} | {seconds * 1000:10.2f} ms | {row['funds_per_s']:14,.0f} funds/s | {mem}")
+    return results
+
+
+def save_results(results, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    payload = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def compare_results(results, baseline_path):
+    """
+    与之前保存的结果对比：speedup > 1 表示本次更快
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    base = {(r["size"], r["stage"]): r for r in baseline}
+
+    print("-" * 30)
+    print(f"📈 对比基线: {baseline_path}")
+    for r in results:
+        b = base.get((r["size"], r["stage"]))
+        if b is None or not r["seconds"]:
+            continue
+        speedup = b["seconds"] / r["seconds"]
+        print(f"{r['size']:>12} | {r['stage']:<12} | {b['seconds'] * 1000:10.2f} -> {r['seconds'] * 1000:10.2f} ms | x{speedup:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="选基流程分阶段基准测试（合成数据，不联网）")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="规模列表，如 100x90 10000x2000")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="不统计峰值内存（更快）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help="与之前保存的 bench_*.json 对比")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    print(f"🚀 基准测试: sizes={args.sizes} | stages={args.stages}")
+    results = run_benchmarks(args.sizes, args.stages, repeat=args.repeat,
+                             measure_memory=not args.no_memory, seed=args.seed)
+    if not args.no_save:
+        print(f"💾 结果已保存: {save_results(results)}")
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
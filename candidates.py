@@ -0,0 +1,94 @@
+# candidates.py
+import numpy as np
+
+
+class CandidateTable:
+    """
+    候选的列式存储（struct-of-arrays）：每个字段一列，候选用整数 id（行号）引用。
+    全为浮点（或缺失）的字段存为 float64 数组，其余（名称、形态等）存为对象数组；
+    选股、相关性查表、报告都只传 id，需要完整记录（写分片文件、打印）时再用 record(i) 还原
+    """
+
+    __slots__ = ("codes", "columns", "_id_of")
+
+    def __init__(self, codes, columns=None):
+        self.codes = [str(c) for c in codes]
+        self.columns = {}
+        self._id_of = None
+        for name, values in (columns or {}).items():
+            self.columns[name] = _as_column(values, len(self.codes))
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        由 dict 记录列表构建（字段取并集，缺失的字段记为 None/NaN），id 与列表顺序一致
+        """
+        records = list(records or [])
+        fields = []
+        seen = set()
+        for record in records:
+            for key in record:
+                if key != "code" and key not in seen:
+                    seen.add(key)
+                    fields.append(key)
+        columns = {key: [record.get(key) for record in records] for key in fields}
+        return cls([record.get("code") for record in records], columns)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def id_of(self, code):
+        if self._id_of is None:
+            self._id_of = {code: i for i, code in enumerate(self.codes)}
+        return self._id_of.get(str(code))
+
+    def column(self, name):
+        values = self.columns.get(name)
+        if values is None:
+            return np.full(len(self.codes), np.nan)
+        return values
+
+    def value(self, i, name, default=None):
+        values = self.columns.get(name)
+        if values is None:
+            return default
+        value = values[i]
+        if values.dtype == float:
+            return default if np.isnan(value) else float(value)
+        return default if value is None else value
+
+    def record(self, i):
+        """
+        第 i 个候选还原为 dict（缺失字段不输出）
+        """
+        out = {"code": self.codes[i]}
+        for name in self.columns:
+            value = self.value(i, name)
+            if value is not None:
+                out[name] = value
+        return out
+
+    def records(self, ids=None):
+        ids = range(len(self.codes)) if ids is None else ids
+        return [self.record(i) for i in ids]
+
+    def order_by(self, name="score"):
+        """
+        按字段降序的 id 数组（稳定：同值保持 id 顺序；NaN 排最后）
+        """
+        values = np.asarray(self.column(name), dtype=float)
+        keys = np.where(np.isnan(values), np.inf, -values)
+        return np.argsort(keys, kind="stable")
+
+
+def _as_column(values, n):
+    if isinstance(values, np.ndarray) and values.dtype.kind == "f":
+        column = values.astype(float, copy=False)
+    elif all(v is None or (isinstance(v, float)) for v in values):
+        column = np.array([np.nan if v is None else v for v in values], dtype=float)
+    else:
+        column = np.empty(len(values), dtype=object)
+        column[:] = list(values)
+    if len(column) != n:
+        raise ValueError(f"column length {len(column)} != {n}")
+    return column
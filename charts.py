@@ -0,0 +1,171 @@
+# charts.py
+import mimetypes
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from panel_score import rolling_score_panel
+
+# ================= 配置区域 =================
+# 净值 + 策略打分图：默认无界面渲染（Agg 后端）直接写 PNG / SVG，批量出图走进程池；
+# matplotlib 只在真正画图时才导入，不画图的运行不承担它的导入开销
+
+# 1. 输出目录与格式（"png" 或 "svg"）
+CHART_DIR = os.path.join("reports", "charts")
+CHART_FORMAT = "png"
+CHART_DPI = 110
+
+# 2. 超过该点数的序列按桶降采样（每桶保留各列的最高 / 最低点，峰谷不丢）
+CHART_MAX_POINTS = 1500
+
+# 3. 批量出图的进程数（不超过 CPU 核数与图表数；1 = 本进程内逐张画）
+CHART_PROCESSES = 4
+
+# ===========================================
+
+
+def _pyplot(interactive=False):
+    """
+    延迟导入 pyplot；非交互模式先切到 Agg 后端（无显示器也能画，且不会阻塞）
+    """
+    import matplotlib
+    if not interactive:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS']
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
+
+
+def downsample(df, max_points=CHART_MAX_POINTS, columns=None):
+    """
+    长序列降采样：把行等分成若干桶，每桶保留 columns 各列最高与最低点所在的行（首尾行总是保留），
+    折线的形状与极值都不变。行数不超过 max_points 时原样返回
+    """
+    n = len(df)
+    if not max_points or n <= int(max_points):
+        return df
+    columns = list(columns) if columns is not None else list(df.columns)
+    n_buckets = max(1, int(max_points) // (2 * max(1, len(columns))))
+    size = -(-n // n_buckets)
+
+    keep = [np.array([0, n - 1])]
+    base = np.arange(n_buckets) * size
+    for col in columns:
+        values = np.full(n_buckets * size, np.nan)
+        values[:n] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+        values = values.reshape(n_buckets, size)
+        missing = np.isnan(values)
+        keep.append(base + np.where(missing, np.inf, values).argmin(axis=1))
+        keep.append(base + np.where(missing, -np.inf, values).argmax(axis=1))
+
+    rows = np.unique(np.concatenate(keep))
+    return df.iloc[rows[rows < n]]
+
+
+def score_frame(nav_df, weights, hold_days, ret_hold_soft_cap, bias_threshold, enable_bias_penalty,
+                date_col='净值日期', value_col='单位净值'):
+    """
+    净值表 -> 以日期为索引的 DataFrame(close, score)，score 为逐日滚动打分（历史不足的日期为 NaN）
+    """
+    close = pd.to_numeric(nav_df[value_col], errors='coerce').to_numpy(dtype=float)
+    result = rolling_score_panel(close, weights, hold_days=hold_days, ret_hold_soft_cap=ret_hold_soft_cap,
+                                 bias_threshold=bias_threshold, enable_bias_penalty=enable_bias_penalty)
+    return pd.DataFrame({"close": close, "score": result["score"][:, 0]},
+                        index=pd.to_datetime(nav_df[date_col]).to_numpy())
+
+
+def plot_score_chart(df, title, path=None, max_points=CHART_MAX_POINTS, dpi=CHART_DPI):
+    """
+    画净值与打分双轴图，并标出打分前 10% 的时刻；df 需含 close / score 两列（日期索引）。
+    path 为 None 时弹窗显示（阻塞，需有显示器），否则按扩展名写出 PNG / SVG 并返回路径
+    """
+    plt = _pyplot(interactive=path is None)
+
+    # 高分阈值按完整序列计算，降采样只影响折线
+    high_score_mask = df['score'] > df['score'].quantile(0.90)
+    high = df[high_score_mask]
+    line = downsample(df, max_points, columns=['close', 'score'])
+
+    fig, ax1 = plt.subplots(figsize=(12, 6))
+
+    color = 'tab:blue'
+    ax1.set_xlabel('日期')
+    ax1.set_ylabel('基金净值', color=color)
+    ax1.plot(line.index, line['close'], color=color, label='净值', alpha=0.6)
+    ax1.tick_params(axis='y', labelcolor=color)
+
+    ax2 = ax1.twinx()
+    color = 'tab:orange'
+    ax2.set_ylabel('策略打分', color=color)
+    ax2.plot(line.index, line['score'], color=color, label='打分', linewidth=1.5)
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax2.axhline(0, color='gray', linestyle='--', alpha=0.5)
+
+    ax1.scatter(high.index, high['close'], color='red', marker='^', s=50, label='高分时刻(前10%)', zorder=10)
+
+    plt.title(title)
+    fig.tight_layout()
+    if path is None:
+        plt.show()
+        return None
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+def chart_path(code, out_dir=CHART_DIR, fmt=CHART_FORMAT):
+    return os.path.join(out_dir, f"{code}.{fmt}")
+
+
+def _render_job(job):
+    code, df, title, path, max_points = job
+    try:
+        return plot_score_chart(df, title, path=path, max_points=max_points)
+    except Exception as e:
+        print(f"❌ 图表生成失败 {code}: {e}")
+        return None
+
+
+def render_charts(jobs, out_dir=CHART_DIR, fmt=CHART_FORMAT, processes=CHART_PROCESSES, max_points=CHART_MAX_POINTS):
+    """
+    批量出图：jobs 为 [(code, df, title)]，每张图写到 out_dir/<code>.<fmt>。
+    多张图时用进程池并行（每个进程各自导入 matplotlib 并使用 Agg 后端）；
+    进程用 spawn 方式启动，调用方本身是多线程时也不会 fork 出持有锁的子进程。
+    pyplot 不是线程安全的：同一进程里不要从多个线程同时调用。
+    返回与 jobs 一一对应的路径列表，失败的为 None
+    """
+    tasks = [(code, df, title, chart_path(code, out_dir, fmt), max_points) for code, df, title in jobs]
+    workers = min(int(processes or 1), os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        return [_render_job(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(_render_job, tasks))
+
+
+def attach_files(msg, paths):
+    """
+    把图表文件作为附件加到 MIMEMultipart 邮件上（图片类型直接按 image/* 附加，邮件客户端可预览）
+    """
+    from email.mime.application import MIMEApplication
+    from email.mime.image import MIMEImage
+
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        mime, _ = mimetypes.guess_type(path)
+        if mime and mime.startswith("image/"):
+            part = MIMEImage(data, _subtype=mime.split("/", 1)[1])
+        else:
+            part = MIMEApplication(data)
+        part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+        msg.attach(part)
+    return msg
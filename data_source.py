@@ -0,0 +1,217 @@
+# data_source.py
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+from governor import governed_call
+from run_metrics import call_outcome, record_call
+
+# ================= 配置区域 =================
+# 数据源模式（环境变量控制，脚本代码无需改动）:
+# - live   : 直接调用 akshare（默认）
+# - record : 调用 akshare，并把每次返回结果存到 AK_DATA_DIR
+# - replay : 只读取 AK_DATA_DIR 里录好的结果，不联网，也不需要安装 akshare
+DATA_MODE = os.environ.get("AK_DATA_MODE", "live").strip().lower()
+DATA_DIR = os.environ.get("AK_DATA_DIR", "replay_data")
+# 回放时每次调用模拟的网络延迟：数字=固定秒数；"recorded"=使用录制时测得的耗时
+REPLAY_LATENCY = os.environ.get("AK_REPLAY_LATENCY", "0").strip()
+
+MANIFEST_NAME = "manifest.json"
+
+# ===========================================
+
+
+class ReplayMissError(LookupError):
+    """
+    回放模式下找不到对应的录制结果
+    """
+
+
+_akshare = None
+_manifest_lock = threading.Lock()
+_manifest = None
+_session_lock = threading.Lock()
+_shared_adapter = None
+
+
+def _load_akshare():
+    global _akshare
+    if _akshare is None:
+        import akshare
+        _akshare = akshare
+    return _akshare
+
+
+def _call_key(func_name, args, kwargs):
+    payload = json.dumps([func_name, list(args), kwargs], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _record_path(func_name, key):
+    return os.path.join(DATA_DIR, func_name, f"{key}.pkl")
+
+
+def _load_manifest():
+    global _manifest
+    if _manifest is None:
+        path = os.path.join(DATA_DIR, MANIFEST_NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def _touch_manifest():
+    """
+    录制时记下录制日期：回放时脚本里的“今天”固定为这一天，保证结果可复现
+    """
+    with _manifest_lock:
+        manifest = _load_manifest()
+        if manifest.get("as_of"):
+            return
+        manifest["as_of"] = time.strftime("%Y-%m-%d", time.localtime())
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(os.path.join(DATA_DIR, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def as_of_date():
+    """
+    回放模式下返回录制日期（YYYY-MM-DD），其他模式返回 None
+    """
+    if DATA_MODE != "replay":
+        return None
+    return _load_manifest().get("as_of")
+
+
+def local_caches_enabled():
+    """
+    本地缓存（净值库/K线缓存/断点）只在 live 模式使用：
+    record/replay 始终走“冷启动”路径，保证录制与回放发出的调用完全一致
+    """
+    return DATA_MODE == "live"
+
+
+def enable_shared_adapter(pool_size=16):
+    """
+    让 akshare 内部 requests.get/post 每次新建的 Session 都挂上同一个 HTTPAdapter（keep-alive 连接池），
+    同一进程里的多条流水线复用 TCP/TLS 连接；Cookie/Header 仍是每次调用各自一份，互不串扰。
+    replay 模式不联网，直接跳过
+    """
+    global _shared_adapter
+    if DATA_MODE == "replay":
+        return None
+    with _session_lock:
+        if _shared_adapter is not None:
+            return _shared_adapter
+
+        from requests import sessions
+        from requests.adapters import HTTPAdapter
+
+        class _PooledAdapter(HTTPAdapter):
+            # requests.get 用完即关 Session，连接池要留给后续调用，不随之关闭
+            def close(self):
+                pass
+
+        adapter = _PooledAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        base = sessions.Session
+
+        class _PooledSession(base):
+            def __init__(self):
+                super().__init__()
+                self.mount("http://", adapter)
+                self.mount("https://", adapter)
+
+        # requests.api.request 内部是 `with sessions.Session() as session`：
+        # 只替换它新建 Session 的类，requests.get/post 本身保持原样；urllib3 连接池本身线程安全
+        sessions.Session = _PooledSession
+        _shared_adapter = adapter
+        return adapter
+
+
+def _replay_sleep(recorded_latency):
+    if REPLAY_LATENCY == "recorded":
+        delay = float(recorded_latency or 0.0)
+    else:
+        try:
+            delay = float(REPLAY_LATENCY or 0)
+        except ValueError:
+            delay = 0.0
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _timed(func_name, func, latencies=None):
+    """
+    每次实际请求（含重试中的每一次，不含限速排队）的耗时与结果类型（成功/空/异常）计入运行埋点
+    """
+    def _run(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            record_call(func_name, time.perf_counter() - started, "exception")
+            raise
+        latency = time.perf_counter() - started
+        record_call(func_name, latency, call_outcome(result))
+        if latencies is not None:
+            latencies.append(latency)
+        return result
+    return _run
+
+
+def call(func_name, *args, **kwargs):
+    """
+    按当前模式调用 akshare 的 func_name；联网调用经过按接口自适应的限速/重试/熔断
+    """
+    if DATA_MODE == "replay":
+        return _timed(func_name, _replay)(func_name, args, kwargs)
+
+    latencies = []
+    func = _timed(func_name, getattr(_load_akshare(), func_name), latencies)
+    result = governed_call(func_name, func, *args, **kwargs)
+
+    if DATA_MODE == "record":
+        _touch_manifest()
+        path = _record_path(func_name, _call_key(func_name, args, kwargs))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"result": result, "latency": latencies[-1]}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    return result
+
+
+def _replay(func_name, args, kwargs):
+    path = _record_path(func_name, _call_key(func_name, args, kwargs))
+    if not os.path.exists(path):
+        raise ReplayMissError(f"未录制: {func_name}{args}{kwargs}")
+    with open(path, "rb") as f:
+        payload = pickle.load(f)
+    _replay_sleep(payload.get("latency"))
+    return payload["result"]
+
+
+class _AkshareProxy:
+    """
+    与 akshare 模块用法一致：ak.fund_etf_spot_em() 等调用都经过 call()
+    """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def _bound(*args, **kwargs):
+            return call(name, *args, **kwargs)
+
+        _bound.__name__ = name
+        return _bound
+
+
+ak = _AkshareProxy()
@@ -0,0 +1,129 @@
+# diversify.py
+import numpy as np
+import pandas as pd
+
+
+def build_return_matrix(returns_map, codes):
+    """
+    把各基金的日收益率序列按日期对齐成 (日期, 基金) 矩阵（外连接，缺失为 NaN）；
+    没有收益率序列的基金对应整列 NaN
+    """
+    series = {}
+    for code in codes:
+        ret = returns_map.get(code)
+        if ret is not None and len(ret) > 0:
+            series[code] = ret[~ret.index.duplicated(keep='last')]
+    if not series:
+        return pd.DataFrame(index=pd.DatetimeIndex([]), columns=list(codes), dtype=float)
+    return pd.DataFrame(series).sort_index().reindex(columns=list(codes))
+
+
+def pairwise_corr_matrix(ret_matrix, min_overlap=30):
+    """
+    一次性计算两两皮尔逊相关系数（每一对只用双方都有数据的日期）；
+    重叠样本不足 min_overlap、方差为 0 或无数据时记为 1.0（保守：缺数据按高相关处理）
+    """
+    x = np.asarray(ret_matrix, dtype=float)
+    n = x.shape[1] if x.ndim == 2 else 0
+    if n == 0:
+        return np.ones((0, 0))
+
+    mask = (~np.isnan(x)).astype(float)
+    # 先按列整体去均值，降低一遍式公式的舍入误差
+    col_mean = np.divide(np.nansum(x, axis=0), mask.sum(axis=0), out=np.zeros(n), where=mask.sum(axis=0) > 0)
+    x0 = np.where(mask > 0, x - col_mean, 0.0)
+
+    overlap = mask.T @ mask
+    sum_a = x0.T @ mask              # sum_a[i, j]：在 i、j 共同日期上 i 的收益之和
+    sum_sq_a = (x0 ** 2).T @ mask
+    sum_ab = x0.T @ x0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = overlap * sum_ab - sum_a * sum_a.T
+        var_a = overlap * sum_sq_a - sum_a ** 2
+        corr = cov / np.sqrt(var_a * var_a.T)
+
+    corr = np.where((overlap >= int(min_overlap)) & np.isfinite(corr), np.clip(corr, -1.0, 1.0), 1.0)
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+def build_corr_matrix(returns_map, codes, min_overlap=30):
+    """
+    为候选代码构建对齐收益矩阵与两两相关矩阵；返回 (code -> 行号, corr)
+    """
+    codes = list(dict.fromkeys(codes))
+    ret_matrix = build_return_matrix(returns_map, codes)
+    corr = pairwise_corr_matrix(ret_matrix.to_numpy(dtype=float), min_overlap=min_overlap)
+    return {code: i for i, code in enumerate(codes)}, corr
+
+
+def max_corr_with(corr_index, corr, code, selected_codes):
+    """
+    code 与已入选组合的最大相关系数（缺数据按 1.0 处理）
+    """
+    i = corr_index.get(code)
+    cols = [corr_index[c] for c in selected_codes if c in corr_index]
+    if i is None or len(cols) < len(selected_codes):
+        return 1.0
+    if not cols:
+        return 1.0
+    return float(corr[i, cols].max())
+
+
+def max_corr_within(corr_index, corr, codes):
+    """
+    一组代码内部的最大两两相关系数（少于两只时为 0.0）
+    """
+    idx = [corr_index[c] for c in codes if c in corr_index]
+    if len(idx) < 2:
+        return 0.0
+    sub = corr[np.ix_(idx, idx)].copy()
+    np.fill_diagonal(sub, -np.inf)
+    return float(max(0.0, sub.max()))
+
+
+def corr_by_ids(corr_matrix, codes):
+    """
+    把 build_corr_matrix 的结果按 codes 顺序重排，使 corr[i, j] 直接对应第 i、j 个候选（id）；
+    不在矩阵里的代码整行记为 1.0（缺数据按 1.0 处理）
+    """
+    corr_index, corr = corr_matrix
+    rows = np.array([corr_index.get(code, -1) for code in codes], dtype=int)
+    out = np.ones((len(rows), len(rows)))
+    ok = rows >= 0
+    out[np.ix_(ok, ok)] = corr[np.ix_(rows[ok], rows[ok])]
+    np.fill_diagonal(out, 1.0)
+    return out
+
+
+def select_diversified_ids(order, corr, top_n, max_pair_corr):
+    """
+    按 order（id 从优到劣）贪心挑选，入选组合内两两相关不超过 max_pair_corr；凑不满时按 order 补齐。
+    corr 以 id 为行列号；维护“与已入选组合的最大相关”向量，每入选一只只更新一次。
+    返回 (selected_ids, rejected)，rejected 为 [(id, max_corr), ...]
+    """
+    top_n = int(top_n)
+    selected = []
+    selected_set = set()
+    rejected = []
+    max_corr = np.full(corr.shape[0], -np.inf)
+
+    for i in order:
+        if len(selected) >= top_n:
+            break
+        i = int(i)
+        if selected and max_corr[i] > float(max_pair_corr):
+            rejected.append((i, float(max_corr[i])))
+            continue
+        selected.append(i)
+        selected_set.add(i)
+        np.maximum(max_corr, corr[i], out=max_corr)
+
+    for i in order:
+        if len(selected) >= top_n:
+            break
+        if int(i) not in selected_set:
+            selected.append(int(i))
+            selected_set.add(int(i))
+    return selected, rejected
@@ -0,0 +1,280 @@
+# factor_eval.py
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import index08 as strategy
+import panel_backtest
+import run_metrics
+from panel_score import FEATURE_NAMES, rolling_score_panel
+
+# ================= 配置区域 =================
+# 横截面因子评估：每个交易日在全部标的上计算因子与未来收益的 Spearman 秩相关 (Rank IC)、
+# 分位组合收益与 IC 衰减；全部是 (日期, 标的) 矩阵上的向量化运算，不逐日 / 逐只循环
+
+# 1. 主评估周期（未来 N 个交易日收益），默认与策略持有期一致
+EVAL_HORIZON = strategy.HOLD_DAYS
+
+# 2. IC 衰减考察的周期
+DECAY_HORIZONS = tuple(range(1, 21))
+
+# 3. 分位组数（按当日因子秩等分，第 1 组因子最低）
+N_QUANTILES = 5
+
+# 4. 当日有效标的（因子与未来收益都非空）少于该数量时，该日 IC / 分位收益记为 NaN
+MIN_CROSS_SECTION = 20
+
+# ===========================================
+
+
+def forward_returns(prices, horizon):
+    """
+    (日期, 标的) 价格矩阵 -> 未来 horizon 个交易日收益 p[t+h] / p[t] - 1；最后 horizon 行为 NaN
+    """
+    prices = np.asarray(prices, dtype=float)
+    h = int(horizon)
+    fwd = np.full(prices.shape, np.nan)
+    if 0 < h < len(prices):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fwd[:-h] = prices[h:] / prices[:-h] - 1
+    return fwd
+
+
+def sort_rows(x):
+    """
+    逐行排序一次，返回 (order, first, last)：三者都是展平后的下标，order 为按行 argsort（NaN 在最后），
+    first / last 为排序后每个位置所在并列组的首 / 尾位置。之后任意子集上的排名都由它推出，不必再排序
+    """
+    x = np.asarray(x, dtype=float)
+    n_dates, n_cols = x.shape
+    # NaN 换成 +inf 再排（含 NaN 的 argsort 慢数倍）；与真实 +inf 并列无妨，排名只统计 mask 内的元素
+    key = np.where(np.isnan(x), np.inf, x)
+    row_base = (np.arange(n_dates) * n_cols)[:, None]
+    order = (np.argsort(key, axis=1) + row_base).ravel()
+    s = key.ravel().take(order).reshape(x.shape)
+
+    starts = np.ones(s.shape, dtype=bool)
+    starts[:, 1:] = s[:, 1:] != s[:, :-1]
+    ends = np.ones(s.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    pos = np.arange(n_cols)
+    first = np.maximum.accumulate(np.where(starts, pos, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, pos, n_cols - 1)[:, ::-1], axis=1)[:, ::-1]
+    return order, (first + row_base).ravel(), (last + row_base).ravel()
+
+
+def subset_ranks(sorted_rows, mask, fill=np.nan):
+    """
+    只在 mask 为真的位置上逐行排名（1 起，并列取平均秩，与 Spearman 的定义一致），其余位置为 fill。
+    排序后的位置上对 mask 做累积计数：某个并列组之前的子集元素数 + (组内子集元素数 + 1) / 2 即平均秩
+    """
+    order, first, last = sorted_rows
+    mask = np.asarray(mask, dtype=bool)
+    m = mask.ravel().take(order)
+    cum = np.cumsum(m.reshape(mask.shape), axis=1, dtype=np.int32).ravel()
+    before = cum.take(first) - m.take(first)
+    in_group = cum.take(last) - before
+
+    ranks = np.empty(mask.size)
+    ranks[order] = np.where(m, before + (in_group + 1) / 2.0, fill)
+    return ranks.reshape(mask.shape)
+
+
+def rank_rows(x):
+    """
+    逐行排名（并列取平均秩）；NaN 不参与排名、结果仍为 NaN
+    """
+    x = np.asarray(x, dtype=float)
+    if x.ndim != 2 or x.size == 0:
+        return np.full(x.shape, np.nan)
+    return subset_ranks(sort_rows(x), ~np.isnan(x))
+
+
+def rank_ic(factor, fwd, min_count=MIN_CROSS_SECTION, factor_sorted=None):
+    """
+    逐日 Spearman 秩相关：只在“因子与未来收益都有值”的位置上排名，再求两组秩的逐行 Pearson 相关。
+    factor_sorted 为 sort_rows(factor)：多个周期共用，因子不必每次重新排序。
+    返回长度 T 的数组，样本不足的日期为 NaN
+    """
+    factor = np.asarray(factor, dtype=float)
+    fwd = np.asarray(fwd, dtype=float)
+    pair = ~np.isnan(factor) & ~np.isnan(fwd)
+    if factor_sorted is None:
+        factor_sorted = sort_rows(factor)
+    # 掩码外的秩记 0，求和时自动剔除；两组秩在掩码内的均值都是 (n+1)/2
+    fr = subset_ranks(factor_sorted, pair, fill=0.0)
+    rr = subset_ranks(sort_rows(np.where(pair, fwd, np.nan)), pair, fill=0.0)
+    count = pair.sum(axis=1)
+
+    center = count * ((count + 1) / 2.0) ** 2
+    cov = np.einsum("ij,ij->i", fr, rr) - center
+    var_f = np.einsum("ij,ij->i", fr, fr) - center
+    var_r = np.einsum("ij,ij->i", rr, rr) - center
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ic = cov / np.sqrt(var_f * var_r)
+    ic[count < int(min_count)] = np.nan
+    return ic
+
+
+def ic_summary(ic, horizon=1):
+    """
+    IC 序列统计：均值、标准差、IR、t 值、IC>0 占比。
+    horizon>1 时相邻日期的未来收益区间重叠、IC 自相关，另给出每 horizon 天取一次的非重叠 t 值
+    """
+    ic = np.asarray(ic, dtype=float)
+
+    def _t(values):
+        values = values[~np.isnan(values)]
+        if len(values) < 2:
+            return float("nan")
+        std = values.std(ddof=1)
+        return float(values.mean() / std * np.sqrt(len(values))) if std > 0 else float("nan")
+
+    valid = ic[~np.isnan(ic)]
+    if len(valid) == 0:
+        return {"n": 0, "mean": float("nan"), "std": float("nan"), "ir": float("nan"),
+                "t_stat": float("nan"), "t_stat_nonoverlap": float("nan"), "hit_rate": float("nan")}
+    std = float(valid.std(ddof=1)) if len(valid) > 1 else float("nan")
+    return {
+        "n": int(len(valid)),
+        "mean": float(valid.mean()),
+        "std": std,
+        "ir": float(valid.mean() / std) if std and std > 0 else float("nan"),
+        "t_stat": _t(ic),
+        "t_stat_nonoverlap": _t(ic[::max(1, int(horizon))]),
+        "hit_rate": float((valid > 0).mean()),
+    }
+
+
+def quantile_returns(factor, fwd, n_quantiles=N_QUANTILES, min_count=MIN_CROSS_SECTION, factor_sorted=None):
+    """
+    逐日按因子秩等分成 n_quantiles 组，返回 (T, n_quantiles) 的组内平均未来收益（第 0 列因子最低）。
+    用 (日期 * 组数 + 组号) 作为扁平下标一次 bincount 求和
+    """
+    factor = np.asarray(factor, dtype=float)
+    fwd = np.asarray(fwd, dtype=float)
+    pair = ~np.isnan(factor) & ~np.isnan(fwd)
+    fr = subset_ranks(factor_sorted if factor_sorted is not None else sort_rows(factor), pair)
+    count = pair.sum(axis=1)
+    q = int(n_quantiles)
+    n_dates = fwd.shape[0]
+
+    t_idx, j_idx = np.nonzero(pair)
+    bucket = np.minimum(((fr[t_idx, j_idx] - 1) * q // count[t_idx]).astype(int), q - 1)
+    flat = t_idx * q + bucket
+    sums = np.bincount(flat, weights=fwd[t_idx, j_idx], minlength=n_dates * q).reshape(n_dates, q)
+    sizes = np.bincount(flat, minlength=n_dates * q).reshape(n_dates, q)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = sums / sizes
+    result[count < max(int(min_count), q)] = np.nan
+    return result
+
+
+def ic_decay(factor, prices, horizons=DECAY_HORIZONS, min_count=MIN_CROSS_SECTION, factor_sorted=None):
+    """
+    各周期的 IC 统计：因子只排序一次，各周期只对未来收益重新排序。返回 {horizon: ic_summary}
+    """
+    factor = np.asarray(factor, dtype=float)
+    if factor_sorted is None:
+        factor_sorted = sort_rows(factor)
+    return {
+        int(h): ic_summary(rank_ic(factor, forward_returns(prices, h), min_count, factor_sorted), h)
+        for h in horizons
+    }
+
+
+def _nanmean_columns(values):
+    sizes = (~np.isnan(values)).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nansum(values, axis=0) / sizes
+
+
+def evaluate_factor(factor, prices, horizon=EVAL_HORIZON, horizons=DECAY_HORIZONS,
+                    n_quantiles=N_QUANTILES, min_count=MIN_CROSS_SECTION):
+    """
+    完整评估：主周期的逐日 IC 与统计、分位收益（逐日与均值、多空价差）以及 IC 衰减
+    """
+    factor = np.asarray(factor, dtype=float)
+    factor_sorted = sort_rows(factor)
+    fwd = forward_returns(prices, horizon)
+    ic = rank_ic(factor, fwd, min_count, factor_sorted)
+    quantiles = quantile_returns(factor, fwd, n_quantiles, min_count, factor_sorted)
+
+    spread = quantiles[:, -1] - quantiles[:, 0]
+    spread_ok = spread[~np.isnan(spread)]
+    return {
+        "horizon": int(horizon),
+        "ic": ic,
+        "summary": ic_summary(ic, horizon),
+        "quantiles": quantiles,
+        "quantile_mean": _nanmean_columns(quantiles),
+        "spread_mean": float(spread_ok.mean()) if len(spread_ok) else float("nan"),
+        "spread_t_stat": ic_summary(spread, horizon)["t_stat_nonoverlap"],
+        "decay": ic_decay(factor, prices, horizons, min_count, factor_sorted),
+    }
+
+
+def strategy_factors(panel):
+    """
+    用 index08 的打分参数对价格面板做滚动打分，返回 {score / 各特征: (T, N) 矩阵}
+    """
+    return rolling_score_panel(
+        panel.to_numpy(dtype=float),
+        panel_backtest.strategy_weights(),
+        hold_days=strategy.HOLD_DAYS,
+        ret_hold_soft_cap=strategy.RET_HOLD_SOFT_CAP,
+        bias_threshold=strategy.BIAS_20_THRESHOLD,
+        enable_bias_penalty=strategy.ENABLE_BIAS_20_PENALTY,
+    )
+
+
+def main(factor_name="score", horizon=EVAL_HORIZON):
+    run_metrics.METRICS.reset()
+    codes = panel_backtest.UNIVERSE_CODES or panel_backtest.default_universe()
+    print(f"⏳ 正在拉取 {len(codes)} 只标的的历史数据...")
+    with run_metrics.stage("fetch"):
+        panel = panel_backtest.load_price_panel(codes)
+    if panel is None:
+        print("❌ 数据获取失败")
+        return
+
+    started = time.perf_counter()
+    with run_metrics.stage("evaluate"):
+        factor = strategy_factors(panel)[factor_name]
+        res = evaluate_factor(factor, panel.to_numpy(dtype=float), horizon=horizon)
+    s = res["summary"]
+
+    print("-" * 30)
+    print(f"📊 因子评估: {factor_name}（{panel.shape[1]} 只 x {panel.shape[0]} 天，耗时 {time.perf_counter() - started:.2f}s）")
+    print(f"{horizon} 日 Rank IC: 均值={s['mean']:.4f} | IR={s['ir']:.3f} | t={s['t_stat']:.2f}"
+          f" (非重叠 t={s['t_stat_nonoverlap']:.2f}) | IC>0 占比={s['hit_rate']:.1%} | 样本 {s['n']} 天")
+    buckets = " | ".join(f"Q{i + 1}={v:.2%}" for i, v in enumerate(res["quantile_mean"]))
+    print(f"分位平均收益（Q1 因子最低）: {buckets}")
+    print(f"多空价差 Q{N_QUANTILES}-Q1: {res['spread_mean']:.2%} (非重叠 t={res['spread_t_stat']:.2f})")
+    print("IC 衰减:")
+    for h, d in res["decay"].items():
+        print(f"  {h:>2} 日: IC={d['mean']:.4f} | t={d['t_stat_nonoverlap']:.2f}")
+
+    ic = pd.Series(res["ic"], index=panel.index.strftime("%Y-%m-%d"))
+    path = run_metrics.write_manifest("factor_eval", extra={
+        "factor": factor_name,
+        "horizon": int(horizon),
+        "summary": s,
+        "quantile_mean": [float(v) for v in res["quantile_mean"]],
+        "spread_mean": res["spread_mean"],
+        "spread_t_stat": res["spread_t_stat"],
+        "decay": {str(h): d for h, d in res["decay"].items()},
+        "ic": {k: float(v) for k, v in ic.dropna().items()},
+    })
+    print(f"📝 运行清单: {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="横截面因子评估（Rank IC / 分位收益 / IC 衰减）")
+    parser.add_argument("--factor", default="score", choices=("score",) + FEATURE_NAMES)
+    parser.add_argument("--horizon", type=int, default=EVAL_HORIZON, help="主评估周期（交易日）")
+    args = parser.parse_args()
+    main(factor_name=args.factor, horizon=args.horizon)
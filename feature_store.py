@@ -0,0 +1,387 @@
+# feature_store.py
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import run_metrics
+from panel_score import (
+    FEATURE_NAMES,
+    build_nav_panel,
+    calc_7d_score_panel,
+    combine_score,
+    features_at,
+    required_points,
+    rolling_score_panel,
+)
+
+# 特征库：(日期, 基金, 字段) 的 float64 内存映射数组，每个 (基金, 日期) 的特征只计算一次。
+# 第 t 行第 j 列 = 基金 j 用“截至日期 t 的自身净值序列”算出的特征（与实盘逐只打分口径一致）；
+# nav_last / win_hash 记录计算时的当日净值与打分窗口（最近 required_points 个净值）的内容哈希（blake2b 取 48 位，
+# float64 可精确表示），窗口内任一净值被修正（含补录的历史修正）/ 前复权价格整体调整时据此判定失效并重算
+FEATURE_DIR = os.path.join("cache", "features")
+CHECK_FIELDS = ("nav_last", "win_hash")
+HASH_BYTES = 6
+STORE_FIELDS = FEATURE_NAMES + CHECK_FIELDS
+MIN_CAPACITY = 64
+
+
+class FeatureStore:
+    """
+    目录结构：meta.json（代码、日期、参数、当前数据文件）+ values_{代次}.f64。
+    新日期一律在文件末尾追加一行（行号经日期 -> 行号映射查找，更早的日期也不必重写文件，
+    全市场扫描里净值滞后的基金不会触发整文件拷贝）；只有基金数超出容量时才写新一代文件再切换 meta，
+    中断时旧文件仍完整可用。参数（持有天数、阈值）变化时整个库作废重建。
+    单进程写：分片扫描时每个分片用自己的库名
+    """
+
+    def __init__(self, name, params, store_dir=FEATURE_DIR, readonly=False):
+        self.dir = os.path.join(store_dir, name)
+        self.params = {k: params[k] for k in sorted(params)}
+        self.readonly = readonly
+        self.fields = list(STORE_FIELDS)
+        self._load()
+
+    # ---------- 元数据 ----------
+    def _meta_path(self):
+        return os.path.join(self.dir, "meta.json")
+
+    def _values_path(self, generation):
+        return os.path.join(self.dir, f"values_{generation}.f64")
+
+    def _reset(self):
+        self.codes = []
+        self.dates = []
+        self.capacity = 0
+        self.generation = 0
+        self.values = None
+        self._col = {}
+        self._row = {}
+        self._written_state = None
+
+    def _load(self):
+        self._reset()
+        try:
+            with open(self._meta_path(), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        if meta.get("params") != self.params or meta.get("fields") != self.fields:
+            return
+
+        codes, dates = meta["codes"], meta["dates"]
+        capacity, generation = int(meta["capacity"]), int(meta["generation"])
+        path = self._values_path(generation)
+        expected = len(dates) * capacity * len(self.fields) * 8
+        if not os.path.exists(path) or os.path.getsize(path) < expected:
+            return
+
+        self.codes, self.dates = list(codes), list(dates)
+        self.capacity, self.generation = capacity, generation
+        self._col = {c: i for i, c in enumerate(self.codes)}
+        self._row = {d: i for i, d in enumerate(self.dates)}
+        self._written_state = self._meta_state()
+        self._map()
+
+    def _map(self):
+        if not self.dates or not self.capacity:
+            self.values = None
+            return
+        self.values = np.memmap(
+            self._values_path(self.generation),
+            dtype=np.float64,
+            mode="r" if self.readonly else "r+",
+            shape=(len(self.dates), self.capacity, len(self.fields)),
+        )
+
+    def _meta_state(self):
+        # codes / dates 只追加不删改，长度 + 容量 + 代次即可判断 meta 是否有变化
+        return len(self.codes), len(self.dates), self.capacity, self.generation
+
+    def _write_meta(self):
+        if self._meta_state() == self._written_state:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        meta = {
+            "params": self.params,
+            "fields": self.fields,
+            "codes": self.codes,
+            "dates": self.dates,
+            "capacity": self.capacity,
+            "generation": self.generation,
+        }
+        tmp_path = f"{self._meta_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path())
+        self._written_state = self._meta_state()
+
+    # ---------- 扩容 ----------
+    def _append_dates(self, new_dates):
+        old_rows = len(self.dates)
+        row_bytes = self.capacity * len(self.fields) * 8
+        if self.values is not None:
+            self.values.flush()
+        self.values = None
+        with open(self._values_path(self.generation), "ab") as f:
+            f.truncate((old_rows + len(new_dates)) * row_bytes)
+        self.dates.extend(new_dates)
+        self._row = {d: i for i, d in enumerate(self.dates)}
+        self._map()
+        self.values[old_rows:] = np.nan
+
+    def _rebuild(self, capacity, n_old_codes):
+        """
+        基金数超出容量时写新一代数据文件，旧数据（前 n_old_codes 列）按原行号拷贝过去
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        generation = self.generation + 1
+        new_values = np.memmap(
+            self._values_path(generation), dtype=np.float64, mode="w+",
+            shape=(len(self.dates), capacity, len(self.fields)),
+        )
+        new_values[:] = np.nan
+        if self.values is not None and n_old_codes:
+            new_values[:, :n_old_codes] = self.values[:, :n_old_codes]
+        new_values.flush()
+        del new_values
+
+        old_path = self._values_path(self.generation) if self.values is not None else None
+        self.values = None
+        self.capacity, self.generation = int(capacity), generation
+        self._write_meta()
+        if old_path and os.path.exists(old_path):
+            os.remove(old_path)
+        self._map()
+
+    def ensure(self, codes, dates):
+        """
+        确保这些代码、日期在库里有位置，返回 (codes 对应的列号数组, dates 对应的行号数组)
+        """
+        if self.readonly:
+            raise RuntimeError("feature store opened read-only")
+        codes = [str(c) for c in codes]
+        dates = [str(d) for d in dates]
+        new_codes = [c for c in dict.fromkeys(codes) if c not in self._col]
+        new_dates = sorted(set(dates) - set(self._row))
+
+        if new_codes or new_dates:
+            n_old_codes = len(self.codes)
+            need = n_old_codes + len(new_codes)
+            self.codes.extend(new_codes)
+            if need > self.capacity:
+                if not self.dates:
+                    self.dates.extend(new_dates)
+                    self._row = {d: i for i, d in enumerate(self.dates)}
+                    new_dates = []
+                self._rebuild(max(MIN_CAPACITY, 2 * need), n_old_codes)
+            if new_dates:
+                self._append_dates(new_dates)
+            self._col = {c: i for i, c in enumerate(self.codes)}
+            self._write_meta()
+
+        cols = np.array([self._col[c] for c in codes], dtype=int)
+        rows = np.array([self._row[d] for d in dates], dtype=int)
+        return cols, rows
+
+    # ---------- 读写 ----------
+    def field_index(self, name):
+        return self.fields.index(name)
+
+    def get(self, rows, cols):
+        """
+        取若干 (行, 列) 的全部字段，返回 (k, 字段数) 的拷贝
+        """
+        if self.values is None or len(rows) == 0:
+            return np.full((len(rows), len(self.fields)), np.nan)
+        return np.asarray(self.values[rows, cols])
+
+    def put(self, rows, cols, values):
+        if len(rows):
+            self.values[rows, cols] = values
+
+    def flush(self):
+        if self.values is not None and not self.readonly:
+            self.values.flush()
+
+    def view(self, start=None, end=None):
+        """
+        日期区间 [start, end] 按日期升序返回 (dates, codes, values)，values 形状为 (日期, 基金, 字段)；
+        区间内各行在文件里按日期连续存放时直接切在内存映射上（零拷贝），否则为拷贝
+        """
+        if self.values is None:
+            return [], list(self.codes), np.empty((0, len(self.codes), len(self.fields)))
+        order = np.argsort(self.dates, kind="stable")
+        sorted_dates = [self.dates[i] for i in order]
+        lo = 0 if start is None else int(np.searchsorted(sorted_dates, str(start)[:10], side="left"))
+        hi = len(sorted_dates) if end is None else int(np.searchsorted(sorted_dates, str(end)[:10], side="right"))
+        rows = order[lo:hi]
+        dates = sorted_dates[lo:hi]
+        if len(rows) == 0:
+            return dates, list(self.codes), self.values[0:0, :len(self.codes)]
+        if (np.diff(rows) == 1).all():
+            return dates, list(self.codes), self.values[rows[0]:rows[-1] + 1, :len(self.codes)]
+        # 区间内有乱序追加的行（后补入的更早日期）：按日期顺序取出（拷贝）
+        return dates, list(self.codes), np.asarray(self.values[rows, :len(self.codes)])
+
+    def take(self, dates, codes, fields):
+        """
+        按 (日期, 代码, 字段) 取出子张量，库里没有的日期 / 代码为 NaN。
+        日期是库里连续的一段、代码与库内顺序一致、字段相邻时直接返回内存映射视图（零拷贝）
+        """
+        fields_idx = [self.field_index(name) for name in fields]
+        keys = pd.DatetimeIndex(dates).strftime("%Y-%m-%d") if not isinstance(dates, (list, tuple)) else [str(d)[:10] for d in dates]
+        date_rows = np.array([self._row.get(d, -1) for d in keys], dtype=int)
+        code_cols = np.array([self._col.get(str(c), -1) for c in codes], dtype=int)
+
+        out = np.full((len(date_rows), len(code_cols), len(fields_idx)), np.nan)
+        if self.values is None or not len(date_rows) or not len(code_cols) or not fields_idx:
+            return out
+
+        contiguous = (
+            (date_rows >= 0).all() and (np.diff(date_rows) == 1).all()
+            and (code_cols == np.arange(len(code_cols))).all()
+            and fields_idx == list(range(fields_idx[0], fields_idx[0] + len(fields_idx)))
+        )
+        if contiguous:
+            return self.values[date_rows[0]:date_rows[-1] + 1, :len(code_cols), fields_idx[0]:fields_idx[-1] + 1]
+
+        ok_d = np.flatnonzero(date_rows >= 0)
+        ok_c = np.flatnonzero(code_cols >= 0)
+        if len(ok_d) and len(ok_c):
+            out[np.ix_(ok_d, ok_c)] = self.values[date_rows[ok_d]][:, code_cols[ok_c]][:, :, fields_idx]
+        return out
+
+
+def open_store(name, hold_days, ret_hold_soft_cap, bias_threshold, enable_bias_penalty, store_dir=FEATURE_DIR, readonly=False):
+    params = {
+        "hold_days": int(hold_days),
+        "ret_hold_soft_cap": float(ret_hold_soft_cap),
+        "bias_threshold": float(bias_threshold),
+        "enable_bias_penalty": bool(enable_bias_penalty),
+    }
+    return FeatureStore(name, params, store_dir=store_dir, readonly=readonly)
+
+
+def _last_dates(nav_dfs, date_col):
+    return [
+        None if df is None or len(df) == 0 else pd.Timestamp(df[date_col].iloc[-1]).strftime("%Y-%m-%d")
+        for df in nav_dfs
+    ]
+
+
+def _window_hash(window):
+    """
+    单个窗口的内容哈希；窗口不完整（含 NaN）时为 NaN（此时特征本就无效）
+    """
+    if np.isnan(window).any():
+        return np.nan
+    digest = hashlib.blake2b(np.ascontiguousarray(window, dtype=np.float64).tobytes(), digest_size=HASH_BYTES).digest()
+    return float(int.from_bytes(digest, "little"))
+
+
+def _window_checks(windows):
+    """
+    windows 为 (k, points) 的打分窗口（按日期升序，不足 points 时含 NaN），返回 (k, 2) 的校验字段 [当日净值, 窗口哈希]
+    """
+    windows = np.asarray(windows, dtype=float)
+    hashes = np.array([_window_hash(w) for w in windows], dtype=float)
+    return np.column_stack([windows[:, -1], hashes])
+
+
+def _rolling_checks(values, points):
+    """
+    整段序列每一天（截至当天的窗口）的校验字段，与 _window_checks 逐行口径一致
+    """
+    padded = np.concatenate([np.full(int(points) - 1, np.nan), np.asarray(values, dtype=float)])
+    return _window_checks(np.lib.stride_tricks.sliding_window_view(padded, int(points)))
+
+
+def _same(a, b):
+    return ((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=-1)
+
+
+def score_with_store(store, codes, nav_dfs, weights, date_col='净值日期', value_col='单位净值'):
+    """
+    与 score_nav_panel 返回相同：每只基金取其最新净值日的特征，库里已有且打分窗口未变的直接读，
+    其余一次面板计算后写回库；得分统一用 combine_score 现算（权重调整不影响库）
+    """
+    params = store.params
+    n = len(nav_dfs)
+    last_dates = _last_dates(nav_dfs, date_col)
+    present = [j for j in range(n) if last_dates[j] is not None]
+
+    result = {name: np.full(n, np.nan) for name in FEATURE_NAMES}
+    result["valid"] = np.zeros(n, dtype=bool)
+    if present:
+        cols, rows = store.ensure([codes[j] for j in present], [last_dates[j] for j in present])
+        stored = store.get(rows, cols)
+        nav = build_nav_panel([nav_dfs[j] for j in present], required_points(params["hold_days"]), value_col)
+        checks = _window_checks(nav.T)
+        check_idx = [store.field_index(name) for name in CHECK_FIELDS]
+        hit = _same(stored[:, check_idx], checks)
+
+        miss = np.flatnonzero(~hit)
+        if len(miss):
+            fresh = calc_7d_score_panel(
+                nav[:, miss],
+                weights,
+                hold_days=params["hold_days"],
+                ret_hold_soft_cap=params["ret_hold_soft_cap"],
+                bias_threshold=params["bias_threshold"],
+                enable_bias_penalty=params["enable_bias_penalty"],
+            )
+            block = np.column_stack([fresh[name] for name in FEATURE_NAMES] + [checks[miss]])
+            store.put(rows[miss], cols[miss], block)
+            stored[miss] = block
+            run_metrics.count("feature_store", "computed", len(miss))
+        run_metrics.count("feature_store", "hit", int(hit.sum()))
+        store.flush()
+
+        for i, name in enumerate(FEATURE_NAMES):
+            result[name][present] = stored[:, i]
+        result["valid"][present] = ~np.isnan(stored[:, :len(FEATURE_NAMES)]).any(axis=1)
+
+    result["score"] = np.full(n, np.nan)
+    valid = result["valid"]
+    if valid.any():
+        result["score"][valid] = combine_score({name: result[name][valid] for name in FEATURE_NAMES}, weights)
+    return [features_at(result, j) for j in range(n)]
+
+
+def backfill(store, codes, series_list, weights):
+    """
+    用各基金完整的净值序列回填全部历史日期（回测 / 权重扫描用）；
+    series_list 的元素为按日期升序、日期索引的净值 Series（None 跳过；中间的 NaN 视为缺口，含缺口的窗口特征为 NaN）。
+    已有且打分窗口校验一致的行不重算，整只基金都命中时跳过计算。返回新计算的 (基金, 日期) 数
+    """
+    params = store.params
+    computed = 0
+    for code, series in zip(codes, series_list):
+        if series is None or len(series) == 0:
+            continue
+        dates = pd.DatetimeIndex(series.index).strftime("%Y-%m-%d").tolist()
+        values = series.to_numpy(dtype=float)
+        cols, rows = store.ensure([code] * len(dates), dates)
+        checks = _rolling_checks(values, required_points(params["hold_days"]))
+        check_idx = [store.field_index(name) for name in CHECK_FIELDS]
+        todo = ~_same(store.get(rows, cols)[:, check_idx], checks)
+        if not todo.any():
+            continue
+
+        result = rolling_score_panel(
+            values[:, None],
+            weights,
+            hold_days=params["hold_days"],
+            ret_hold_soft_cap=params["ret_hold_soft_cap"],
+            bias_threshold=params["bias_threshold"],
+            enable_bias_penalty=params["enable_bias_penalty"],
+        )
+        block = np.column_stack([result[name][:, 0] for name in FEATURE_NAMES] + [checks])
+        store.put(rows[todo], cols[todo], block[todo])
+        computed += int(todo.sum())
+    store.flush()
+    return computed
+
@@ -0,0 +1,63 @@
+# fetch_pool.py
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """
+    全局限速器：所有线程共享同一个“每秒请求数”预算（按固定间隔发放令牌）
+    rps <= 0 表示不限速
+    """
+
+    def __init__(self, rps):
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+        self.set_rps(rps)
+
+    def set_rps(self, rps):
+        self.interval = 1.0 / float(rps) if rps and float(rps) > 0 else 0.0
+
+    def acquire(self):
+        if self.interval <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.interval
+
+        wait = start_at - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def fetch_many(fetch_func, items, max_workers=8, rps=None):
+    """
+    并发拉取：线程池执行 fetch_func(item)；rps 为固定的全局限速（None = 不额外限速，
+    由 data_source 里按接口自适应的 governor 控制节奏）；
+    结果按 items 原顺序返回，单个任务异常时对应位置返回 None
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    limiter = RateLimiter(rps)
+
+    def _task(item):
+        limiter.acquire()
+        try:
+            return fetch_func(item)
+        except Exception:
+            return None
+
+    # 工作线程沿用调用方的 contextvars（如 run_metrics 的埋点作用域）；每个任务一份副本，可并发进入
+    parent = contextvars.copy_context()
+
+    def _run_in_context(item):
+        return parent.copy().run(_task, item)
+
+    workers = max(1, min(int(max_workers), len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_in_context, items))
@@ -0,0 +1,176 @@
+# governor.py
+import random
+import threading
+import time
+
+import run_metrics
+from fetch_pool import RateLimiter
+
+# ================= 配置区域 =================
+# 每个接口一个“请求调度器”：按观测到的延迟/错误自适应调整请求速率（AIMD），
+# 可重试错误做带抖动的指数退避重试，连续失败时熔断、冷却期内直接快速失败
+
+# 1. 速率（每秒请求数）：从 START_RPS 起步，在 [MIN_RPS, MAX_RPS] 内自适应
+START_RPS = 5.0
+MIN_RPS = 0.5
+MAX_RPS = 20.0
+
+# 2. AIMD：延迟正常时每秒约加 INCREASE_STEP；变慢时乘 SLOW_FACTOR，出错时乘 ERROR_FACTOR
+TARGET_LATENCY_SEC = 2.0
+INCREASE_STEP = 0.5
+SLOW_FACTOR = 0.8
+ERROR_FACTOR = 0.5
+
+# 3. 重试：只重试网络/解析类错误（限流时东财常返回非 JSON），退避 = min(上限, 基数 * 2^n) * 抖动
+MAX_RETRIES = 3
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 10.0
+RETRYABLE_ERRORS = (OSError, ValueError)
+
+# 4. 熔断：连续 BREAKER_FAILURES 次可重试错误后熔断 BREAKER_COOLDOWN_SEC 秒，之后放一个请求试探
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN_SEC = 30.0
+
+# ===========================================
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    接口处于熔断状态，请求被直接拒绝
+    """
+
+
+class EndpointGovernor:
+    """
+    单个接口的自适应限速 + 重试 + 熔断（线程安全）
+    """
+
+    def __init__(self, name, start_rps=START_RPS, min_rps=MIN_RPS, max_rps=MAX_RPS):
+        self.name = name
+        self.min_rps = float(min_rps)
+        self.max_rps = float(max_rps)
+        self.rps = min(max(float(start_rps), self.min_rps), self.max_rps)
+        self._limiter = RateLimiter(self.rps)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    def _set_rps(self, rps):
+        self.rps = min(max(rps, self.min_rps), self.max_rps)
+        self._limiter.set_rps(self.rps)
+        run_metrics.set_gauge("rate_rps", self.name, round(self.rps, 3))
+
+    def _before_call(self):
+        """
+        熔断检查：冷却期内快速失败；冷却结束后只放行一个试探请求
+        """
+        with self._lock:
+            if self._failures < BREAKER_FAILURES:
+                return
+            if time.monotonic() < self._open_until or self._probing:
+                run_metrics.count("governor", "fail_fast")
+                raise CircuitOpenError(f"{self.name} 熔断中")
+            self._probing = True
+
+    def _on_success(self, latency):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if latency > TARGET_LATENCY_SEC:
+                self._set_rps(self.rps * SLOW_FACTOR)
+            else:
+                # 每次成功加 step/rps，折合每秒约加 step（与请求频率无关）
+                self._set_rps(self.rps + INCREASE_STEP / max(self.rps, 1.0))
+
+    def _on_data_error(self):
+        """
+        数据类错误说明接口已正常应答：结束试探并关闭熔断，但不调整速率
+        """
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+
+    def _on_error(self, exc):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            self._set_rps(self.rps * ERROR_FACTOR)
+            if self._failures >= BREAKER_FAILURES:
+                self._open_until = time.monotonic() + BREAKER_COOLDOWN_SEC
+                run_metrics.count("governor", "breaker_open")
+                print(f"⚠️ {self.name} 连续失败 {self._failures} 次，熔断 {BREAKER_COOLDOWN_SEC:.0f}s: {exc!r}")
+
+    def call(self, func, *args, **kwargs):
+        """
+        限速执行 func；可重试错误按指数退避重试，仍失败则抛出最后一次异常
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self._before_call()
+            self._limiter.acquire()
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                self._on_error(e)
+                run_metrics.count("errors", f"{self.name}:{type(e).__name__}")
+                if attempt >= MAX_RETRIES:
+                    raise
+                run_metrics.count("governor", "retry")
+                delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt))
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                continue
+            except Exception as e:
+                # 数据类错误（字段缺失等）不是限流信号：不重试、不计入熔断
+                self._on_data_error()
+                run_metrics.count("errors", f"{self.name}:{type(e).__name__}")
+                raise
+            self._on_success(time.perf_counter() - started)
+            return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "rps": round(self.rps, 3),
+                "failures": self._failures,
+                "open": self._failures >= BREAKER_FAILURES and time.monotonic() < self._open_until,
+            }
+
+
+_registry_lock = threading.Lock()
+_governors = {}
+_rate_share = 1.0
+
+
+def set_rate_share(fraction):
+    """
+    多进程分片时每个进程只占总速率的 fraction（在创建调度器之前调用）
+    """
+    global _rate_share
+    _rate_share = max(0.0, float(fraction)) or 1.0
+    with _registry_lock:
+        _governors.clear()
+
+
+def governor_for(name):
+    with _registry_lock:
+        gov = _governors.get(name)
+        if gov is None:
+            gov = EndpointGovernor(
+                name,
+                start_rps=START_RPS * _rate_share,
+                min_rps=MIN_RPS * _rate_share,
+                max_rps=MAX_RPS * _rate_share,
+            )
+            _governors[name] = gov
+        return gov
+
+
+def governed_call(name, func, *args, **kwargs):
+    return governor_for(name).call(func, *args, **kwargs)
+
+
+def snapshot():
+    with _registry_lock:
+        governors = list(_governors.values())
+    return {gov.name: gov.snapshot() for gov in governors}
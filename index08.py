@@ -1,14 +1,32 @@
 # index.py
-import akshare as ak
+from data_source import ak, local_caches_enabled
+import argparse
 import sys
 import time
 import json
 import pandas as pd
 import smtplib
 import os
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
 
+from candidates import CandidateTable
+from charts import CHART_DIR, attach_files, render_charts, score_frame
+from diversify import build_corr_matrix, corr_by_ids, max_corr_within, select_diversified_ids
+from fetch_pool import fetch_many
+from governor import CircuitOpenError, set_rate_share
+import run_metrics
+from panel_score import build_nav_panel, calc_7d_score_panel, features_at, required_points
+from feature_store import open_store, score_with_store
+from nav_store import load_history, save_history, rows_after, append_rows, today_str
+from share_class import dedup_share_classes
+from scan_checkpoint import checkpoint_path, prune_checkpoints, iter_checkpoint, append_records, series_to_json, series_from_json
+from trade_calendar import trading_days_before
+from topk import TopK
+from updown_pattern import PATTERN_POINTS, PatternMatcher, decode_pattern, updown_bits_panel
+from shard import split_by_shard, parse_shard_arg, partial_path, save_partial, load_partials, merge_partials, run_sharded
+
 # ================= 配置区域 =================
 
 # 1. 扫描数量（候选池大小：先从榜单取前 N 个，再对这批做“7天策略打分”）
@@ -17,6 +35,7 @@ TOP_COUNT = 150
 # 2. 目标形态 (0=跌, 1=涨，左侧为最新日期)
 # 1001 或 100111 (黄金 N 字底)
 TARGET_PATTERN = "101111" 
+# 也可以填多个形态，任一匹配即可（整批一次位运算匹配），如 ["1001", "101111", "00011111"]
 
 # 3. 是否开启热门排序功能
 ENABLE_HOT_SORT = True
@@ -24,8 +43,9 @@ ENABLE_HOT_SORT = True
 # 4. 排序标准
 SORT_KEY = "近6月"
 
-# 5. 是否开启去重
+# 5. 是否开启去重（同一基金的 A/C/E/D/I 等份额、联接基金与其目标 ETF 只保留一个）
 ENABLE_DEDUPLICATE = True
+DEDUP_CLASS_PRIORITY = "C"  # 份额优先级，靠前的优先保留（如 "CEA"）；未列出的按榜单先后
 
 # 6. 7天策略参数（Confirmed via 寸止）
 # - 目标口径：未来 7 日收益 > 0%（无法保证，只能用历史规律与近况做打分筛选）
@@ -79,38 +99,125 @@ DIVERSIFY_MAX_PAIR_CORR = 0.85
 # 计算相关性时最少需要的重叠样本数；不足则视为高度相关（保守处理）
 DIVERSIFY_MIN_OVERLAP = 30
 
+# 15. 并发拉取（替代逐只 sleep 的串行扫描）
+# 线程池并发数；请求节奏由 governor.py 按接口延迟/错误率自适应控制（含退避重试与熔断）
+# FETCH_RPS 为额外的固定限速上限（None = 不设，完全自适应）
+FETCH_MAX_WORKERS = 8
+FETCH_RPS = None
+
+# 16. 本地净值历史库（每只基金一个文件，按净值日期增量追加）
+# 开启后：先读本地，联网只合并“最后入库日期之后”的新净值；当天已更新过则完全不联网
+ENABLE_NAV_STORE = True
+NAV_STORE_DIR = os.path.join("cache", "nav")
+
+# 17. 断点续跑（分批扫描，每批完成即追加写入当天的断点文件）
+# 中途失败后同一天重跑：已完成的基金直接读断点结果，只扫描剩余部分
+ENABLE_CHECKPOINT = True
+SCAN_BATCH_SIZE = 50
+
+# 18. 扫描范围
+# "top"  = 按 SORT_KEY 榜单预筛，只扫描前 TOP_COUNT 只（最快）
+# "full" = 全市场：去重后的全部基金都打分（仍按 SORT_KEY 排序，预算不够时先扫排名靠前的）
+SCAN_MODE = "top"
+# 扫描时间预算（秒，0=不限）：超时后不再发起新批次，剩余基金计入“超时跳过”
+SCAN_TIME_BUDGET_SEC = 40 * 60
+# 扫描时只保留得分最高的 N 个候选（有界堆，分散化也只在这 N 个里做），
+# 全市场模式下内存与排序开销不随基金数增长
+CANDIDATE_POOL_SIZE = OUTPUT_TOP_N * 10
+
+# 19. 分片扫描（候选按代码哈希稳定分片，分片结果合并后再统一做分散化 TopN）
+# SCAN_PROCESSES > 1：本进程内用进程池并行扫描各分片
+# 也可以拆成多个独立任务：python index08.py --shard 0/4 ... --shard 3/4，最后 python index08.py --merge 4
+# 每个分片进程的自适应速率区间按分片数等分，总请求速率不变
+SCAN_PROCESSES = 1
+
+# 20. 特征库（每只基金每个净值日的打分特征只计算一次，按日追加进内存映射文件，回测 / 权重扫描可直接切片读取）
+# 打分窗口（最近 21 个净值）内任一净值与入库时不一致（按窗口内容哈希比对，含历史净值修正）会自动重算；权重调整不影响库，持有天数 / 阈值调整会整库重建
+ENABLE_FEATURE_STORE = True
+
+# 21. 邮件图表包（每只入选基金一张“净值 + 逐日打分”图，作为附件随日报发送）
+# 无界面渲染（Agg 后端，matplotlib 只在出图时导入），多张图用进程池并行；图片写到 reports/charts/<日期>/index08/
+ENABLE_CHART_PACK = False
+# 图上展示的净值点数（本地净值库命中时不额外联网）
+CHART_PACK_POINTS = 250
+
 # ===========================================
 
-def fetch_fund_nav_df(code, lookback_points=NAV_LOOKBACK_POINTS):
+def _clean_nav_rows(df):
     """
-    拉取基金净值走势数据，并做基础清洗（日期升序、净值转数值）
+    基础清洗：只保留 净值日期/单位净值，日期升序、净值转数值
     """
-    try:
-        df = ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势")
-        if df is None or len(df) == 0:
-            return None
+    df = df[['净值日期', '单位净值']].copy()
+    df['净值日期'] = pd.to_datetime(df['净值日期'], errors='coerce')
+    df = df.dropna(subset=['净值日期']).sort_values('净值日期')
+    df['单位净值'] = pd.to_numeric(df['单位净值'], errors='coerce')
+    return df.dropna(subset=['单位净值'])
 
-        df = df.tail(lookback_points).copy()
 
-        if '净值日期' in df.columns:
-            df['净值日期'] = pd.to_datetime(df['净值日期'], errors='coerce')
-            df = df.dropna(subset=['净值日期']).sort_values('净值日期')
+def _store_is_fresh(stored, fetched_on):
+    """
+    本地库是否已是最新：今天补齐过，或已包含上一交易日的净值（盘中运行时当天净值尚未公布）
+    """
+    if fetched_on == today_str():
+        return True
+    if len(stored) == 0:
+        return False
+    prev_trade_day = trading_days_before(today_str(), 1)
+    return prev_trade_day is not None and stored['净值日期'].iloc[-1] >= prev_trade_day
 
-        if '单位净值' in df.columns:
-            df['单位净值'] = pd.to_numeric(df['单位净值'], errors='coerce')
-            df = df.dropna(subset=['单位净值'])
 
+def fetch_fund_nav_df(code, lookback_points=NAV_LOOKBACK_POINTS):
+    """
+    拉取基金净值走势数据，并做基础清洗（日期升序、净值转数值）
+    开启本地库时：只解析并追加新日期，回看窗口从本地历史中截取
+    """
+    try:
+        use_store = ENABLE_NAV_STORE and local_caches_enabled()
+        stored, fetched_on = None, None
+        if use_store:
+            stored, fetched_on = load_history(code, NAV_STORE_DIR)
+
+        if stored is not None and _store_is_fresh(stored, fetched_on):
+            # 今天已经补齐过 / 已有上一交易日净值，直接用本地数据
+            history = stored
+            run_metrics.count("fetch_nav", "store_hit")
+        else:
+            df = ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势")
+            if df is None or len(df) == 0:
+                run_metrics.count("fetch_nav", "empty")
+                return None
+
+            if stored is not None and len(stored) > 0:
+                new_rows = _clean_nav_rows(rows_after(df, '净值日期', stored['净值日期'].iloc[-1]))
+                history = append_rows(stored, new_rows, '净值日期')
+            elif use_store:
+                history = _clean_nav_rows(df)
+            else:
+                history = _clean_nav_rows(df.tail(lookback_points))
+
+            if use_store:
+                save_history(code, history, NAV_STORE_DIR)
+
+        df = history.tail(lookback_points)
         if len(df) < max(HOLD_DAYS + 1, 21):
+            run_metrics.count("fetch_nav", "insufficient")
             return None
 
+        run_metrics.count("fetch_nav", "success")
         return df.reset_index(drop=True)
+    except CircuitOpenError:
+        run_metrics.count("fetch_nav", "circuit_open")
+        return None
     except Exception:
+        # 具体异常类型已由 governor 计入 errors 计数
+        run_metrics.count("fetch_nav", "exception")
         return None
 
 
 def calc_updown_pattern(fund_df, points=20):
     """
     生成涨跌形态字符串（0=跌, 1=涨，左侧为最新日期）
+    逐只计算的参考实现；扫描时用 pattern_bits_panel 整批计算位编码
     """
     try:
         if fund_df is None or len(fund_df) < points:
@@ -125,6 +232,14 @@ def calc_updown_pattern(fund_df, points=20):
         return None
 
 
+def pattern_bits_panel(nav_dfs, points=PATTERN_POINTS):
+    """
+    整批计算涨跌形态位编码：返回列表，第 j 项为 int（与 calc_updown_pattern(nav_dfs[j]) 逐位对应）或 None
+    """
+    bits, valid = updown_bits_panel(build_nav_panel(nav_dfs, points), points)
+    return [int(b) if v else None for b, v in zip(bits, valid)]
+
+
 def calc_7d_score(fund_df, hold_days=HOLD_DAYS):
     """
     规则打分：用近期动量 + 趋势 + 波动/回撤控制，近似筛“未来7天更可能上涨”的候选。
@@ -179,6 +294,49 @@ def calc_7d_score(fund_df, hold_days=HOLD_DAYS):
     return float(score), features
 
 
+def open_feature_store(name):
+    """
+    打开（或新建）特征库；库参数与当前的持有天数 / 阈值不一致时自动作废重建
+    """
+    return open_store(name, HOLD_DAYS, RET_HOLD_SOFT_CAP, BIAS_20_THRESHOLD, ENABLE_BIAS_20_PENALTY)
+
+
+def score_weights():
+    """
+    当前打分权重（键为 panel_score.WEIGHT_KEYS）
+    """
+    return {
+        "ret_hold": SCORE_W_RET_HOLD,
+        "ret_20": SCORE_W_RET_20,
+        "vol_20": SCORE_W_VOL_20,
+        "mdd_20": SCORE_W_MDD_20,
+        "pos_20": SCORE_W_POS_20,
+        "ret_hold_cap": SCORE_W_RET_HOLD_CAP,
+        "bias_20": SCORE_W_BIAS_20,
+    }
+
+
+def score_nav_panel(nav_dfs, hold_days=HOLD_DAYS, codes=None, store=None):
+    """
+    面板打分：一批净值 DataFrame 一次性打分；返回列表，第 j 项与 calc_7d_score(nav_dfs[j]) 一致。
+    传入特征库 store（与 codes 对应）时已入库的特征直接读取，只计算新增的
+    """
+    weights = score_weights()
+    if store is not None:
+        return score_with_store(store, codes, nav_dfs, weights)
+
+    nav = build_nav_panel(nav_dfs, required_points(hold_days))
+    result = calc_7d_score_panel(
+        nav,
+        weights,
+        hold_days=hold_days,
+        ret_hold_soft_cap=RET_HOLD_SOFT_CAP,
+        bias_threshold=BIAS_20_THRESHOLD,
+        enable_bias_penalty=ENABLE_BIAS_20_PENALTY,
+    )
+    return [features_at(result, j) for j in range(len(nav_dfs))]
+
+
 def _extract_return_series(fund_df, lookback_days=DIVERSIFY_LOOKBACK_DAYS):
     """
     将净值序列转换为日收益率序列（按净值日期对齐），用于相关性分散
@@ -202,62 +360,194 @@ def _extract_return_series(fund_df, lookback_days=DIVERSIFY_LOOKBACK_DAYS):
     return ret
 
 
-def _pair_corr(ret_a, ret_b, min_overlap=DIVERSIFY_MIN_OVERLAP):
+def select_diversified_top(table, returns_map, top_n=OUTPUT_TOP_N, max_pair_corr=DIVERSIFY_MAX_PAIR_CORR, corr_matrix=None, ids=None):
     """
-    计算两只基金收益率的皮尔逊相关系数；重叠样本不足则返回 1.0（保守）
+    相关性分散：按 score 从高到低贪心挑选，控制入选组合内的最大两两相关系数。
+    table 为 CandidateTable，ids 为参与挑选的候选（默认全部，按 score 降序）；
+    corr_matrix 为 build_corr_matrix 的结果 (code -> 行号, corr)，不传则按 returns_map 现算一次。
+    返回 (selected_ids, rejected)，rejected 为 [(id, max_corr), ...]
     """
-    if ret_a is None or ret_b is None:
-        return 1.0
-
-    aligned = pd.concat([ret_a, ret_b], axis=1, join='inner').dropna()
-    if len(aligned) < int(min_overlap):
-        return 1.0
+    if not len(table):
+        return [], []
 
-    corr = float(aligned.iloc[:, 0].corr(aligned.iloc[:, 1]))
-    if pd.isna(corr):
-        return 1.0
-    return corr
+    order = table.order_by("score") if ids is None else ids
+    if corr_matrix is None:
+        corr_matrix = build_corr_matrix(
+            returns_map, [table.codes[i] for i in order], min_overlap=DIVERSIFY_MIN_OVERLAP
+        )
+    return select_diversified_ids(order, corr_by_ids(corr_matrix, table.codes), top_n, max_pair_corr)
 
 
-def select_diversified_top(scored_funds, returns_map, top_n=OUTPUT_TOP_N, max_pair_corr=DIVERSIFY_MAX_PAIR_CORR):
+def _build_scan_record(index, code, name, fund_df, score_result, pattern_bits=None):
     """
-    相关性分散：按 score 从高到低贪心挑选，控制入选组合内的最大两两相关系数
+    单只基金的扫描结果（即断点记录）：status 为 scored / filtered / insufficient
     """
-    if not scored_funds:
-        return [], []
+    if score_result is None:
+        return {"code": code, "status": "insufficient"}
+
+    score, features = score_result
+    if FILTER_RET_HOLD_POSITIVE and float(features.get("ret_hold", 0.0)) <= 0.0:
+        return {"code": code, "status": "filtered"}
+
+    fund_data = {
+        "code": code,
+        "name": name,
+        "score": round(score, 6),
+        **features,
+    }
+    if pattern_bits is not None:
+        fund_data["pattern_bits"] = pattern_bits
+        fund_data["pattern"] = decode_pattern(pattern_bits, PATTERN_POINTS - 1)
 
-    ordered = sorted(scored_funds, key=lambda x: x.get("score", float("-inf")), reverse=True)
-    selected = []
-    rejected = []
+    if ENABLE_HOT_SORT:
+        fund_data["hot_rank"] = f"{SORT_KEY}第{index+1}名"
 
-    for f in ordered:
-        if len(selected) >= int(top_n):
+    record = {"code": code, "status": "scored", "fund": fund_data}
+    if ENABLE_DIVERSIFY:
+        record["returns"] = series_to_json(_extract_return_series(fund_df))
+    return record
+
+
+def _iter_scan_records(rows, coverage, time_budget=SCAN_TIME_BUDGET_SEC, rps=FETCH_RPS, ckpt_name="index08"):
+    """
+    生成器：逐条吐出 (position, record)。先是当天断点里已完成的记录，
+    再分批 并发拉取 -> 面板打分，每批写入断点后逐条吐出；超出 time_budget 秒后不再发起新批次
+    """
+    started = time.monotonic()
+    position = {code: pos for pos, (_, code, _) in enumerate(rows)}
+    done_codes = set()
+
+    ckpt_path = None
+    if ENABLE_CHECKPOINT and local_caches_enabled():
+        ckpt_path = checkpoint_path(ckpt_name)
+        prune_checkpoints(ckpt_name, ckpt_path)
+        for record in iter_checkpoint(ckpt_path):
+            code = str(record["code"])
+            if code in position and code not in done_codes:
+                done_codes.add(code)
+                yield position[code], record
+        coverage["resumed"] = len(done_codes)
+        if done_codes:
+            print(f"♻️ 断点续跑：今日已完成 {len(done_codes)} 只，跳过。")
+
+    store = open_feature_store(ckpt_name) if ENABLE_FEATURE_STORE and local_caches_enabled() else None
+
+    pending = [(pos, row) for pos, row in enumerate(rows) if row[1] not in done_codes]
+    batch_size = max(1, int(SCAN_BATCH_SIZE))
+    for start in range(0, len(pending), batch_size):
+        if time_budget and time.monotonic() - started > float(time_budget):
+            coverage["skipped"] = len(pending) - start
+            print(f"⏰ 扫描超出时间预算 {time_budget}s，剩余 {coverage['skipped']} 只跳过。")
             break
 
-        if not selected:
-            selected.append(f)
+        batch = pending[start:start + batch_size]
+
+        # 并发拉取净值（全局限速，结果与 batch 顺序一致）
+        with run_metrics.stage("fetch"):
+            nav_dfs = fetch_many(fetch_fund_nav_df, [row[1] for _, row in batch], max_workers=FETCH_MAX_WORKERS, rps=rps)
+        with run_metrics.stage("score"):
+            score_results = score_nav_panel(nav_dfs, codes=[row[1] for _, row in batch], store=store)
+            pattern_bits = pattern_bits_panel(nav_dfs)
+
+        records = []
+        for (pos, (index, code, name)), fund_df, score_result, bits in zip(batch, nav_dfs, score_results, pattern_bits):
+            # 拉取失败不写断点，重跑时重试
+            if fund_df is None:
+                coverage["failed"] += 1
+                continue
+            record = _build_scan_record(index, code, name, fund_df, score_result, bits)
+            if record["status"] == "scored":
+                # 打印过程日志
+                print(json.dumps(record["fund"], ensure_ascii=False))
+            records.append((pos, record))
+
+        if ckpt_path:
+            append_records(ckpt_path, [record for _, record in records])
+        yield from records
+
+
+def scan_funds(top_funds, time_budget=SCAN_TIME_BUDGET_SEC, rps=FETCH_RPS, ckpt_name="index08"):
+    """
+    流式扫描候选池：拉取 -> 打分 -> 过滤 逐条进入容量为 CANDIDATE_POOL_SIZE 的有界堆，
+    收益率序列只为堆内成员解析保留，内存与最终排序开销不随扫描数量增长。
+    返回 (table, returns_map, coverage)，table 为 CandidateTable，id 按 score 降序（同分按 top_funds 顺序）
+    """
+    rows = [(index, str(row['基金代码']), row['基金简称']) for index, row in top_funds.iterrows()]
+    coverage = {"planned": len(rows), "resumed": 0, "failed": 0, "skipped": 0, "scored": 0, "filtered": 0, "insufficient": 0}
+    heap = TopK(CANDIDATE_POOL_SIZE)
+    matcher = PatternMatcher(TARGET_PATTERN) if ENABLE_PATTERN_FILTER else None
+
+    for pos, record in _iter_scan_records(rows, coverage, time_budget=time_budget, rps=rps, ckpt_name=ckpt_name):
+        status = record.get("status")
+        coverage[status] = coverage.get(status, 0) + 1
+        if status != "scored":
             continue
 
-        corr_list = [
-            _pair_corr(returns_map.get(f.get("code")), returns_map.get(s.get("code")))
-            for s in selected
-        ]
-        max_corr = max(corr_list) if corr_list else 1.0
+        fund = record["fund"]
+        if matcher is not None and not matcher.match(fund.get("pattern_bits")):
+            continue
+        if heap.accepts(fund["score"], pos):
+            returns = series_from_json(record.get("returns")) if ENABLE_DIVERSIFY else None
+            heap.push(fund["score"], pos, fund, returns)
 
-        if max_corr <= float(max_pair_corr):
-            selected.append(f)
-        else:
-            rejected.append((f, max_corr))
+    scored_funds = []
+    returns_map = {}
+    for fund, returns in heap.sorted_items():
+        scored_funds.append(fund)
+        if ENABLE_DIVERSIFY:
+            returns_map[fund["code"]] = returns
+    return CandidateTable.from_records(scored_funds), returns_map, coverage
 
-    # 若阈值太严格导致凑不满，则按 score 补齐（并记录原因）
-    if len(selected) < int(top_n):
-        remaining = [f for f in ordered if f not in selected]
-        for f in remaining:
-            if len(selected) >= int(top_n):
-                break
-            selected.append(f)
 
-    return selected, rejected
+def _scan_shard(shard_df, index, n_shards, fresh_metrics=True):
+    """
+    扫描第 index 个分片（进程池 worker / --shard 模式共用），断点文件按分片独立；
+    返回 dict(scored_funds, returns, coverage, metrics)。
+    fresh_metrics=True 时先清空本进程的埋点，只回传本分片的数据
+    """
+    if fresh_metrics:
+        run_metrics.METRICS.reset()
+    set_rate_share(1.0 / n_shards)
+    table, returns_map, coverage = scan_funds(
+        shard_df, rps=FETCH_RPS / n_shards if FETCH_RPS else None, ckpt_name=f"index08_s{index}of{n_shards}"
+    )
+    return {
+        "scored_funds": table.records(),
+        "returns": returns_map,
+        "coverage": coverage,
+        "metrics": run_metrics.METRICS.export(),
+    }
+
+
+def scan_funds_sharded(top_funds, n_shards):
+    """
+    进程池分片扫描：按代码哈希拆成 n_shards 片并行扫描，合并结果（顺序与 top_funds 一致）
+    """
+    shards = split_by_shard(top_funds, '基金代码', n_shards)
+    print(f"🧩 分片扫描: {n_shards} 个进程，各分片 {[len(df) for df in shards]} 只")
+    partials = run_sharded(_scan_shard, [(df, i, n_shards) for i, df in enumerate(shards)], processes=n_shards)
+    for part in partials:
+        run_metrics.METRICS.merge(part["metrics"])
+    scored_funds, returns_map, coverage = merge_partials(partials, order_codes=top_funds['基金代码'].astype(str))
+    return CandidateTable.from_records(scored_funds), returns_map, coverage
+
+
+def load_shard_results(top_funds, n_shards, log):
+    """
+    --merge 模式：读取当天 n_shards 个分片文件并合并；缺失分片的候选计入“超时跳过”
+    """
+    partials, missing = load_partials("index08", n_shards)
+    for part in partials:
+        run_metrics.METRICS.merge(part.get("metrics"))
+    scored_funds, returns_map, coverage = merge_partials(partials, order_codes=top_funds['基金代码'].astype(str))
+    if missing:
+        shards = split_by_shard(top_funds, '基金代码', n_shards)
+        log(f"⚠️ 分片结果缺失: {missing}（共 {sum(len(shards[i]) for i in missing)} 只未参与本次选股）")
+        coverage["skipped"] = coverage.get("skipped", 0) + sum(len(shards[i]) for i in missing)
+    for key in ("planned", "resumed", "failed", "skipped", "scored", "filtered", "insufficient"):
+        coverage.setdefault(key, 0)
+    coverage["planned"] = len(top_funds)
+    return CandidateTable.from_records(scored_funds), returns_map, coverage
 
 
 def get_market_regime():
@@ -299,9 +589,78 @@ def get_market_regime():
     except Exception:
         return None
 
-def send_email(content):
+def load_candidate_pool():
+    """
+    获取开放式基金榜单 -> 同名份额去重 -> 热门排序，返回候选池（SCAN_MODE=full 时为全市场）
+    """
+    with run_metrics.stage("rank"):
+        rank_df = ak.fund_open_fund_rank_em(symbol="全部")
+    if ENABLE_HOT_SORT:
+        rank_df[SORT_KEY] = pd.to_numeric(rank_df[SORT_KEY], errors='coerce')
+
+    if ENABLE_DEDUPLICATE:
+        rank_df = dedup_share_classes(rank_df, '基金简称', DEDUP_CLASS_PRIORITY)
+
+    if ENABLE_HOT_SORT:
+        rank_df.sort_values(by=SORT_KEY, ascending=False, inplace=True)
+
+    rank_df.reset_index(drop=True, inplace=True)
+    return rank_df if SCAN_MODE == "full" else rank_df.head(TOP_COUNT)
+
+
+def pick_top_candidates(table, returns_map, log):
+    """
+    从候选表中选出最终 TopN 的 id（开启分散化时做相关性贪心挑选）
+    """
+    order = table.order_by("score")
+    if not ENABLE_DIVERSIFY:
+        return [int(i) for i in order[:OUTPUT_TOP_N]]
+
+    # 分片合并后是各片 TopK 的并集，只取前 CANDIDATE_POOL_SIZE 参与挑选
+    order = order[:int(CANDIDATE_POOL_SIZE)]
+
+    # 一次性构建候选的对齐收益矩阵与两两相关矩阵，选股、降级提示与概览都从这里读
+    corr_matrix = build_corr_matrix(
+        returns_map, [table.codes[i] for i in order], min_overlap=DIVERSIFY_MIN_OVERLAP
+    )
+    top_ids, rejected = select_diversified_top(
+        table,
+        returns_map,
+        top_n=OUTPUT_TOP_N,
+        max_pair_corr=DIVERSIFY_MAX_PAIR_CORR,
+        corr_matrix=corr_matrix,
+        ids=order,
+    )
+    # 仅做摘要提示，具体明细不刷屏
+    if rejected:
+        worst = max((c for _, c in rejected), default=None)
+        if worst is not None:
+            log(f"分散化提示: 有 {len(rejected)} 个高相关候选被降级（max_corr 阈值={DIVERSIFY_MAX_PAIR_CORR}，被拒最大相关={worst:.2f}）。")
+
+    # 输出入选组合的相关性概览（便于你观察是否仍同质化）
+    max_corr_selected = max_corr_within(*corr_matrix, [table.codes[i] for i in top_ids])
+    log(f"分散化概览: 入选组合最大两两相关={max_corr_selected:.2f}（越低越分散）。")
+    return top_ids
+
+
+def render_chart_pack(records, out_dir=None):
+    """
+    为入选基金各画一张 净值 + 逐日打分 图；records 为入选候选（含 code / name），返回写出的图片路径
+    """
+    out_dir = out_dir or os.path.join(CHART_DIR, time.strftime("%Y%m%d", time.localtime()), "index08")
+    jobs = []
+    for f in records:
+        nav_df = fetch_fund_nav_df(f['code'], lookback_points=CHART_PACK_POINTS)
+        if nav_df is None:
+            continue
+        df = score_frame(nav_df, score_weights(), HOLD_DAYS, RET_HOLD_SOFT_CAP, BIAS_20_THRESHOLD, ENABLE_BIAS_20_PENALTY)
+        jobs.append((f['code'], df, f"{f['name']} ({f['code']}) 净值与打分"))
+    return [p for p in render_charts(jobs, out_dir=out_dir) if p]
+
+
+def send_email(content, subject=None, attachments=None):
     """
-    发送邮件函数 (修复 502 Invalid Input 问题)
+    发送邮件函数 (修复 502 Invalid Input 问题)；attachments 为附件路径（如图表包）
     """
     sender = os.environ.get('EMAIL_SENDER')
     password = os.environ.get('EMAIL_PASSWORD') # 注意：这里必须是QQ邮箱的授权码，不是QQ密码
@@ -314,10 +673,15 @@ def send_email(content):
     receivers = [r.strip() for r in receivers_str.split(',')]
     
     current_date = time.strftime("%Y-%m-%d", time.localtime())
-    subject = f'【基金日报】{current_date} 走势筛选结果'
+    subject = subject or f'【基金日报】{current_date} 走势筛选结果'
 
     # === 构造邮件对象 ===
-    msg = MIMEText(content, 'plain', 'utf-8')
+    if attachments:
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(content, 'plain', 'utf-8'))
+        attach_files(msg, attachments)
+    else:
+        msg = MIMEText(content, 'plain', 'utf-8')
     
     # 修复 1: 使用 formataddr 标准化发件人写法
     msg['From'] = formataddr(("基金分析机器人", sender))
@@ -345,19 +709,37 @@ def send_email(content):
     except Exception as e:
         print(f"❌ 发生未知错误: {e}")
 
-def main():
-    print(f"🚀 启动选基程序...")
-    result_buffer = []
-    
-    def log(text):
-        print(text)
-        result_buffer.append(text)
+def run_shard(index, n_shards):
+    """
+    --shard i/N 模式：只扫描代码哈希落在第 i 片的候选，结果写入分片文件（不选股、不发邮件），
+    全部分片完成后由 --merge N 统一选股发信
+    """
+    run_metrics.METRICS.reset()
+    top_funds = load_candidate_pool()
+    shard_df = split_by_shard(top_funds, '基金代码', n_shards)[index]
+    print(f"🧩 分片 {index}/{n_shards}: {len(shard_df)} / {len(top_funds)} 只")
 
+    result = _scan_shard(shard_df, index, n_shards, fresh_metrics=False)
+    path = partial_path("index08", index, n_shards)
+    save_partial(path, result["scored_funds"], result["returns"], result["coverage"], metrics=result["metrics"])
+    print(f"💾 分片结果: {path} | 覆盖率: {result['coverage']}")
+    run_metrics.write_manifest(f"index08_shard{index}of{n_shards}", extra={"coverage": result["coverage"]})
+
+
+def run_pipeline(log, report, market=None, merge_shards=None, chart_records=None):
+    """
+    选基主流程（不含发邮件）：日志逐行交给 log，结果摘要写入 report。
+    market 为外部已获取的大盘环境（run_all 里两条流水线共用），None 时自行获取；
+    chart_records 传入列表时不在这里出图，只把入选记录追加进去（run_all 在流水线都结束后统一出图）
+    """
     log(f"分析时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}")
-    log(f"候选池: {TOP_COUNT} | 持有周期: {HOLD_DAYS} 天 | 输出 TopN: {OUTPUT_TOP_N} | 形态过滤: {'开启' if ENABLE_PATTERN_FILTER else '关闭'} | 分散化: {'开启' if ENABLE_DIVERSIFY else '关闭'}")
+    pool_desc = "全市场" if SCAN_MODE == "full" else TOP_COUNT
+    log(f"候选池: {pool_desc} | 持有周期: {HOLD_DAYS} 天 | 输出 TopN: {OUTPUT_TOP_N} | 形态过滤: {'开启' if ENABLE_PATTERN_FILTER else '关闭'} | 分散化: {'开启' if ENABLE_DIVERSIFY else '关闭'}")
     log("-" * 30)
 
-    market = get_market_regime()
+    if market is None:
+        with run_metrics.stage("market_regime"):
+            market = get_market_regime()
     if market:
         market_status = "风险ON" if market.get("risk_on") else "风险OFF"
         log(
@@ -367,115 +749,41 @@ def main():
         )
         if (not market.get("risk_on")) and MARKET_FILTER_MODE == "block":
             log("⚠️ 大盘处于 MA 下方：今日停止开仓（MARKET_FILTER_MODE=block）。")
-            send_email("\n".join(result_buffer))
             return
     else:
         log("⚠️ 大盘过滤: 获取失败，已跳过。")
 
     try:
-        rank_df = ak.fund_open_fund_rank_em(symbol="全部")
-        if ENABLE_HOT_SORT:
-            rank_df[SORT_KEY] = pd.to_numeric(rank_df[SORT_KEY], errors='coerce')
-
-        if ENABLE_DEDUPLICATE:
-            rank_df['base_name'] = rank_df['基金简称'].str.replace(r'[AC]$', '', regex=True)
-            rank_df['prio'] = rank_df['基金简称'].apply(lambda x: 0 if x.endswith('C') else 1)
-            rank_df.sort_values(by=['base_name', 'prio'], ascending=[True, True], inplace=True)
-            rank_df.drop_duplicates(subset=['base_name'], keep='first', inplace=True)
-            rank_df.drop(columns=['base_name', 'prio'], inplace=True)
-
-        if ENABLE_HOT_SORT:
-            rank_df.sort_values(by=SORT_KEY, ascending=False, inplace=True)
-
-        rank_df.reset_index(drop=True, inplace=True)
-        top_funds = rank_df.head(TOP_COUNT)
-        
+        top_funds = load_candidate_pool()
     except Exception as e:
         log(f"❌ 获取榜单失败: {e}")
         # 即使失败也尝试发送报错日志
-        send_email("\n".join(result_buffer))
         return
 
-    scored_funds = []
-    returns_map = {}
-
-    for index, row in top_funds.iterrows():
-        code = str(row['基金代码'])
-        name = row['基金简称']
-
-        fund_df = fetch_fund_nav_df(code)
-        if fund_df is None:
-            time.sleep(0.2)
-            continue
-
-        score_result = calc_7d_score(fund_df)
-        if score_result is None:
-            time.sleep(0.2)
-            continue
-
-        score, features = score_result
-        if FILTER_RET_HOLD_POSITIVE and float(features.get("ret_hold", 0.0)) <= 0.0:
-            time.sleep(0.2)
-            continue
-        pattern = calc_updown_pattern(fund_df)
-        if ENABLE_DIVERSIFY:
-            returns_map[code] = _extract_return_series(fund_df)
-
-        fund_data = {
-            "code": code,
-            "name": name,
-            "score": round(score, 6),
-            **features,
-        }
-        if pattern:
-            fund_data["pattern"] = pattern
-
-        if ENABLE_HOT_SORT:
-            fund_data["hot_rank"] = f"{SORT_KEY}第{index+1}名"
-
-        # 打印过程日志
-        print(json.dumps(fund_data, ensure_ascii=False))
-        scored_funds.append(fund_data)
-        time.sleep(0.2)
+    if merge_shards:
+        table, returns_map, coverage = load_shard_results(top_funds, merge_shards, log)
+    elif SCAN_PROCESSES > 1:
+        table, returns_map, coverage = scan_funds_sharded(top_funds, SCAN_PROCESSES)
+    else:
+        table, returns_map, coverage = scan_funds(top_funds)
+    report["candidates"] = len(top_funds)
+    report["scored"] = coverage.get("scored", 0)
+    report["coverage"] = coverage
 
     log("✅ 扫描结束。")
+    log(
+        f"覆盖率: 计划 {coverage['planned']} | 打分 {coverage['scored']} | 动量过滤 {coverage['filtered']}"
+        f" | 数据不足 {coverage['insufficient']} | 拉取失败 {coverage['failed']} | 超时跳过 {coverage['skipped']}"
+        f" | 断点复用 {coverage['resumed']}"
+    )
 
-    if ENABLE_PATTERN_FILTER:
-        scored_funds = [
-            x for x in scored_funds
-            if isinstance(x.get("pattern"), str) and x["pattern"].startswith(TARGET_PATTERN)
-        ]
-
-    scored_funds.sort(key=lambda x: x.get("score", float("-inf")), reverse=True)
-
-    if ENABLE_DIVERSIFY:
-        top_candidates, rejected = select_diversified_top(
-            scored_funds,
-            returns_map,
-            top_n=OUTPUT_TOP_N,
-            max_pair_corr=DIVERSIFY_MAX_PAIR_CORR,
-        )
-        # 仅做摘要提示，具体明细不刷屏
-        if rejected:
-            worst = max((c for _, c in rejected), default=None)
-            if worst is not None:
-                log(f"分散化提示: 有 {len(rejected)} 个高相关候选被降级（max_corr 阈值={DIVERSIFY_MAX_PAIR_CORR}，被拒最大相关={worst:.2f}）。")
-
-        # 输出入选组合的相关性概览（便于你观察是否仍同质化）
-        max_corr_selected = 0.0
-        for i in range(len(top_candidates)):
-            for j in range(i + 1, len(top_candidates)):
-                a = top_candidates[i].get("code")
-                b = top_candidates[j].get("code")
-                c = _pair_corr(returns_map.get(a), returns_map.get(b))
-                max_corr_selected = max(max_corr_selected, c)
-        log(f"分散化概览: 入选组合最大两两相关={max_corr_selected:.2f}（越低越分散）。")
-    else:
-        top_candidates = scored_funds[:OUTPUT_TOP_N]
+    with run_metrics.stage("diversify"):
+        top_ids = pick_top_candidates(table, returns_map, log)
+    report["selected"] = [table.codes[i] for i in top_ids]
 
-    if top_candidates:
-        log(f"\n🎉 Top {min(OUTPUT_TOP_N, len(top_candidates))} 候选（规则打分，score 越大越靠前）：\n")
-        for i, f in enumerate(top_candidates, start=1):
+    if top_ids:
+        log(f"\n🎉 Top {min(OUTPUT_TOP_N, len(top_ids))} 候选（规则打分，score 越大越靠前）：\n")
+        for i, f in enumerate(table.records(top_ids), start=1):
             line = (
                 f"{i}. [{f['code']}] {f['name']} | score={f.get('score')}"
                 f" | ret{HOLD_DAYS}={f.get('ret_hold'):.4%}"
@@ -486,12 +794,46 @@ def main():
             if ENABLE_PATTERN_FILTER and f.get("pattern"):
                 line += f" | pattern={f.get('pattern')}"
             log(line)
+
+        if ENABLE_CHART_PACK and chart_records is not None:
+            chart_records.extend(table.records(top_ids))
+        elif ENABLE_CHART_PACK:
+            with run_metrics.stage("charts"):
+                report["charts"] = render_chart_pack(table.records(top_ids))
+            log(f"\n🖼️ 图表包: {len(report['charts'])} 张（见邮件附件）")
     else:
         log("\n⚠️ 未筛到候选基金（可能是净值数据不足/接口异常/候选池过小）。")
 
+
+def main(merge_shards=None):
+    print(f"🚀 启动选基程序...")
+    result_buffer = []
+    
+    def log(text):
+        print(text)
+        result_buffer.append(text)
+
+    run_metrics.METRICS.reset()
+    report = {}
+    run_pipeline(log, report, merge_shards=merge_shards)
+
     # === 发送邮件 ===
-    email_content = "\n".join(result_buffer)
-    send_email(email_content)
+    # 附上耗时摘要后发送邮件，并写出运行清单（JSON）
+    log("")
+    for line in run_metrics.summary_lines():
+        log(line)
+    with run_metrics.stage("email"):
+        send_email("\n".join(result_buffer), attachments=report.get("charts"))
+    path = run_metrics.write_manifest("index08", extra=report)
+    print(f"📝 运行清单: {path}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="开放式基金 7 天策略选基")
+    parser.add_argument("--shard", help="只扫描第 i/N 个分片并写出分片结果，如 0/4")
+    parser.add_argument("--merge", type=int, help="合并当天 N 个分片结果后选股、发邮件")
+    args = parser.parse_args()
+
+    if args.shard:
+        run_shard(*parse_shard_arg(args.shard))
+    else:
+        main(merge_shards=args.merge)
@@ -1,14 +1,31 @@
 # index_etf.py
-import akshare as ak
+from data_source import ak, local_caches_enabled
+import argparse
 import sys
 import time
 import json
 import pandas as pd
 import smtplib
 import os
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
 
+import run_metrics
+from charts import CHART_DIR, attach_files, render_charts, score_frame
+from panel_score import build_nav_panel, calc_7d_score_panel, features_at, required_points
+from candidates import CandidateTable
+from diversify import build_corr_matrix, corr_by_ids, select_diversified_ids
+from governor import CircuitOpenError, set_rate_share
+from feature_store import open_store, score_with_store
+from nav_store import load_history, save_history, append_rows, today_str
+from share_class import is_feeder
+from scan_checkpoint import checkpoint_path, prune_checkpoints, iter_checkpoint, append_records, series_to_json, series_from_json
+from trade_calendar import lookback_start_date
+from topk import TopK
+from updown_pattern import PATTERN_POINTS, PatternMatcher, decode_pattern, updown_bits_panel
+from shard import split_by_shard, parse_shard_arg, partial_path, save_partial, load_partials, merge_partials, run_sharded
+
 # ================= 配置区域 =================
 
 # 1. 扫描池逻辑 (ETF 特有)
@@ -19,6 +36,7 @@ MIN_TURNOVER = 30000000    # 最小成交额过滤：3000万 (低于此流动性
 
 # 2. 目标形态
 TARGET_PATTERN = "101111" 
+# 可填多个形态，任一匹配即可，如 ["1001", "101111"]
 
 # 3. 策略持有参数
 HOLD_DAYS = 7     # ETF 也是短线轮动
@@ -54,43 +72,111 @@ MARKET_FILTER_MODE = "warn"
 # 排除货币ETF、债券ETF(可选)、不知名的小微ETF
 EXCLUDE_KEYWORDS = ["货币", "债", "理财", "资金"]
 
+# 8. 本地日线缓存 (按交易日历计算最小 start_date，之后只从最后缓存日期往后补)
+# 前复权价格会在分红后整体变化：补数时比对最后缓存日的收盘价，不一致就整只重拉
+ENABLE_ETF_BAR_CACHE = True
+ETF_CACHE_DIR = os.path.join("cache", "etf")
+QFQ_CHANGE_TOLERANCE = 1e-6
+
+# 9. 断点续跑 (分批扫描，每批完成即写入当天的断点文件，中途失败后重跑只扫剩余部分)
+ENABLE_CHECKPOINT = True
+SCAN_BATCH_SIZE = 50
+
+# 10. 分片扫描 (按代码哈希分片；SCAN_PROCESSES > 1 时进程池并行，或 --shard i/N 多任务 + --merge N 合并)
+# 请求节奏由 governor.py 自适应控制（替代固定 sleep），各分片进程的速率区间按分片数等分
+SCAN_PROCESSES = 1
+
+# 11. 候选上限 (扫描时用有界堆只保留得分最高的 N 只，分散化只在其中挑选)
+CANDIDATE_POOL_SIZE = OUTPUT_TOP_N * 10
+
+# 12. 特征库 (每只 ETF 每个交易日的打分特征只算一次；打分窗口内价格变化（含前复权整体调整）时按窗口内容哈希自动重算)
+ENABLE_FEATURE_STORE = True
+
+# 13. 邮件图表包 (每只入选 ETF 一张"价格 + 逐日打分"图，作为附件随日报发送；无界面渲染，多张图进程池并行)
+# 图上为最近 NAV_LOOKBACK_POINTS 个交易日 (与行情缓存一致，不额外拉长历史)
+ENABLE_CHART_PACK = False
+
 # ===========================================
 
-def fetch_etf_price_df(code, lookback_points=NAV_LOOKBACK_POINTS):
+def _clean_etf_rows(df):
     """
-    【修改点】拉取 ETF 历史行情 (前复权)
+    标准化列名，适配后续逻辑 (将 '日期'->'净值日期', '收盘'->'单位净值')，日期升序、价格转数值
     """
-    try:
-        # adjust='qfq' 非常重要！ETF分红如果不复权，K线会断崖下跌，导致策略误判
-        df = ak.fund_etf_hist_em(symbol=code, period="daily", start_date="20200101", adjust="qfq")
-        if df is None or len(df) == 0:
-            return None
+    rename_map = {
+        '日期': '净值日期',
+        '收盘': '单位净值',
+        '成交量': 'vol'
+    }
+    df = df.rename(columns=rename_map)[['净值日期', '单位净值', 'vol']].copy()
+    df['净值日期'] = pd.to_datetime(df['净值日期'], errors='coerce')
+    df = df.dropna(subset=['净值日期']).sort_values('净值日期')
+    df['单位净值'] = pd.to_numeric(df['单位净值'], errors='coerce')
+    df['vol'] = pd.to_numeric(df['vol'], errors='coerce')
+    return df.dropna(subset=['单位净值']).reset_index(drop=True)
 
-        df = df.tail(lookback_points).copy()
 
-        # 标准化列名，适配后续逻辑 (将 '日期'->'净值日期', '收盘'->'单位净值')
-        rename_map = {
-            '日期': '净值日期',
-            '收盘': '单位净值', 
-            '成交量': 'vol'
-        }
-        df.rename(columns=rename_map, inplace=True)
+def _qfq_unchanged(cached, fresh):
+    """
+    比对最后缓存日在新旧两份数据里的前复权收盘价；不一致说明复权因子变了
+    """
+    last_date = cached['净值日期'].iloc[-1]
+    overlap = fresh.loc[fresh['净值日期'] == last_date, '单位净值']
+    if len(overlap) == 0:
+        return False
+    old_close = float(cached['单位净值'].iloc[-1])
+    return abs(float(overlap.iloc[0]) / old_close - 1) <= QFQ_CHANGE_TOLERANCE
 
-        if '净值日期' in df.columns:
-            df['净值日期'] = pd.to_datetime(df['净值日期'], errors='coerce')
-            df = df.sort_values('净值日期')
 
-        if '单位净值' in df.columns:
-            df['单位净值'] = pd.to_numeric(df['单位净值'], errors='coerce')
+def fetch_etf_price_df(code, lookback_points=NAV_LOOKBACK_POINTS):
+    """
+    【修改点】拉取 ETF 历史行情 (前复权)
+    只请求刚好够 lookback_points 个交易日的区间；有缓存时从最后缓存日期往后补
+    """
+    try:
+        history = None
+        use_cache = ENABLE_ETF_BAR_CACHE and local_caches_enabled()
+        cached = load_history(code, ETF_CACHE_DIR)[0] if use_cache else None
 
+        # adjust='qfq' 非常重要！ETF分红如果不复权，K线会断崖下跌，导致策略误判
+        if cached is not None and len(cached) > 0:
+            start = cached['净值日期'].iloc[-1].strftime('%Y%m%d')
+            df = ak.fund_etf_hist_em(symbol=code, period="daily", start_date=start, adjust="qfq")
+            if df is not None and len(df) > 0:
+                fresh = _clean_etf_rows(df)
+                if _qfq_unchanged(cached, fresh):
+                    history = append_rows(cached, fresh, '净值日期')
+
+        if history is None:
+            start = lookback_start_date(lookback_points)
+            df = ak.fund_etf_hist_em(symbol=code, period="daily", start_date=start, adjust="qfq")
+            if df is None or len(df) == 0:
+                run_metrics.count("fetch_etf", "empty")
+                return None
+            history = _clean_etf_rows(df)
+            run_metrics.count("fetch_etf", "full_fetch")
+
+        if use_cache:
+            # 盘中运行时当天K线还会变，只缓存今天之前的完整日线
+            history = history.tail(lookback_points)
+            save_history(code, history[history['净值日期'] < pd.Timestamp(today_str())], ETF_CACHE_DIR)
+
+        df = history.tail(lookback_points)
         if len(df) < max(HOLD_DAYS + 1, 21):
+            run_metrics.count("fetch_etf", "insufficient")
             return None
 
+        run_metrics.count("fetch_etf", "success")
         return df.reset_index(drop=True)
+    except CircuitOpenError:
+        run_metrics.count("fetch_etf", "circuit_open")
+        return None
     except Exception:
+        # 具体异常类型已由 governor 计入 errors 计数
+        run_metrics.count("fetch_etf", "exception")
         return None
 
 # 下面这几个函数逻辑通用，直接复制即可，不需要改动
+# (逐只计算的形态参考实现；扫描时用 updown_bits_panel 整批计算位编码)
 def calc_updown_pattern(fund_df, points=20):
     try:
         if fund_df is None or len(fund_df) < points:
@@ -152,46 +238,65 @@ def calc_7d_score(fund_df, hold_days=HOLD_DAYS):
     }
     return float(score), features
 
+def open_feature_store(name):
+    """
+    打开（或新建）特征库；库参数与当前的持有天数 / 阈值不一致时自动作废重建
+    """
+    return open_store(name, HOLD_DAYS, RET_HOLD_SOFT_CAP, BIAS_20_THRESHOLD, ENABLE_BIAS_20_PENALTY)
+
+
+def score_weights():
+    """
+    当前打分权重（键为 panel_score.WEIGHT_KEYS）
+    """
+    return {
+        "ret_hold": SCORE_W_RET_HOLD,
+        "ret_20": SCORE_W_RET_20,
+        "vol_20": SCORE_W_VOL_20,
+        "mdd_20": SCORE_W_MDD_20,
+        "pos_20": SCORE_W_POS_20,
+        "ret_hold_cap": SCORE_W_RET_HOLD_CAP,
+        "bias_20": SCORE_W_BIAS_20,
+    }
+
+
+def score_nav_panel(nav_dfs, hold_days=HOLD_DAYS, codes=None, store=None):
+    """
+    面板打分：一批净值 DataFrame 一次性打分；返回列表，第 j 项与 calc_7d_score(nav_dfs[j]) 一致。
+    传入特征库 store（与 codes 对应）时已入库的特征直接读取，只计算新增的
+    """
+    weights = score_weights()
+    if store is not None:
+        return score_with_store(store, codes, nav_dfs, weights)
+
+    nav = build_nav_panel(nav_dfs, required_points(hold_days))
+    result = calc_7d_score_panel(
+        nav,
+        weights,
+        hold_days=hold_days,
+        ret_hold_soft_cap=RET_HOLD_SOFT_CAP,
+        bias_threshold=BIAS_20_THRESHOLD,
+        enable_bias_penalty=ENABLE_BIAS_20_PENALTY,
+    )
+    return [features_at(result, j) for j in range(len(nav_dfs))]
+
 def _extract_return_series(fund_df, lookback_days=60):
     if fund_df is None: return None
     df = fund_df.copy().set_index('净值日期')
     ret = df['单位净值'].pct_change().dropna()
     return ret.tail(lookback_days)
 
-def _pair_corr(ret_a, ret_b, min_overlap=30):
-    if ret_a is None or ret_b is None: return 1.0
-    aligned = pd.concat([ret_a, ret_b], axis=1, join='inner').dropna()
-    if len(aligned) < min_overlap: return 1.0
-    return float(aligned.iloc[:, 0].corr(aligned.iloc[:, 1]))
-
-def select_diversified_top(scored_funds, returns_map, top_n=6, max_pair_corr=0.85):
-    if not scored_funds: return [], []
-    ordered = sorted(scored_funds, key=lambda x: x.get("score", float("-inf")), reverse=True)
-    selected = []
-    rejected = []
-
-    for f in ordered:
-        if len(selected) >= top_n: break
-        if not selected:
-            selected.append(f)
-            continue
-        
-        corr_list = [_pair_corr(returns_map.get(f['code']), returns_map.get(s['code'])) for s in selected]
-        max_corr = max(corr_list) if corr_list else 1.0
-        
-        if max_corr <= max_pair_corr:
-            selected.append(f)
-        else:
-            rejected.append((f, max_corr))
-            
-    # 补齐逻辑
-    if len(selected) < top_n:
-        remaining = [f for f in ordered if f not in selected]
-        for f in remaining:
-            if len(selected) >= top_n: break
-            selected.append(f)
-            
-    return selected, rejected
+def select_diversified_top(table, returns_map, top_n=6, max_pair_corr=0.85, corr_matrix=None, ids=None):
+    """
+    按 score 贪心挑选低相关组合；table 为 CandidateTable，ids 为参与挑选的候选（默认全部，按 score 降序），
+    返回 (selected_ids, [(id, max_corr), ...])
+    """
+    if not len(table): return [], []
+    order = table.order_by("score") if ids is None else ids
+    # 候选两两相关矩阵只对参与挑选的候选算一次，贪心挑选直接按 id 查表
+    if corr_matrix is None:
+        corr_matrix = build_corr_matrix(returns_map, [table.codes[i] for i in order], min_overlap=30)
+    return select_diversified_ids(order, corr_by_ids(corr_matrix, table.codes), top_n, max_pair_corr)
 
 def get_market_regime():
     try:
@@ -203,7 +308,21 @@ def get_market_regime():
         return {"symbol": MARKET_INDEX_SYMBOL, "close": close, "ma": ma, "risk_on": close >= ma}
     except: return None
 
-def send_email(content):
+def render_chart_pack(records, out_dir=None):
+    """
+    为入选 ETF 各画一张 价格 + 逐日打分 图；返回写出的图片路径
+    """
+    out_dir = out_dir or os.path.join(CHART_DIR, time.strftime("%Y%m%d", time.localtime()), "index_etf")
+    jobs = []
+    for f in records:
+        price_df = fetch_etf_price_df(f['code'])
+        if price_df is None:
+            continue
+        df = score_frame(price_df, score_weights(), HOLD_DAYS, RET_HOLD_SOFT_CAP, BIAS_20_THRESHOLD, ENABLE_BIAS_20_PENALTY)
+        jobs.append((f['code'], df, f"{f['name']} ({f['code']}) 价格与打分"))
+    return [p for p in render_charts(jobs, out_dir=out_dir) if p]
+
+def send_email(content, attachments=None):
     sender = os.environ.get('EMAIL_SENDER')
     password = os.environ.get('EMAIL_PASSWORD')
     receivers_str = os.environ.get('EMAIL_RECEIVERS')
@@ -213,7 +332,12 @@ def send_email(content):
     receivers = receivers_str.split(',')
     
     current_date = time.strftime("%Y-%m-%d", time.localtime())
-    msg = MIMEText(content, 'plain', 'utf-8')
+    if attachments:
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(content, 'plain', 'utf-8'))
+        attach_files(msg, attachments)
+    else:
+        msg = MIMEText(content, 'plain', 'utf-8')
     msg['From'] = formataddr(("ETF策略机器人", sender))
     msg['To'] = ",".join(receivers)
     msg['Subject'] = f'【ETF日报】{current_date} 轮动筛选结果'
@@ -227,122 +351,297 @@ def send_email(content):
     except Exception as e:
         print(f"❌ 邮件发送失败: {e}")
 
-# ================= 主程序 =================
-def main():
-    print(f"🚀 启动 ETF 选基程序...")
-    result_buffer = []
-    def log(text):
-        print(text)
-        result_buffer.append(text)
+def _build_scan_record(code, name, df, score_res, pattern_bits=None):
+    """
+    单只 ETF 的扫描结果 (即断点记录)：status 为 scored / filtered / insufficient
+    """
+    if score_res is None:
+        print(f"{code} 计算失败")
+        return {"code": code, "status": "insufficient"}
+
+    score, features = score_res
+
+    # 基础过滤：如果7日收益是负的，直接不要（趋势不对）
+    if FILTER_RET_HOLD_POSITIVE and features['ret_hold'] <= 0:
+        return {"code": code, "status": "filtered"}
+
+    print(f"{code} {name} 得分: {score:.4f}")
+
+    item = {
+        "code": code,
+        "name": name,
+        "score": round(score, 6),
+        "pattern": decode_pattern(pattern_bits, PATTERN_POINTS - 1) if pattern_bits is not None else None,
+        "pattern_bits": pattern_bits,
+        **features
+    }
+    record = {"code": code, "status": "scored", "item": item}
+    if ENABLE_DIVERSIFY:
+        record["returns"] = series_to_json(_extract_return_series(df))
+    return record
 
+def load_etf_pool():
+    """
+    ETF 实时榜单 -> 成交额/关键词过滤 -> 按成交额取头部，返回候选表
+    """
+    # akshare 获取所有 ETF 实时行情
+    with run_metrics.stage("spot"):
+        spot_df = ak.fund_etf_spot_em()
+    # 过滤掉成交额太小的（防止流动性陷阱）
+    spot_df = spot_df[spot_df['成交额'] >= MIN_TURNOVER]
+    # 过滤掉货币/债券/理财等关键词
+    mask = spot_df['名称'].apply(lambda x: not any(k in x for k in EXCLUDE_KEYWORDS))
+    spot_df = spot_df[mask]
+
+    # 按成交额降序取头部，保证流动性
+    spot_df = spot_df.sort_values(by='成交额', ascending=False)
+    candidates = spot_df.head(TOP_COUNT_LIQUIDITY)
+
+    # 简单去重：只看主流宽基和行业，去除联接基金名字干扰(ETF一般不需要这步，但为了保险)
+    return candidates[~is_feeder(candidates['名称']).to_numpy()]
+
+def _iter_scan_records(rows, coverage, ckpt_name="index_etf"):
+    """
+    生成器：逐条吐出 (position, record)；先是当天断点里已完成的记录，再分批 拉取 -> 整批面板打分
+    """
+    position = {code: pos for pos, (code, _) in enumerate(rows)}
+    done_codes = set()
+
+    ckpt_path = None
+    if ENABLE_CHECKPOINT and local_caches_enabled():
+        ckpt_path = checkpoint_path(ckpt_name)
+        prune_checkpoints(ckpt_name, ckpt_path)
+        for record in iter_checkpoint(ckpt_path):
+            code = str(record['code'])
+            if code in position and code not in done_codes:
+                done_codes.add(code)
+                yield position[code], record
+        coverage["resumed"] = len(done_codes)
+        if done_codes:
+            print(f"♻️ 断点续跑: 今日已完成 {len(done_codes)} 只，跳过")
+
+    store = open_feature_store(ckpt_name) if ENABLE_FEATURE_STORE and local_caches_enabled() else None
+
+    pending = [(pos, row) for pos, row in enumerate(rows) if row[0] not in done_codes]
+    total = len(pending)
+
+    for start in range(0, total, SCAN_BATCH_SIZE):
+        batch = pending[start:start + SCAN_BATCH_SIZE]
+
+        # 3. 循环拉取历史K线
+        fetched = []
+        for i, (pos, (code, name)) in enumerate(batch, start=start + 1):
+            # 进度条
+            print(f"[{i}/{total}] 拉取: {code} {name} ... ", end="", flush=True)
+
+            with run_metrics.stage("fetch"):
+                df = fetch_etf_price_df(code)
+            if df is None:
+                print("数据不足")
+                coverage["failed"] += 1
+                continue
+
+            print("OK")
+            fetched.append((pos, code, name, df))
+
+        # 4. 面板打分（整批一次性计算），结果写入断点；拉取失败的不写，重跑时重试
+        with run_metrics.stage("score"):
+            nav_dfs = [df for _, _, _, df in fetched]
+            score_results = score_nav_panel(nav_dfs, codes=[code for _, code, _, _ in fetched], store=store)
+            bits, valid = updown_bits_panel(build_nav_panel(nav_dfs, PATTERN_POINTS), PATTERN_POINTS)
+            records = [
+                (pos, _build_scan_record(code, name, df, score_res, int(b) if v else None))
+                for (pos, code, name, df), score_res, b, v in zip(fetched, score_results, bits, valid)
+            ]
+        if ckpt_path:
+            append_records(ckpt_path, [record for _, record in records])
+        yield from records
+
+def scan_etfs(candidates, ckpt_name="index_etf"):
+    """
+    流式扫描候选 ETF：拉取 -> 打分 -> 过滤 逐条进入容量为 CANDIDATE_POOL_SIZE 的有界堆，
+    收益率序列只为堆内成员保留。返回 (table, returns_map, coverage)，table 为 CandidateTable，id 按 score 降序
+    """
+    rows = [(str(row['代码']), row['名称']) for _, row in candidates.iterrows()]
+    coverage = {"planned": len(rows), "resumed": 0, "failed": 0, "skipped": 0, "scored": 0, "filtered": 0, "insufficient": 0}
+    heap = TopK(CANDIDATE_POOL_SIZE)
+    matcher = PatternMatcher(TARGET_PATTERN) if ENABLE_PATTERN_FILTER else None
+
+    for pos, record in _iter_scan_records(rows, coverage, ckpt_name=ckpt_name):
+        coverage[record.get('status')] = coverage.get(record.get('status'), 0) + 1
+        if record.get('status') != 'scored': continue
+        item = record['item']
+        if matcher is not None and not matcher.match(item.get('pattern_bits')): continue
+        if heap.accepts(item['score'], pos):
+            returns = series_from_json(record.get('returns')) if ENABLE_DIVERSIFY else None
+            heap.push(item['score'], pos, item, returns)
+
+    scored_funds = []
+    returns_map = {}
+    for item, returns in heap.sorted_items():
+        scored_funds.append(item)
+        if ENABLE_DIVERSIFY:
+            returns_map[item['code']] = returns
+    return CandidateTable.from_records(scored_funds), returns_map, coverage
+
+def _scan_shard(shard_df, index, n_shards, fresh_metrics=True):
+    """
+    扫描第 index 个分片（进程池 worker / --shard 模式共用），断点文件按分片独立
+    """
+    if fresh_metrics:
+        run_metrics.METRICS.reset()
+    set_rate_share(1.0 / n_shards)
+    table, returns_map, coverage = scan_etfs(shard_df, ckpt_name=f"index_etf_s{index}of{n_shards}")
+    return {
+        "scored_funds": table.records(),
+        "returns": returns_map,
+        "coverage": coverage,
+        "metrics": run_metrics.METRICS.export(),
+    }
+
+def load_shard_results(candidates, n_shards, log):
+    """
+    --merge 模式：读取当天 n_shards 个分片文件并合并；缺失 / 损坏分片的 ETF 计入“缺失跳过”
+    """
+    partials, missing = load_partials("index_etf", n_shards)
+    for part in partials:
+        run_metrics.METRICS.merge(part.get("metrics"))
+    scored_funds, returns_map, coverage = merge_partials(partials, order_codes=candidates['代码'].astype(str))
+    if missing:
+        shards = split_by_shard(candidates, '代码', n_shards)
+        log(f"⚠️ 分片结果缺失: {missing}（共 {sum(len(shards[i]) for i in missing)} 只未参与本次选股）")
+        coverage["skipped"] = coverage.get("skipped", 0) + sum(len(shards[i]) for i in missing)
+    for key in ("planned", "resumed", "failed", "skipped", "scored", "filtered", "insufficient"):
+        coverage.setdefault(key, 0)
+    coverage["planned"] = len(candidates)
+    return CandidateTable.from_records(scored_funds), returns_map, coverage
+
+def run_shard(index, n_shards):
+    """
+    --shard i/N 模式：只扫描第 i 片并写出分片结果，不选股、不发邮件
+    """
+    run_metrics.METRICS.reset()
+    candidates = load_etf_pool()
+    shard_df = split_by_shard(candidates, '代码', n_shards)[index]
+    print(f"🧩 分片 {index}/{n_shards}: {len(shard_df)} / {len(candidates)} 只")
+
+    result = _scan_shard(shard_df, index, n_shards, fresh_metrics=False)
+    path = partial_path("index_etf", index, n_shards)
+    save_partial(path, result["scored_funds"], result["returns"], result["coverage"], metrics=result["metrics"])
+    print(f"💾 分片结果: {path} | 覆盖率: {result['coverage']}")
+    run_metrics.write_manifest(f"index_etf_shard{index}of{n_shards}", extra={"coverage": result["coverage"]})
+
+# ================= 主程序 =================
+def run_pipeline(log, report, market=None, merge_shards=None, chart_records=None):
+    """
+    ETF 主流程（不含发邮件）；market 为外部已获取的大盘环境，None 时自行获取。
+    chart_records 传入列表时不在这里出图，只把入选记录追加进去（run_all 在流水线都结束后统一出图）。
+    榜单获取失败返回 False（单独运行时不发邮件），其余情况返回 True
+    """
     log(f"分析时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}")
     log(f"ETF候选池: 流动性前{TOP_COUNT_LIQUIDITY} | 最小成交额: {MIN_TURNOVER/10000:.0f}万")
     log("-" * 30)
 
     # 1. 大盘环境
-    market = get_market_regime()
+    if market is None:
+        with run_metrics.stage("market_regime"):
+            market = get_market_regime()
     if market:
         status = "风险ON (可开仓)" if market['risk_on'] else "风险OFF (谨慎)"
         log(f"大盘状态: {status} | Close: {market['close']:.2f} | MA{MARKET_MA_WINDOW}: {market['ma']:.2f}")
         if not market['risk_on'] and MARKET_FILTER_MODE == "block":
             log("🚫 触发熔断，停止扫描。")
-            send_email("\n".join(result_buffer))
-            return
+            return True
 
     # 2. 获取 ETF 实时榜单（按成交额排序，作为初筛池）
     try:
-        # akshare 获取所有 ETF 实时行情
-        spot_df = ak.fund_etf_spot_em()
-        # 过滤掉成交额太小的（防止流动性陷阱）
-        spot_df = spot_df[spot_df['成交额'] >= MIN_TURNOVER]
-        # 过滤掉货币/债券/理财等关键词
-        mask = spot_df['名称'].apply(lambda x: not any(k in x for k in EXCLUDE_KEYWORDS))
-        spot_df = spot_df[mask]
-        
-        # 按成交额降序取头部，保证流动性
-        spot_df.sort_values(by='成交额', ascending=False, inplace=True)
-        candidates = spot_df.head(TOP_COUNT_LIQUIDITY)
-        
+        candidates = load_etf_pool()
     except Exception as e:
         log(f"❌ 获取ETF榜单失败: {e}")
-        return
-
-    scored_funds = []
-    returns_map = {}
+        return False
+
+    if merge_shards:
+        table, returns_map, coverage = load_shard_results(candidates, merge_shards, log)
+    elif SCAN_PROCESSES > 1:
+        shards = split_by_shard(candidates, '代码', SCAN_PROCESSES)
+        partials = run_sharded(_scan_shard, [(df, i, SCAN_PROCESSES) for i, df in enumerate(shards)], processes=SCAN_PROCESSES)
+        for part in partials:
+            run_metrics.METRICS.merge(part["metrics"])
+        scored_funds, returns_map, coverage = merge_partials(partials, order_codes=candidates['代码'].astype(str))
+        table = CandidateTable.from_records(scored_funds)
+    else:
+        table, returns_map, coverage = scan_etfs(candidates)
+
+    # 5. 排序与分散化
+    log(f"✅ 扫描结束，合格候选数: {coverage.get('scored', 0)}")
+    log(
+        f"覆盖率: 计划 {coverage['planned']} | 打分 {coverage['scored']} | 动量过滤 {coverage['filtered']}"
+        f" | 数据不足 {coverage['insufficient']} | 拉取失败 {coverage['failed']}"
+        f" | 缺失跳过 {coverage['skipped']} | 断点复用 {coverage['resumed']}"
+    )
+    report["candidates"] = len(candidates)
+    report["scored"] = coverage.get("scored", 0)
+    report["coverage"] = coverage
     
-    # 3. 循环打分
-    total = len(candidates)
-    for i, (index, row) in enumerate(candidates.iterrows()):
-        code = str(row['代码'])
-        name = row['名称']
-        
-        # 简单去重：只看主流宽基和行业，去除联接基金名字干扰(ETF一般不需要这步，但为了保险)
-        if "联接" in name: continue
-
-        # 进度条
-        print(f"[{i+1}/{total}] 分析: {code} {name} ... ", end="", flush=True)
-
-        # 拉取历史K线
-        df = fetch_etf_price_df(code)
-        if df is None:
-            print("数据不足")
-            continue
-
-        # 计算得分
-        score_res = calc_7d_score(df)
-        if score_res is None:
-            print("计算失败")
-            continue
-            
-        score, features = score_res
-        
-        # 基础过滤：如果7日收益是负的，直接不要（趋势不对）
-        if FILTER_RET_HOLD_POSITIVE and features['ret_hold'] <= 0:
-            print("动量为负")
-            continue
-
-        print(f"得分: {score:.4f}")
-        
-        # 记录数据
-        pattern = calc_updown_pattern(df)
+    with run_metrics.stage("diversify"):
         if ENABLE_DIVERSIFY:
-            returns_map[code] = _extract_return_series(df)
-
-        item = {
-            "code": code,
-            "name": name,
-            "score": round(score, 6),
-            "pattern": pattern,
-            **features
-        }
-        scored_funds.append(item)
-        time.sleep(0.1) # 防封
-
-    # 4. 排序与分散化
-    log(f"✅ 扫描结束，合格候选数: {len(scored_funds)}")
-    
-    if ENABLE_DIVERSIFY:
-        final_list, rejected = select_diversified_top(
-            scored_funds, returns_map, 
-            top_n=OUTPUT_TOP_N, 
-            max_pair_corr=DIVERSIFY_MAX_PAIR_CORR
-        )
-        if rejected:
-            log(f"分散化优化: 剔除了 {len(rejected)} 只高相关ETF (如: {rejected[0][0]['name']})")
-    else:
-        scored_funds.sort(key=lambda x: x['score'], reverse=True)
-        final_list = scored_funds[:OUTPUT_TOP_N]
+            # 分片合并后是各片 TopK 的并集，与 index08 一样只取前 CANDIDATE_POOL_SIZE 参与挑选
+            final_ids, rejected = select_diversified_top(
+                table, returns_map, 
+                top_n=OUTPUT_TOP_N, 
+                max_pair_corr=DIVERSIFY_MAX_PAIR_CORR,
+                ids=table.order_by("score")[:int(CANDIDATE_POOL_SIZE)]
+            )
+            if rejected:
+                log(f"分散化优化: 剔除了 {len(rejected)} 只高相关ETF (如: {table.value(rejected[0][0], 'name')})")
+        else:
+            final_ids = [int(i) for i in table.order_by("score")[:OUTPUT_TOP_N]]
+    report["selected"] = [table.codes[i] for i in final_ids]
+    final_list = table.records(final_ids)
 
-    # 5. 输出结果
+    # 6. 输出结果
     if final_list:
         log(f"\n🎉 ETF 优选 Top {len(final_list)}：\n")
         for idx, f in enumerate(final_list, 1):
             log(f"{idx}. [{f['code']}] {f['name']} | Score: {f['score']:.4f}")
             log(f"   近7日: {f['ret_hold']:.2%} | 近20日: {f['ret_20']:.2%} | 回撤: {f['mdd_20']:.2%}")
+        if ENABLE_CHART_PACK and chart_records is not None:
+            chart_records.extend(final_list)
+        elif ENABLE_CHART_PACK:
+            with run_metrics.stage("charts"):
+                report["charts"] = render_chart_pack(final_list)
+            log(f"\n🖼️ 图表包: {len(report['charts'])} 张 (见邮件附件)")
     else:
         log("⚠️ 无满足条件的标的。")
+    return True
+
+def main(merge_shards=None):
+    print(f"🚀 启动 ETF 选基程序...")
+    result_buffer = []
+    def log(text):
+        print(text)
+        result_buffer.append(text)
 
-    send_email("\n".join(result_buffer))
+    run_metrics.METRICS.reset()
+    report = {}
+    if not run_pipeline(log, report, merge_shards=merge_shards):
+        return
+
+    # 附上耗时摘要后发送邮件，并写出运行清单 (JSON)
+    log("")
+    for line in run_metrics.summary_lines():
+        log(line)
+    with run_metrics.stage("email"):
+        send_email("\n".join(result_buffer), attachments=report.get("charts"))
+    print(f"📝 运行清单: {run_metrics.write_manifest('index_etf', extra=report)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETF 轮动筛选")
+    parser.add_argument("--shard", help="只扫描第 i/N 个分片并写出分片结果，如 0/4")
+    parser.add_argument("--merge", type=int, help="合并当天 N 个分片结果后选股、发邮件")
+    args = parser.parse_args()
+
+    if args.shard:
+        run_shard(*parse_shard_arg(args.shard))
+    else:
+        main(merge_shards=args.merge)
\ No newline at end of file
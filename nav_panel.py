@@ -0,0 +1,221 @@
+# nav_panel.py
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from nav_store import DEFAULT_STORE_DIR, load_history
+
+# 多年净值面板：float32 的 (日期, 基金) 矩阵按列存放（每只基金的全部日期连续），
+# 另有观测掩码（1=当天有真实净值）与代码 / 日期索引文件；用 np.memmap 只读打开，
+# 回测只会读到用到的列和日期区间，启动耗时与内存不随全市场基金数增长
+PANEL_DIR = os.path.join("cache", "panel")
+
+_VALUES = "values.f32"
+_MASK = "mask.u1"
+_CODES = "codes.txt"
+_DATES = "dates.npy"
+_META = "meta.json"
+
+
+def _panel_path(name, panel_dir=PANEL_DIR):
+    return os.path.join(panel_dir, name)
+
+
+def write_panel(name, dates, codes, series_iter, panel_dir=PANEL_DIR, meta=None):
+    """
+    逐只写入面板：series_iter 依次给出与 codes 对应的净值 Series（日期索引；None 表示无数据），
+    按 dates 对齐后写入对应列，内存只占一只基金的一列。先写临时目录再整体替换，中断时旧面板仍可用。
+    meta 为附加信息（如拉取区间），原样写入 meta.json。返回面板目录
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(dates)).normalize().unique().sort_values()
+    codes = [str(c) for c in codes]
+    path = _panel_path(name, panel_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    shape = (len(dates), len(codes))
+    values = np.memmap(os.path.join(tmp_path, _VALUES), dtype=np.float32, mode="w+", shape=shape, order="F")
+    mask = np.memmap(os.path.join(tmp_path, _MASK), dtype=np.uint8, mode="w+", shape=shape, order="F")
+
+    for j, series in enumerate(series_iter):
+        if j >= len(codes):
+            break
+        column = np.full(len(dates), np.nan, dtype=np.float32)
+        if series is not None and len(series) > 0:
+            series = series.copy()
+            series.index = pd.DatetimeIndex(series.index).normalize()
+            series = series[~series.index.duplicated(keep="last")]
+            aligned = series.reindex(dates)
+            column[:] = aligned.to_numpy(dtype=np.float32)
+        values[:, j] = column
+        mask[:, j] = ~np.isnan(column)
+
+    values.flush()
+    mask.flush()
+    del values, mask
+
+    with open(os.path.join(tmp_path, _CODES), "w", encoding="utf-8") as f:
+        f.write("\n".join(codes))
+    np.save(os.path.join(tmp_path, _DATES), dates.to_numpy(dtype="datetime64[D]"))
+    with open(os.path.join(tmp_path, _META), "w", encoding="utf-8") as f:
+        json.dump(dict(meta or {}, shape=list(shape), dtype="float32", order="F"), f, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_panel_frame(name, frame, panel_dir=PANEL_DIR, meta=None):
+    """
+    (日期, 基金) DataFrame 直接写成面板
+    """
+    return write_panel(name, frame.index, frame.columns, (frame[c].dropna() for c in frame.columns), panel_dir, meta)
+
+
+class NavPanel:
+    """
+    只读面板：values / mask 为 (日期, 基金) 的内存映射，切片时才真正读盘
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, _META), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.meta = meta
+        with open(os.path.join(path, _CODES), "r", encoding="utf-8") as f:
+            self.codes = f.read().split("\n") if meta["shape"][1] else []
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(path, _DATES)).astype("datetime64[ns]"))
+        shape = tuple(meta["shape"])
+        self.values = np.memmap(os.path.join(path, _VALUES), dtype=np.float32, mode="r", shape=shape, order="F")
+        self.mask = np.memmap(os.path.join(path, _MASK), dtype=np.uint8, mode="r", shape=shape, order="F")
+        self._col = {c: j for j, c in enumerate(self.codes)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def covers(self, codes, start, end, today=None):
+        """
+        生成面板时的拉取区间（meta 里的 start/end，YYYYMMDD）是否包含 [start, end]，
+        且已请求过全部 codes（meta 里的 universe，拉取失败的代码也算在内，避免每次重拉）；
+        用于判断缓存能否直接复用。
+        end 常写成未来日期：面板实际只覆盖到拉取当天（meta 里的 fetched_through），
+        所以按 min(end, 今天) 判断，拉取之后又过了交易日就视为未覆盖、需要重拉
+        """
+        if "start" not in self.meta or "end" not in self.meta or "fetched_through" not in self.meta:
+            return False
+        today = today or time.strftime("%Y%m%d", time.localtime())
+        covered_end = min(str(self.meta["end"]), str(self.meta["fetched_through"]))
+        universe = set(str(c) for c in self.meta.get("universe", self.codes))
+        return (str(self.meta["start"]) <= str(start) and covered_end >= min(str(end), str(today))
+                and all(str(c) in universe for c in codes))
+
+    def rows(self, start=None, end=None):
+        """
+        日期区间 [start, end] 对应的行切片
+        """
+        lo = 0 if start is None else int(self.dates.searchsorted(pd.Timestamp(start), side="left"))
+        hi = len(self.dates) if end is None else int(self.dates.searchsorted(pd.Timestamp(end), side="right"))
+        return slice(lo, hi)
+
+    def columns(self, codes):
+        """
+        代码 -> 列号；不在面板里的代码跳过。返回 (列号数组, 对应代码列表)
+        """
+        found = [(self._col[str(c)], str(c)) for c in codes if str(c) in self._col]
+        return np.array([j for j, _ in found], dtype=int), [c for _, c in found]
+
+    def select(self, codes=None, start=None, end=None):
+        """
+        取 (日期区间, 若干基金) 的 float32 矩阵；codes 为 None 时返回内存映射视图（零拷贝），
+        否则只读取这些列（按列存放，每列是一段连续读）。返回 (values, dates, codes)
+        """
+        rows = self.rows(start, end)
+        if codes is None:
+            return self.values[rows], self.dates[rows], list(self.codes)
+        cols, found = self.columns(codes)
+        return np.asarray(self.values[rows][:, cols]), self.dates[rows], found
+
+    def frame(self, codes=None, start=None, end=None, dropna_columns=True):
+        """
+        取出一块 float64 DataFrame（供沿用 pandas 的回测代码使用）；默认去掉区间内全空的列
+        """
+        values, dates, found = self.select(codes, start, end)
+        df = pd.DataFrame(np.asarray(values, dtype=float), index=dates, columns=found)
+        return df.dropna(axis=1, how="all") if dropna_columns else df
+
+    def series(self, code, start=None, end=None):
+        """
+        单只基金的净值序列（去掉缺失日）；不在面板里时返回 None
+        """
+        j = self._col.get(str(code))
+        if j is None:
+            return None
+        rows = self.rows(start, end)
+        s = pd.Series(np.asarray(self.values[rows, j], dtype=float), index=self.dates[rows])
+        return s.dropna()
+
+    def coverage(self, start=None, end=None):
+        """
+        各基金在区间内的有效净值天数（只读掩码）
+        """
+        return pd.Series(self.mask[self.rows(start, end)].sum(axis=0, dtype=np.int64), index=self.codes)
+
+
+def open_panel(name, panel_dir=PANEL_DIR):
+    """
+    打开已生成的面板；不存在或损坏时返回 None
+    """
+    path = _panel_path(name, panel_dir)
+    try:
+        return NavPanel(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def build_from_nav_store(name, codes=None, store_dir=DEFAULT_STORE_DIR, date_col='净值日期', value_col='单位净值', panel_dir=PANEL_DIR):
+    """
+    用本地净值历史库（每只基金一个 .npz）生成面板：第一遍只收集日期，第二遍逐只写列
+    """
+    if codes is None:
+        codes = sorted(os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(store_dir, "*.npz")))
+
+    all_dates = set()
+    kept = []
+    for code in codes:
+        df, _ = load_history(code, store_dir)
+        if df is None or len(df) == 0 or date_col not in df.columns:
+            continue
+        all_dates.update(pd.to_datetime(df[date_col]).to_numpy(dtype="datetime64[D]").tolist())
+        kept.append(code)
+
+    def _iter_series():
+        for code in kept:
+            df, _ = load_history(code, store_dir)
+            yield pd.Series(pd.to_numeric(df[value_col], errors="coerce").to_numpy(dtype=float),
+                            index=pd.to_datetime(df[date_col]))
+
+    return write_panel(name, sorted(all_dates), kept, _iter_series(), panel_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从本地净值历史库生成内存映射净值面板")
+    parser.add_argument("--name", default="funds")
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    path = build_from_nav_store(args.name, store_dir=args.store_dir)
+    panel = open_panel(args.name)
+    n_dates, n_codes = panel.shape
+    size_mb = os.path.getsize(os.path.join(path, _VALUES)) / 1024 / 1024
+    print(f"✅ 面板已生成: {path} | {n_codes} 只 x {n_dates} 天 | {size_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
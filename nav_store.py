@@ -0,0 +1,94 @@
+# nav_store.py
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_source import as_of_date
+
+# 本地历史库：每只基金一个 .npz 文件（列式存储：日期列 + 数值列），按日期升序、日期唯一
+DEFAULT_STORE_DIR = os.path.join("cache", "nav")
+
+
+def _store_path(code, store_dir):
+    return os.path.join(store_dir, f"{code}.npz")
+
+
+def today_str():
+    """
+    “今天”（YYYY-MM-DD）；回放模式下固定为录制日期
+    """
+    return as_of_date() or time.strftime("%Y-%m-%d", time.localtime())
+
+
+def load_history(code, store_dir=DEFAULT_STORE_DIR):
+    """
+    读取本地历史；返回 (df, fetched_on)，不存在或损坏时返回 (None, None)
+    fetched_on 为最近一次联网补齐的日期（YYYY-MM-DD），用于判断“当天已更新”
+    """
+    path = _store_path(code, store_dir)
+    if not os.path.exists(path):
+        return None, None
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            columns = [str(c) for c in data["__columns__"]]
+            fetched_on = str(data["__fetched_on__"])
+            df = pd.DataFrame({col: data[f"c{i}"] for i, col in enumerate(columns)})
+        return df, fetched_on
+    except Exception:
+        return None, None
+
+
+def save_history(code, df, store_dir=DEFAULT_STORE_DIR, fetched_on=None):
+    """
+    写入本地历史（先写临时文件再替换，避免中断时留下半个文件）
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    path = _store_path(code, store_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    arrays = {f"c{i}": df[col].to_numpy() for i, col in enumerate(df.columns)}
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            __columns__=np.array([str(c) for c in df.columns]),
+            __fetched_on__=np.array(fetched_on or today_str()),
+            **arrays,
+        )
+    os.replace(tmp_path, path)
+
+
+def rows_after(raw_df, date_col, last_date):
+    """
+    从接口返回的（按日期升序）原始数据中，只解析尾部日期晚于 last_date 的新增行；
+    从尾部按倍数向前扩大窗口，直到遇到已入库日期，避免整列解析
+    """
+    total = len(raw_df)
+    n = min(8, total)
+    while True:
+        chunk = raw_df.tail(n)
+        dates = pd.to_datetime(chunk[date_col], errors="coerce")
+        if n >= total or (dates <= last_date).any():
+            break
+        n = min(n * 4, total)
+
+    chunk = chunk.loc[(dates > last_date).to_numpy()].copy()
+    chunk[date_col] = dates[dates > last_date].to_numpy()
+    return chunk
+
+
+def append_rows(stored_df, new_df, date_col):
+    """
+    将新增行追加到已入库历史后面（按日期去重、升序）
+    """
+    if stored_df is None or len(stored_df) == 0:
+        merged = new_df
+    elif new_df is None or len(new_df) == 0:
+        return stored_df
+    else:
+        merged = pd.concat([stored_df, new_df[stored_df.columns]], ignore_index=True)
+
+    merged = merged.drop_duplicates(subset=[date_col], keep="last")
+    return merged.sort_values(date_col).reset_index(drop=True)
@@ -0,0 +1,259 @@
+# panel_backtest.py
+from data_source import ak, local_caches_enabled
+import time
+
+import numpy as np
+import pandas as pd
+
+import index08 as strategy
+from candidates import CandidateTable
+from fetch_pool import fetch_many
+from nav_panel import open_panel, write_panel_frame
+from panel_score import rolling_score_panel
+
+# ================= 回测设置 =================
+# 横截面回测：每个调仓日对整个候选池打分 -> 过滤 -> 分散化 TopN -> 持有 HOLD_DAYS，
+# 选股参数 (权重/过滤/大盘/分散化) 全部直接复用 index08，保证与实盘流程一致
+
+# 回测标的池；None 表示取当前成交额最大的 UNIVERSE_TOP_LIQUIDITY 只 ETF（注意存在幸存者偏差）
+UNIVERSE_CODES = None
+UNIVERSE_TOP_LIQUIDITY = 200
+START_DATE = "20220101"
+END_DATE = "20251231"
+
+# 相邻日期缺失（停牌/节假日错位）时最多向前填充的天数
+FFILL_LIMIT = 3
+# 每个调仓日只把得分最高的前 N 个合格候选交给分散化（控制相关性计算量）
+CANDIDATE_POOL = 60
+# 单边换手成本（按换手比例扣减，0 表示不计成本）
+TRADE_COST = 0.0
+
+FETCH_MAX_WORKERS = 8
+# 固定限速上限（None = 由 governor 按接口自适应）
+FETCH_RPS = None
+
+# 历史价格面板缓存名（cache/panel/<名>，float32 内存映射，同一区间与标的池重跑时不再拉取）；None = 不缓存
+PRICE_PANEL_NAME = "etf_hfq"
+
+# ===========================================
+
+def _fetch_close_series(code, start=START_DATE, end=END_DATE):
+    """
+    拉取单只 ETF 的后复权收盘价序列 (日期索引)
+    """
+    try:
+        df = ak.fund_etf_hist_em(symbol=code, period="daily", start_date=start, end_date=end, adjust="hfq")
+        if df is None or len(df) == 0:
+            return None
+        close = pd.to_numeric(df['收盘'], errors='coerce')
+        close.index = pd.to_datetime(df['日期'], errors='coerce')
+        close = close[close.index.notna()].dropna()
+        return close[~close.index.duplicated(keep='last')].sort_index()
+    except Exception:
+        return None
+
+
+def default_universe():
+    spot_df = ak.fund_etf_spot_em()
+    spot_df = spot_df.sort_values(by='成交额', ascending=False)
+    return [str(c) for c in spot_df['代码'].head(UNIVERSE_TOP_LIQUIDITY)]
+
+
+def load_price_panel(codes, start=START_DATE, end=END_DATE):
+    """
+    拉取候选池历史并拼成 (日期, 基金) 收盘价面板；拿不到数据的标的直接剔除。
+    启用面板缓存时，区间与标的池都已覆盖就只从内存映射里读取这些列，否则拉取后写回。
+    面板是 float32（约 7 位有效数字），启用缓存时返回值一律取自面板，未命中与命中两条路径精度一致
+    """
+    use_cache = bool(PRICE_PANEL_NAME) and local_caches_enabled()
+    cached = open_panel(PRICE_PANEL_NAME) if use_cache else None
+    if cached is not None and cached.covers(codes, start, end):
+        panel = cached.frame(codes, start, end)
+    else:
+        series = fetch_many(lambda c: _fetch_close_series(c, start, end), codes,
+                            max_workers=FETCH_MAX_WORKERS, rps=FETCH_RPS)
+        frames = {code: s for code, s in zip(codes, series) if s is not None and len(s) > 0}
+        if not frames:
+            return None
+        panel = pd.DataFrame(frames).sort_index()
+        if use_cache:
+            write_panel_frame(PRICE_PANEL_NAME, panel,
+                              meta={"start": start, "end": end, "universe": [str(c) for c in codes],
+                                    "fetched_through": time.strftime("%Y%m%d", time.localtime())})
+            # 面板按 float32 存储：刚拉取的这次也从面板读回，保证与命中缓存时的打分/排名/净值曲线完全一致
+            written = open_panel(PRICE_PANEL_NAME)
+            if written is not None:
+                panel = written.frame(codes, start, end)
+    if len(panel.columns) == 0:
+        return None
+    if FFILL_LIMIT:
+        panel = panel.ffill(limit=int(FFILL_LIMIT))
+    return panel
+
+
+def load_market_risk_on(dates):
+    """
+    按回测日期计算大盘风险开关（收盘价 >= MA 即风险 ON）；拿不到数据时视为全程风险 ON
+    """
+    risk_on = pd.Series(True, index=dates)
+    if not strategy.ENABLE_MARKET_FILTER:
+        return risk_on
+    try:
+        df = ak.stock_zh_index_daily_em(symbol=strategy.MARKET_INDEX_SYMBOL)
+        close = pd.to_numeric(df['close'], errors='coerce')
+        close.index = pd.to_datetime(df['date'], errors='coerce')
+        close = close.dropna().sort_index()
+        ma = close.rolling(int(strategy.MARKET_MA_WINDOW)).mean()
+        flag = (close >= ma) | ma.isna()
+        return flag.reindex(dates, method='ffill').fillna(True).astype(bool)
+    except Exception:
+        return risk_on
+
+
+def strategy_weights():
+    """
+    index08 当前的打分权重（键为 panel_score.WEIGHT_KEYS）
+    """
+    return strategy.score_weights()
+
+
+def score_panel(panel):
+    """
+    用 index08 的打分参数对整个面板做滚动打分，返回 (score, ret_hold) 两个 (T, N) 矩阵
+    """
+    result = rolling_score_panel(
+        panel.to_numpy(dtype=float),
+        strategy_weights(),
+        hold_days=strategy.HOLD_DAYS,
+        ret_hold_soft_cap=strategy.RET_HOLD_SOFT_CAP,
+        bias_threshold=strategy.BIAS_20_THRESHOLD,
+        enable_bias_penalty=strategy.ENABLE_BIAS_20_PENALTY,
+    )
+    return result["score"], result["ret_hold"]
+
+
+def select_on_date(t, codes, score, ret_hold, returns):
+    """
+    复现 index08 单日选股：打分 -> ret_hold 过滤 -> 分散化 TopN；返回入选代码列表
+    """
+    row_score = score[t]
+    ok = ~np.isnan(row_score)
+    if strategy.FILTER_RET_HOLD_POSITIVE:
+        ok &= ret_hold[t] > 0.0
+    idx = np.flatnonzero(ok)
+    if len(idx) == 0:
+        return []
+
+    idx = idx[np.argsort(-row_score[idx], kind="stable")][:int(CANDIDATE_POOL)]
+    table = CandidateTable([codes[j] for j in idx], {"score": row_score[idx]})
+
+    if not strategy.ENABLE_DIVERSIFY:
+        return table.codes[:strategy.OUTPUT_TOP_N]
+
+    lookback = int(strategy.DIVERSIFY_LOOKBACK_DAYS)
+    window = returns.iloc[max(0, t - lookback + 1):t + 1]
+    returns_map = {codes[j]: window.iloc[:, j].dropna() for j in idx}
+    selected, _ = strategy.select_diversified_top(
+        table,
+        returns_map,
+        top_n=strategy.OUTPUT_TOP_N,
+        max_pair_corr=strategy.DIVERSIFY_MAX_PAIR_CORR,
+    )
+    return [table.codes[i] for i in selected]
+
+
+def run_panel_backtest(panel, risk_on=None):
+    """
+    横截面回测主循环：每 HOLD_DAYS 个交易日调仓一次，等权持有入选标的。
+    返回 (curve, trades)：curve 为逐日组合收益/净值/换手，trades 为每次调仓的持仓明细
+    """
+    codes = [str(c) for c in panel.columns]
+    col_of = {c: j for j, c in enumerate(codes)}
+    dates = panel.index
+    returns = panel.pct_change(fill_method=None)
+    ret_values = returns.to_numpy(dtype=float)
+    score, ret_hold = score_panel(panel)
+    if risk_on is None:
+        risk_on = pd.Series(True, index=dates)
+
+    hold = int(strategy.HOLD_DAYS)
+    n_dates = len(dates)
+    port_ret = np.zeros(n_dates)
+    turnover = np.zeros(n_dates)
+    weights = {}
+    trades = []
+
+    valid_rows = np.flatnonzero(~np.isnan(score).all(axis=1))
+    first = int(valid_rows[0]) if len(valid_rows) else n_dates
+
+    for t in range(first, n_dates - 1, hold):
+        if (not risk_on.iloc[t]) and strategy.MARKET_FILTER_MODE == "block":
+            picks = []
+        else:
+            picks = select_on_date(t, codes, score, ret_hold, returns)
+
+        new_weights = {c: 1.0 / len(picks) for c in picks} if picks else {}
+        changed = set(weights) | set(new_weights)
+        turnover[t] = sum(abs(new_weights.get(c, 0.0) - weights.get(c, 0.0)) for c in changed) / 2
+        weights = new_weights
+        trades.append({"date": dates[t], "codes": picks, "risk_on": bool(risk_on.iloc[t])})
+
+        # 持有期：t+1 .. t+hold 的等权收益（停牌日收益按 0 计）
+        if picks:
+            cols = [col_of[c] for c in picks]
+            period = ret_values[t + 1:t + 1 + hold][:, cols]
+            port_ret[t + 1:t + 1 + hold] = np.nan_to_num(period, nan=0.0).mean(axis=1)
+        port_ret[t + 1] -= float(TRADE_COST) * turnover[t]
+
+    curve = pd.DataFrame({"ret": port_ret, "turnover": turnover}, index=dates).iloc[first:]
+    curve["equity"] = (1 + curve["ret"]).cumprod()
+    # 基准：候选池全部标的等权
+    bench = np.nan_to_num(ret_values, nan=0.0)
+    counts = (~np.isnan(ret_values)).sum(axis=1)
+    bench_ret = np.divide(bench.sum(axis=1), counts, out=np.zeros(n_dates), where=counts > 0)
+    curve["bench_equity"] = (1 + pd.Series(bench_ret, index=dates).iloc[first:]).cumprod()
+    return curve, trades
+
+
+def summarize(curve, trades):
+    if curve is None or len(curve) == 0:
+        return {}
+    equity = curve["equity"]
+    days = len(curve)
+    total = float(equity.iloc[-1] - 1)
+    annual = float(equity.iloc[-1] ** (252 / days) - 1) if days else 0.0
+    mdd = float((equity / equity.cummax() - 1).min())
+    rebalances = [x for x in trades if x["codes"]]
+    return {
+        "days": days,
+        "total_return": total,
+        "annual_return": annual,
+        "max_drawdown": mdd,
+        "bench_return": float(curve["bench_equity"].iloc[-1] - 1),
+        "rebalances": len(trades),
+        "invested_rebalances": len(rebalances),
+        "avg_turnover": float(curve["turnover"][curve["turnover"] > 0].mean()) if (curve["turnover"] > 0).any() else 0.0,
+    }
+
+
+def main():
+    codes = UNIVERSE_CODES or default_universe()
+    print(f"⏳ 正在拉取 {len(codes)} 只标的的历史数据...")
+    panel = load_price_panel(codes)
+    if panel is None:
+        print("❌ 数据获取失败")
+        return
+
+    risk_on = load_market_risk_on(panel.index)
+    curve, trades = run_panel_backtest(panel, risk_on)
+    stats = summarize(curve, trades)
+
+    print("-" * 30)
+    print(f"📊 横截面回测 ({panel.shape[1]} 只, {panel.index[0].date()} ~ {panel.index[-1].date()})")
+    print(f"持有周期: {strategy.HOLD_DAYS} 天 | TopN: {strategy.OUTPUT_TOP_N} | 调仓次数: {stats.get('rebalances')}")
+    print(f"累计收益: {stats.get('total_return', 0):.2%} | 年化: {stats.get('annual_return', 0):.2%} | 最大回撤: {stats.get('max_drawdown', 0):.2%}")
+    print(f"基准(等权)累计收益: {stats.get('bench_return', 0):.2%} | 平均换手: {stats.get('avg_turnover', 0):.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# panel_score.py
+import numpy as np
+
+# 与 calc_7d_score 返回的 features 字段一一对应
+FEATURE_NAMES = (
+    "ret_hold",
+    "ret_hold_over_cap",
+    "ret_20",
+    "vol_20",
+    "mdd_20",
+    "pos_ratio_20",
+    "ma_20",
+    "bias_20",
+    "bias_20_over",
+)
+
+# 打分权重的键（与各脚本里的 SCORE_W_* 常量对应）
+WEIGHT_KEYS = ("ret_hold", "ret_20", "vol_20", "mdd_20", "pos_20", "ret_hold_cap", "bias_20")
+
+
+def required_points(hold_days):
+    """
+    打分所需的最少净值点数（与 calc_7d_score 的长度判断一致）
+    """
+    return max(int(hold_days) + 1, 21)
+
+
+def build_nav_panel(nav_dfs, points, value_col='单位净值'):
+    """
+    把一批基金的净值序列按“各自最新一天”右对齐成 (points, N) 矩阵，不足部分补 NaN；
+    None 对应整列 NaN。右对齐保证每列最后一行就是该基金自己的最新净值，结果与逐只计算一致
+    """
+    panel = np.full((int(points), len(nav_dfs)), np.nan)
+    for j, df in enumerate(nav_dfs):
+        if df is None or value_col not in df.columns:
+            continue
+        values = df[value_col].to_numpy(dtype=float)[-int(points):]
+        if len(values):
+            panel[len(panel) - len(values):, j] = values
+    return panel
+
+
+def combine_score(features, weights):
+    """
+    按权重把特征合成最终得分（运算顺序与 calc_7d_score 相同，保证逐位一致）
+    """
+    return (
+        weights["ret_hold"] * features["ret_hold"]
+        + weights["ret_20"] * features["ret_20"]
+        - weights["vol_20"] * features["vol_20"]
+        - weights["mdd_20"] * np.abs(features["mdd_20"])
+        + weights["pos_20"] * (features["pos_ratio_20"] - 0.5)
+        - weights["ret_hold_cap"] * features["ret_hold_over_cap"]
+        - weights["bias_20"] * features["bias_20_over"]
+    )
+
+
+def weight_vector(weights):
+    """
+    权重 dict -> 按 WEIGHT_KEYS 排列的数组（与 feature_design 的列一一对应）
+    """
+    return np.array([float(weights[k]) for k in WEIGHT_KEYS])
+
+
+def feature_design(features, ret_hold_soft_cap=0.12, bias_threshold=0.10, enable_bias_penalty=True):
+    """
+    combine_score 的线性形式：返回最后一维按 WEIGHT_KEYS 排列的设计矩阵 X，
+    X @ weight_vector(weights) 即得分（与 combine_score 只差浮点舍入）。
+    软上限 / 乖离阈值只影响最后两列，由原始 ret_hold、bias_20 现算，换阈值不必重算其它特征
+    """
+    ret_hold = np.asarray(features["ret_hold"], dtype=float)
+    over_cap = np.maximum(0.0, ret_hold - float(ret_hold_soft_cap))
+    if enable_bias_penalty:
+        over_bias = np.maximum(0.0, np.asarray(features["bias_20"], dtype=float) - float(bias_threshold))
+    else:
+        over_bias = np.zeros_like(ret_hold)
+    return np.stack([
+        ret_hold,
+        features["ret_20"],
+        -np.asarray(features["vol_20"], dtype=float),
+        -np.abs(features["mdd_20"]),
+        np.asarray(features["pos_ratio_20"], dtype=float) - 0.5,
+        -over_cap,
+        -over_bias,
+    ], axis=-1)
+
+
+def _window_features(w, hold_days, ret_hold_soft_cap, bias_threshold, enable_bias_penalty):
+    """
+    w 的最后一维是按时间升序的 required_points 个净值（无 NaN），其余维度任意；
+    沿最后一维计算全部特征（与 pandas 逐只计算的求和顺序一致）
+    """
+    last = w[..., -1]
+    ret_hold = last / w[..., -(int(hold_days) + 1)] - 1
+    ret_20 = last / w[..., -21] - 1
+
+    daily_ret = w[..., -20:] / w[..., -21:-1] - 1
+    n = daily_ret.shape[-1]
+    avg = daily_ret.sum(axis=-1, dtype=np.float64) / n
+    vol_20 = np.sqrt(((avg[..., None] - daily_ret) ** 2).sum(axis=-1, dtype=np.float64) / (n - 1))
+
+    window_nav = w[..., -20:]
+    cummax = np.maximum.accumulate(window_nav, axis=-1)
+    mdd_20 = (window_nav / cummax - 1).min(axis=-1)
+
+    ma_20 = window_nav.sum(axis=-1, dtype=np.float64) / window_nav.shape[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bias_20 = np.where(ma_20 != 0, (last - ma_20) / ma_20, 0.0)
+    if enable_bias_penalty:
+        over_bias = np.maximum(0.0, bias_20 - float(bias_threshold))
+    else:
+        over_bias = np.zeros_like(bias_20)
+
+    pos_ratio_20 = (daily_ret > 0).sum(axis=-1, dtype=np.float64) / n
+    over_cap = np.maximum(0.0, ret_hold - float(ret_hold_soft_cap))
+
+    return {
+        "ret_hold": ret_hold,
+        "ret_hold_over_cap": over_cap,
+        "ret_20": ret_20,
+        "vol_20": vol_20,
+        "mdd_20": mdd_20,
+        "pos_ratio_20": pos_ratio_20,
+        "ma_20": ma_20,
+        "bias_20": bias_20,
+        "bias_20_over": over_bias,
+    }
+
+
+def calc_7d_score_panel(nav, weights, hold_days=7, ret_hold_soft_cap=0.12,
+                        bias_threshold=0.10, enable_bias_penalty=True):
+    """
+    面板打分：nav 为 (日期, 基金) 矩阵（按各基金最新日右对齐），一次 NumPy 计算全部基金。
+    返回 dict：FEATURE_NAMES 各特征、score（均为长度 N 的数组）以及 valid（数据足够的列）；
+    无效列的特征与得分为 NaN
+    """
+    nav = np.asarray(nav, dtype=float)
+    need = required_points(hold_days)
+    n_funds = nav.shape[1] if nav.ndim == 2 else 0
+
+    result = {name: np.full(n_funds, np.nan) for name in FEATURE_NAMES}
+    result["score"] = np.full(n_funds, np.nan)
+    result["valid"] = np.zeros(n_funds, dtype=bool)
+    if n_funds == 0 or nav.shape[0] < need:
+        return result
+
+    # 转成 (基金, 日期) 连续内存：沿最后一维归约
+    window = np.ascontiguousarray(nav[-need:].T)
+    valid = ~np.isnan(window).any(axis=1)
+    result["valid"] = valid
+    if not valid.any():
+        return result
+
+    features = _window_features(window[valid], hold_days, ret_hold_soft_cap, bias_threshold, enable_bias_penalty)
+    for name, values in features.items():
+        result[name][valid] = values
+    result["score"][valid] = combine_score(features, weights)
+    return result
+
+
+def rolling_score_panel(nav, weights, hold_days=7, ret_hold_soft_cap=0.12,
+                        bias_threshold=0.10, enable_bias_penalty=True, chunk_elems=4_000_000):
+    """
+    滚动打分：nav 为按日期升序的 (日期, 基金) 矩阵，对每一天都用“截至当天”的窗口计算特征与得分，
+    一次遍历完成（每个窗口只看最近 required_points 个点，整体 O(T)）。
+    返回 dict：各特征与 score 为 (T, N) 矩阵，窗口内有 NaN 或历史不足的位置为 NaN
+    """
+    nav = np.asarray(nav, dtype=float)
+    if nav.ndim == 1:
+        nav = nav[:, None]
+    n_dates, n_funds = nav.shape
+    need = required_points(hold_days)
+
+    result = {name: np.full((n_dates, n_funds), np.nan) for name in FEATURE_NAMES}
+    result["score"] = np.full((n_dates, n_funds), np.nan)
+    if n_dates < need or n_funds == 0:
+        return result
+
+    nav_t = np.ascontiguousarray(nav.T)
+    windows = np.lib.stride_tricks.sliding_window_view(nav_t, need, axis=1)  # (N, T-need+1, need)
+    n_windows = windows.shape[1]
+
+    # 分块计算，控制 (基金, 日期, 窗口) 临时数组的内存
+    step = max(1, int(chunk_elems) // max(1, n_funds * need))
+    for start in range(0, n_windows, step):
+        stop = min(n_windows, start + step)
+        w = windows[:, start:stop]
+        valid = ~np.isnan(w).any(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            features = _window_features(w, hold_days, ret_hold_soft_cap, bias_threshold, enable_bias_penalty)
+            score = combine_score(features, weights)
+
+        rows = slice(start + need - 1, stop + need - 1)
+        for name, values in features.items():
+            result[name][rows] = np.where(valid, values, np.nan).T
+        result["score"][rows] = np.where(valid, score, np.nan).T
+    return result
+
+
+def features_at(result, j):
+    """
+    取第 j 只基金的 (score, features)；数据不足时返回 None（与 calc_7d_score 的返回约定一致）
+    """
+    if not result["valid"][j]:
+        return None
+    features = {name: float(result[name][j]) for name in FEATURE_NAMES}
+    return float(result["score"][j]), features
@@ -0,0 +1,127 @@
+# run_all.py
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import index08
+import index_etf
+import run_metrics
+from data_source import enable_shared_adapter
+from trade_calendar import load_trade_dates
+
+# ================= 配置区域 =================
+# 一个进程里跑完基金 + ETF 两条流水线：只导入一次 akshare/pandas，
+# 大盘环境只下载一次，交易日历/本地缓存/HTTP 连接池共用，最后合并成一封邮件
+
+# 1. 两条流水线同时执行（各自内部仍按自己的限速拉取）
+RUN_CONCURRENTLY = True
+
+# 2. 共用 HTTP 连接池（keep-alive，省去重复的 TCP/TLS 握手）
+SHARE_HTTP_SESSION = True
+HTTP_POOL_SIZE = 16
+
+# ===========================================
+
+PIPELINES = (
+    ("index08", index08, "📊 基金日报"),
+    ("index_etf", index_etf, "📈 ETF日报"),
+)
+
+
+def shared_market_regime():
+    """
+    两条流水线的大盘过滤参数一致时只下载一次指数日线；返回 {name: market}
+    """
+    enabled = [(name, module) for name, module, _ in PIPELINES if module.ENABLE_MARKET_FILTER]
+    settings = {(module.MARKET_INDEX_SYMBOL, module.MARKET_MA_WINDOW) for _, module in enabled}
+    if len(settings) != 1:
+        return {}
+
+    with run_metrics.stage("market_regime"):
+        market = index08.get_market_regime()
+    return {name: market for name, _ in enabled}
+
+
+def _run_one(name, module, market):
+    """
+    跑一条流水线，日志只收集不单独发信；图表包只收集入选记录，不在流水线线程里出图。
+    返回 (日志行, report, 待出图的入选记录)
+    """
+    lines = []
+
+    def log(text):
+        print(f"[{name}] {text}")
+        lines.append(text)
+
+    report = {}
+    chart_records = []
+    # 两条流水线的阶段名相同（fetch/score/...），按流水线名分作用域，耗时与计数分别归因
+    with run_metrics.stage(name), run_metrics.scope(name):
+        try:
+            module.run_pipeline(log, report, market=market, chart_records=chart_records)
+        except Exception as e:
+            log(f"❌ 运行异常: {e}")
+            report["error"] = str(e)
+    return lines, report, chart_records
+
+
+def _render_chart_pack(name, module, lines, report, records):
+    """
+    流水线都结束后在主线程里依次出图：pyplot 不是线程安全的，进程池也不在多线程环境里创建
+    """
+    if not records:
+        return
+    with run_metrics.scope(name), run_metrics.stage("charts"):
+        try:
+            report["charts"] = module.render_chart_pack(records)
+        except Exception as e:
+            print(f"[{name}] ❌ 图表包生成失败: {e}")
+            report["charts"] = []
+    text = f"\n🖼️ 图表包: {len(report['charts'])} 张（见邮件附件）"
+    print(f"[{name}] {text}")
+    lines.append(text)
+
+
+def main(concurrent=RUN_CONCURRENTLY):
+    print("🚀 启动基金 + ETF 联合运行...")
+    run_metrics.METRICS.reset()
+
+    if SHARE_HTTP_SESSION:
+        enable_shared_adapter(HTTP_POOL_SIZE)
+    # 交易日历进程内只加载一次，先在主线程加载好再分发
+    load_trade_dates()
+    markets = shared_market_regime()
+
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(PIPELINES)) as pool:
+            futures = [pool.submit(_run_one, name, module, markets.get(name)) for name, module, _ in PIPELINES]
+            results = [f.result() for f in futures]
+    else:
+        results = [_run_one(name, module, markets.get(name)) for name, module, _ in PIPELINES]
+
+    for (name, module, _), (lines, report, records) in zip(PIPELINES, results):
+        _render_chart_pack(name, module, lines, report, records)
+
+    sections = []
+    reports = {}
+    for (name, _, title), (lines, report, _) in zip(PIPELINES, results):
+        sections.append("\n".join([f"========== {title} ==========", *lines]))
+        reports[name] = report
+
+    summary = run_metrics.summary_lines()
+    print("\n".join(summary))
+    content = "\n\n".join(sections + ["\n".join(summary)])
+
+    # 两条流水线各自生成的图表包合并成同一封邮件的附件
+    charts = [p for report in reports.values() for p in report.get("charts", [])]
+    current_date = time.strftime("%Y-%m-%d", time.localtime())
+    with run_metrics.stage("email"):
+        index08.send_email(content, subject=f'【基金+ETF日报】{current_date} 筛选结果', attachments=charts)
+    print(f"📝 运行清单: {run_metrics.write_manifest('run_all', extra=reports)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基金 + ETF 联合运行（一封合并邮件）")
+    parser.add_argument("--sequential", action="store_true", help="两条流水线依次执行（默认并发）")
+    args = parser.parse_args()
+    main(concurrent=RUN_CONCURRENTLY and not args.sequential)
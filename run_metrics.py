@@ -0,0 +1,205 @@
+# run_metrics.py
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# 运行清单输出目录（每次运行一个 JSON，workflow 里作为 artifact 上传）
+MANIFEST_DIR = "reports"
+
+# 当前埋点作用域（如同一进程里并发的两条流水线）：阶段/计数/接口名前加 "作用域." 前缀，便于分别归因
+_SCOPE = contextvars.ContextVar("run_metrics_scope", default="")
+
+
+def _scoped(name):
+    prefix = _SCOPE.get()
+    # 已带前缀的名字（如合并回来的分片数据）不再重复添加
+    if not prefix or name.startswith(f"{prefix}."):
+        return name
+    return f"{prefix}.{name}"
+
+
+class RunMetrics:
+    """
+    一次运行的轻量埋点：阶段耗时、各接口调用延迟、成功/空数据/异常计数（线程安全）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.stages = {}      # name -> 累计秒数
+            self.latencies = {}   # endpoint -> [秒, ...]
+            self.counters = {}    # name -> {outcome: 次数}
+            self.gauges = {}      # name -> {key: 最新值}（如各接口当前自适应速率）
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            name = _scoped(name)
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def record_call(self, endpoint, seconds, outcome):
+        endpoint = _scoped(endpoint)
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(float(seconds))
+            bucket = self.counters.setdefault(endpoint, {})
+            bucket[outcome] = bucket.get(outcome, 0) + 1
+
+    def count(self, name, outcome, n=1):
+        name = _scoped(name)
+        with self._lock:
+            bucket = self.counters.setdefault(name, {})
+            bucket[outcome] = bucket.get(outcome, 0) + int(n)
+
+    def set_gauge(self, name, key, value):
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def export(self):
+        """
+        原始埋点数据（可 JSON 序列化），用于把分片子进程的数据汇总回主进程
+        """
+        with self._lock:
+            return {
+                "stages": dict(self.stages),
+                "latencies": {k: list(v) for k, v in self.latencies.items()},
+                "counters": {k: dict(v) for k, v in self.counters.items()},
+                "gauges": {k: dict(v) for k, v in self.gauges.items()},
+            }
+
+    def merge(self, data):
+        """
+        合并分片子进程导出的数据；阶段/计数/接口名按当前作用域加前缀（与本进程内记录的一致）
+        """
+        if not data:
+            return
+        with self._lock:
+            for name, seconds in data.get("stages", {}).items():
+                name = _scoped(name)
+                self.stages[name] = self.stages.get(name, 0.0) + float(seconds)
+            for endpoint, values in data.get("latencies", {}).items():
+                self.latencies.setdefault(_scoped(endpoint), []).extend(float(v) for v in values)
+            for name, outcomes in data.get("counters", {}).items():
+                bucket = self.counters.setdefault(_scoped(name), {})
+                for outcome, n in outcomes.items():
+                    bucket[outcome] = bucket.get(outcome, 0) + int(n)
+            # 分片进程各自的速率相加即总速率（调度器按接口进程内共用，速率不分作用域）
+            for name, values in data.get("gauges", {}).items():
+                bucket = self.gauges.setdefault(name, {})
+                for key, value in values.items():
+                    bucket[key] = bucket.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, values in self.latencies.items():
+                arr = np.asarray(values, dtype=float)
+                endpoints[endpoint] = {
+                    "calls": int(len(arr)),
+                    "p50": float(np.percentile(arr, 50)),
+                    "p95": float(np.percentile(arr, 95)),
+                    "max": float(arr.max()),
+                    "total": float(arr.sum()),
+                }
+            return {
+                "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+                "elapsed": time.time() - self.started_at,
+                "stages": dict(self.stages),
+                "endpoints": endpoints,
+                "counters": {k: dict(v) for k, v in self.counters.items()},
+                "gauges": {k: dict(v) for k, v in self.gauges.items()},
+            }
+
+
+METRICS = RunMetrics()
+
+
+@contextmanager
+def scope(name):
+    """
+    在 with 块内（含经 fetch_pool 派生的工作线程）记录的埋点都归到作用域 name 下
+    """
+    token = _SCOPE.set(name)
+    try:
+        yield
+    finally:
+        _SCOPE.reset(token)
+
+
+def stage(name):
+    return METRICS.stage(name)
+
+
+def record_call(endpoint, seconds, outcome):
+    METRICS.record_call(endpoint, seconds, outcome)
+
+
+def count(name, outcome, n=1):
+    METRICS.count(name, outcome, n)
+
+
+def set_gauge(name, key, value):
+    METRICS.set_gauge(name, key, value)
+
+
+def call_outcome(result):
+    """
+    接口返回值归类：None/空表 -> empty，其余 -> success
+    """
+    if result is None:
+        return "empty"
+    try:
+        return "empty" if len(result) == 0 else "success"
+    except TypeError:
+        return "success"
+
+
+def summary_lines():
+    """
+    邮件里附带的简短耗时摘要
+    """
+    snap = METRICS.snapshot()
+    lines = [f"⏱️ 运行耗时: {snap['elapsed']:.1f}s"]
+    if snap["stages"]:
+        lines.append("阶段: " + " | ".join(f"{k}={v:.1f}s" for k, v in snap["stages"].items()))
+    for endpoint, stats in snap["endpoints"].items():
+        outcomes = snap["counters"].get(endpoint, {})
+        lines.append(
+            f"{endpoint}: {stats['calls']}次 p50={stats['p50']:.2f}s p95={stats['p95']:.2f}s max={stats['max']:.2f}s"
+            f" | 空={outcomes.get('empty', 0)} 异常={outcomes.get('exception', 0)}"
+        )
+    for name, outcomes in snap["counters"].items():
+        if name in snap["endpoints"]:
+            continue
+        lines.append(f"{name}: " + " ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+    for name, values in snap["gauges"].items():
+        lines.append(f"{name}: " + " ".join(f"{k}={v}" for k, v in sorted(values.items())))
+    return lines
+
+
+def write_manifest(name, extra=None, manifest_dir=MANIFEST_DIR):
+    """
+    写出机器可读的运行清单 JSON，返回文件路径
+    """
+    payload = METRICS.snapshot()
+    payload["name"] = name
+    if extra:
+        payload.update(extra)
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+    return path
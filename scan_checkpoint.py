@@ -0,0 +1,81 @@
+# scan_checkpoint.py
+import glob
+import json
+import os
+
+import pandas as pd
+
+from nav_store import today_str
+
+# 扫描断点：每只基金处理完立即追加一行 JSON；同一天重跑时跳过已完成的代码
+CHECKPOINT_DIR = os.path.join("cache", "checkpoint")
+
+
+def checkpoint_path(name, run_date=None, checkpoint_dir=CHECKPOINT_DIR):
+    return os.path.join(checkpoint_dir, f"{name}_{run_date or today_str()}.jsonl")
+
+
+def prune_checkpoints(name, keep_path, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    删除同名的历史断点文件（只保留当天的）；
+    只匹配 {name}_日期.jsonl，不会误删分片断点 {name}_s0of4_日期.jsonl
+    """
+    for path in glob.glob(os.path.join(checkpoint_dir, f"{name}_[0-9]*.jsonl")):
+        if os.path.abspath(path) != os.path.abspath(keep_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def iter_checkpoint(path):
+    """
+    逐行读取断点文件（流式，不整体载入内存）；
+    进程被强杀时最后一行可能不完整，直接忽略
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("code"):
+                yield record
+
+
+def append_records(path, records):
+    """
+    追加写入一批已完成的记录，并立即落盘
+    """
+    if not records:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def series_to_json(ret):
+    """
+    收益率序列 -> 可 JSON 序列化的 {"dates": [...], "values": [...]}
+    """
+    if ret is None:
+        return None
+    return {
+        "dates": [pd.Timestamp(d).strftime("%Y-%m-%d") for d in ret.index],
+        "values": [float(v) for v in ret.to_numpy()],
+    }
+
+
+def series_from_json(data):
+    if not data:
+        return None
+    return pd.Series(data["values"], index=pd.to_datetime(data["dates"]), dtype=float)
@@ -0,0 +1,110 @@
+# shard.py
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from nav_store import today_str
+from scan_checkpoint import series_from_json, series_to_json
+
+# 分片结果目录：多个独立进程/定时任务各扫一片，最后由 --merge 合并
+SHARD_DIR = os.path.join("cache", "shards")
+
+
+def shard_of(code, n_shards):
+    """
+    按代码哈希确定分片号（crc32，跨进程/跨机器稳定，不受 PYTHONHASHSEED 影响）
+    """
+    return zlib.crc32(str(code).encode("utf-8")) % int(n_shards)
+
+
+def split_by_shard(df, code_col, n_shards):
+    """
+    把候选表按代码哈希拆成 n_shards 份（各份内部保持原顺序）
+    """
+    shard_ids = df[code_col].astype(str).map(lambda c: shard_of(c, n_shards))
+    return [df[shard_ids == i] for i in range(int(n_shards))]
+
+
+def parse_shard_arg(text):
+    """
+    "2/8" -> (2, 8)
+    """
+    index, total = str(text).split("/")
+    index, total = int(index), int(total)
+    if total < 1 or not 0 <= index < total:
+        raise ValueError(f"invalid shard: {text}")
+    return index, total
+
+
+def partial_path(name, index, n_shards, run_date=None, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f"{name}_{run_date or today_str()}_{index}of{n_shards}.json")
+
+
+def save_partial(path, scored_funds, returns_map, coverage, metrics=None):
+    """
+    写出单个分片的扫描结果（收益率序列转成 JSON）
+    """
+    payload = {
+        "scored_funds": scored_funds,
+        "returns": {code: series_to_json(ret) for code, ret in returns_map.items()},
+        "coverage": coverage,
+        "metrics": metrics,
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_partials(name, n_shards, run_date=None, shard_dir=SHARD_DIR):
+    """
+    读取当天全部分片结果；返回 (partials, missing_shards)
+    """
+    partials = []
+    missing = []
+    for i in range(int(n_shards)):
+        path = partial_path(name, i, n_shards, run_date=run_date, shard_dir=shard_dir)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            missing.append(i)
+            continue
+        payload["returns"] = {code: series_from_json(data) for code, data in payload.get("returns", {}).items()}
+        partials.append(payload)
+    return partials, missing
+
+
+def merge_partials(partials, order_codes=None):
+    """
+    合并分片结果：scored_funds 按 order_codes（原候选顺序）排列，coverage 各项求和。
+    partials 的元素为 dict(scored_funds, returns, coverage)
+    """
+    scored_funds = []
+    returns_map = {}
+    coverage = {}
+    for part in partials:
+        scored_funds.extend(part.get("scored_funds") or [])
+        returns_map.update(part.get("returns") or {})
+        for key, value in (part.get("coverage") or {}).items():
+            coverage[key] = coverage.get(key, 0) + int(value)
+
+    if order_codes is not None:
+        rank = {str(code): i for i, code in enumerate(order_codes)}
+        scored_funds.sort(key=lambda f: rank.get(str(f.get("code")), len(rank)))
+    return scored_funds, returns_map, coverage
+
+
+def run_sharded(worker, shard_args, processes):
+    """
+    进程池并行执行 worker(*args)（每片一个任务），按分片顺序返回结果；
+    worker 必须是模块顶层函数（可被 pickle）。
+    子进程用 spawn 方式启动：run_all 里调用方是多线程的，fork 会把其它线程持有的锁（调度器/限速器/连接池/日志）带进子进程
+    """
+    processes = max(1, min(int(processes), len(shard_args)))
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(worker, *args) for args in shard_args]
+        return [f.result() for f in futures]
@@ -0,0 +1,67 @@
+# share_class.py
+import string
+
+import numpy as np
+import pandas as pd
+
+# 份额类别后缀：名称末尾的单个类别字母，前一个字符不能是大写字母，
+# 避免把 "ETF"、"LOF"、"QDII" 的末字母当成份额类别
+SHARE_CLASSES = list("ABCDEFHIY")
+FEEDER_KEYWORD = "联接"
+
+_UPPER = list(string.ascii_uppercase)
+_FULLWIDTH = str.maketrans({"（": "(", "）": ")"})
+
+
+def normalize_names(names):
+    """
+    全角括号转半角，保证同一基金不同份额的名称可比（只处理含全角括号的行）
+    """
+    names = pd.Series(names, dtype=object).fillna("").astype(str)
+    fullwidth = names.str.contains("（", regex=False).to_numpy()
+    if fullwidth.any():
+        names = names.copy()
+        names[fullwidth] = names[fullwidth].str.translate(_FULLWIDTH)
+    return names
+
+
+def is_feeder(names):
+    """
+    是否为 ETF 联接基金（向量化）
+    """
+    return pd.Series(names, dtype=object).fillna("").astype(str).str.contains(FEEDER_KEYWORD, regex=False)
+
+
+def split_share_class(names):
+    """
+    名称 -> (base, share_class)：base 去掉份额后缀与“联接”字样（联接基金与其目标 ETF 归为一组），
+    share_class 为类别字母，没有后缀时为空串
+    """
+    names = normalize_names(names)
+    last = names.str[-1:]
+    has_class = (last.isin(SHARE_CLASSES) & ~names.str[-2:-1].isin(_UPPER)).to_numpy()
+
+    share_class = last.where(has_class, "")
+    base = names.copy()
+    base[has_class] = names[has_class].str[:-1]
+    feeder = is_feeder(base).to_numpy()
+    if feeder.any():
+        base[feeder] = base[feeder].str.replace(FEEDER_KEYWORD, "", regex=False)
+    return base, share_class
+
+
+def dedup_share_classes(df, name_col, class_priority="C"):
+    """
+    同一基金的多个份额只保留一个：按 class_priority 里的先后选类别（未列出的类别与无后缀的排在后面），
+    同优先级取表里靠前的一行。一次 groupby 完成，返回保持原有行顺序的子表
+    """
+    if df is None or len(df) == 0:
+        return df
+
+    base, share_class = split_share_class(df[name_col].to_numpy())
+    order = {c: i for i, c in enumerate(str(class_priority))}
+    rank = share_class.map(order).fillna(len(order)).to_numpy()
+
+    keys = pd.DataFrame({"base": base.to_numpy(), "rank": rank})
+    keep = np.sort(keys.groupby("base", sort=False)["rank"].idxmin().to_numpy())
+    return df.iloc[keep].copy()
@@ -0,0 +1,21 @@
+# tests/test_smoke.py
+import importlib
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# workflow 里直接运行的入口脚本：只验证能否导入（导入时不联网），改名 / 删函数导致的 ImportError 在这里暴露
+ENTRY_MODULES = ("run_all", "index08", "index_etf", "trade_calendar")
+
+
+class ImportSmokeTest(unittest.TestCase):
+    def test_entry_modules_import(self):
+        for name in ENTRY_MODULES:
+            with self.subTest(module=name):
+                importlib.import_module(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+# topk.py
+import heapq
+
+
+class TopK:
+    """
+    有界小顶堆：扫描过程中只保留 score 最高的 k 个候选（score 相同时 order 小的优先，
+    与“按 score 稳定降序排序后取前 k”结果一致）；附带数据（如收益率序列）只为堆内成员保留
+    """
+
+    def __init__(self, k):
+        self.k = max(1, int(k))
+        self._heap = []  # (score, -order, item, payload)，堆顶是当前最差的成员
+
+    def __len__(self):
+        return len(self._heap)
+
+    def accepts(self, score, order):
+        """
+        这个候选能否进堆（先判断，再决定是否解析它的附带数据）
+        """
+        if len(self._heap) < self.k:
+            return True
+        return (float(score), -int(order)) > self._heap[0][:2]
+
+    def push(self, score, order, item, payload=None):
+        entry = (float(score), -int(order), item, payload)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def sorted_items(self):
+        """
+        按 score 降序返回 [(item, payload), ...]
+        """
+        ordered = sorted(self._heap, key=lambda e: e[:2], reverse=True)
+        return [(item, payload) for _, _, item, payload in ordered]
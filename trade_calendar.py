@@ -0,0 +1,153 @@
+# trade_calendar.py
+import argparse
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from data_source import ak
+from nav_store import today_str
+
+# 交易日历缓存（新浪交易日历包含当年剩余日期，只有“今天超过缓存最后日期”时才需要刷新）
+CALENDAR_PATH = os.path.join("cache", "trade_dates.npy")
+
+# workflow 门禁按北京时间判断“今天”
+GATE_TIMEZONE = "Asia/Shanghai"
+
+_lock = threading.Lock()
+_trade_dates = None
+_trade_day_set = None
+
+
+def _download_trade_dates():
+    df = ak.tool_trade_date_hist_sina()
+    dates = pd.to_datetime(df["trade_date"], errors="coerce").dropna()
+    return np.unique(dates.to_numpy().astype("datetime64[D]"))
+
+
+def _weekday_fallback(today):
+    """
+    交易日历接口异常且无本地缓存时，退化为“工作日”近似（与 workflow 的处理一致）
+    """
+    days = pd.bdate_range(end=today, periods=2000)
+    return days.to_numpy().astype("datetime64[D]")
+
+
+def load_trade_dates(path=CALENDAR_PATH):
+    """
+    返回升序交易日数组（datetime64[D]）；进程内只加载一次
+    """
+    global _trade_dates, _trade_day_set
+    with _lock:
+        if _trade_dates is not None:
+            return _trade_dates
+
+        today = np.datetime64(today_str(), "D")
+        dates = None
+        if os.path.exists(path):
+            try:
+                dates = np.load(path, allow_pickle=False)
+            except Exception:
+                dates = None
+
+        if dates is None or len(dates) == 0 or today > dates[-1]:
+            try:
+                dates = _download_trade_dates()
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                np.save(path, dates)
+            except Exception:
+                if dates is None or len(dates) == 0:
+                    dates = _weekday_fallback(today_str())
+
+        _trade_dates = dates
+        # 按“天序号”建哈希集合，is_trading_day 为 O(1) 查询
+        _trade_day_set = set(dates.astype("int64").tolist())
+        return _trade_dates
+
+
+def _as_day(day):
+    return np.datetime64(day or today_str(), "D")
+
+
+def is_trading_day(day=None):
+    """
+    day（默认今天）是否为交易日；超出日历范围（新年日历尚未发布）时按工作日近似
+    """
+    dates = load_trade_dates()
+    day = _as_day(day)
+    if day > dates[-1]:
+        return bool(np.is_busday(day))
+    return int(day.astype("int64")) in _trade_day_set
+
+
+def trading_days_before(day=None, n=1):
+    """
+    day 之前第 n 个交易日（day 本身不计），返回 pd.Timestamp；超出日历范围返回 None
+    """
+    dates = load_trade_dates()
+    pos = int(np.searchsorted(dates, _as_day(day), side="left")) - int(n)
+    return pd.Timestamp(dates[pos]) if 0 <= pos < len(dates) else None
+
+
+def trading_days_after(day=None, n=1):
+    """
+    day 之后第 n 个交易日（day 本身不计），返回 pd.Timestamp；超出日历范围返回 None
+    """
+    dates = load_trade_dates()
+    pos = int(np.searchsorted(dates, _as_day(day), side="right")) + int(n) - 1
+    return pd.Timestamp(dates[pos]) if 0 <= pos < len(dates) else None
+
+
+def trade_dates_between(start, end):
+    """
+    [start, end] 区间内的交易日（DatetimeIndex），二分定位后直接切片
+    """
+    dates = load_trade_dates()
+    lo = int(np.searchsorted(dates, _as_day(start), side="left"))
+    hi = int(np.searchsorted(dates, _as_day(end), side="right"))
+    return pd.DatetimeIndex(dates[lo:hi])
+
+
+def lookback_start_date(points, today=None):
+    """
+    截止今天（含）往前数 points 个交易日，返回最早那天（YYYYMMDD），
+    即能拿到 points 根日线的最小 start_date
+    """
+    dates = load_trade_dates()
+    today = np.datetime64(today or today_str(), "D")
+    end = int(np.searchsorted(dates, today, side="right"))
+    start = max(0, end - int(points))
+    return pd.Timestamp(dates[start]).strftime("%Y%m%d")
+
+
+def gate_today():
+    """
+    北京时间的今天（YYYY-MM-DD）
+    """
+    from zoneinfo import ZoneInfo
+    return datetime.now(ZoneInfo(GATE_TIMEZONE)).strftime("%Y-%m-%d")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="交易日判断（workflow 门禁）")
+    parser.add_argument("--date", help="要判断的日期 YYYY-MM-DD，默认北京时间今天")
+    args = parser.parse_args()
+
+    day = args.date or gate_today()
+    try:
+        is_trade = is_trading_day(day)
+    except Exception:
+        # 日历不可用时退化为“工作日”判断，避免误判导致一直不跑
+        is_trade = bool(np.is_busday(np.datetime64(day, "D")))
+
+    output = os.environ.get("GITHUB_OUTPUT")
+    if output:
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(f"is_trade={'true' if is_trade else 'false'}\n")
+    print(f"Beijing date: {day} | is_trade={is_trade}")
+
+
+if __name__ == "__main__":
+    main()
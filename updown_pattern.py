@@ -0,0 +1,92 @@
+# updown_pattern.py
+import numpy as np
+
+# 涨跌形态的位编码：第 k 位 = 往前数第 k 个交易日是否上涨（第 0 位 = 最新一天），
+# 与字符串形态 "1011..."（左侧为最新）逐字符对应；一个 uint64 最多表示 64 天
+PATTERN_POINTS = 20
+MAX_PATTERN_BITS = 64
+
+
+def updown_bits_panel(nav, points=PATTERN_POINTS):
+    """
+    整个面板一次性计算涨跌形态：nav 为右对齐的 (T, N) 净值矩阵（build_nav_panel 的输出）。
+    返回 (bits, valid)：bits 为 (N,) uint64，valid 表示最近 points 行都有数据（否则无形态）
+    """
+    n_bits = int(points) - 1
+    if not 0 < n_bits <= MAX_PATTERN_BITS:
+        raise ValueError(f"points must be in [2, {MAX_PATTERN_BITS + 1}]")
+
+    nav = np.asarray(nav, dtype=float)
+    n_funds = nav.shape[1]
+    if nav.shape[0] < points:
+        return np.zeros(n_funds, dtype=np.uint64), np.zeros(n_funds, dtype=bool)
+
+    window = nav[-points:]
+    valid = ~np.isnan(window).any(axis=0)
+    up = np.diff(window, axis=0) > 0          # (points-1, N)，NaN 比较为 False
+    up = up[::-1]                             # 第 0 行 = 最新一天
+    weights = np.left_shift(np.uint64(1), np.arange(n_bits, dtype=np.uint64))
+    bits = np.bitwise_or.reduce(np.where(up, weights[:, None], np.uint64(0)), axis=0)
+    return bits.astype(np.uint64), valid
+
+
+def encode_pattern(pattern):
+    """
+    "1011" -> (code, length)；字符串左侧为最新一天
+    """
+    pattern = str(pattern)
+    if not pattern or len(pattern) > MAX_PATTERN_BITS or set(pattern) - {"0", "1"}:
+        raise ValueError(f"invalid pattern: {pattern!r}")
+    code = 0
+    for k, ch in enumerate(pattern):
+        if ch == "1":
+            code |= 1 << k
+    return code, len(pattern)
+
+
+def decode_pattern(bits, length=PATTERN_POINTS - 1):
+    """
+    位编码 -> 字符串形态（仅用于展示）
+    """
+    bits = int(bits)
+    return "".join("1" if (bits >> k) & 1 else "0" for k in range(int(length)))
+
+
+class PatternMatcher:
+    """
+    多形态前缀匹配：“形态以 M 个目标中的任意一个开头”等价于 (bits & 低 L 位掩码) == 目标编码
+    """
+
+    def __init__(self, patterns):
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        encoded = [encode_pattern(p) for p in patterns]
+        self.patterns = [str(p) for p in patterns]
+        self.codes = np.array([code for code, _ in encoded], dtype=np.uint64)
+        self.masks = np.array([(1 << length) - 1 for _, length in encoded], dtype=np.uint64)
+        self._pairs = [(code, (1 << length) - 1) for code, length in encoded]
+
+    def match(self, bits):
+        """
+        单只基金：bits 为 int（None 表示无形态，视为不匹配）
+        """
+        if bits is None:
+            return False
+        bits = int(bits)
+        return any(bits & mask == code for code, mask in self._pairs)
+
+    def match_matrix(self, bits, valid=None):
+        """
+        整个面板：返回 (M, N) 布尔矩阵，第 m 行 = 哪些基金以第 m 个形态开头
+        """
+        bits = np.asarray(bits, dtype=np.uint64)
+        hit = (bits[None, :] & self.masks[:, None]) == self.codes[:, None]
+        if valid is not None:
+            hit &= np.asarray(valid, dtype=bool)[None, :]
+        return hit
+
+    def match_panel(self, bits, valid=None):
+        """
+        整个面板：返回 (N,) 布尔数组，匹配任意一个形态即为 True
+        """
+        return self.match_matrix(bits, valid).any(axis=0)
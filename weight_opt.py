@@ -0,0 +1,369 @@
+# weight_opt.py
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import index08 as strategy
+import panel_backtest
+import run_metrics
+from feature_store import backfill, open_store
+from panel_score import WEIGHT_KEYS, feature_design, rolling_score_panel, weight_vector
+
+# ================= 配置区域 =================
+# SCORE_W_* 权重与两个阈值的 walk-forward 优化：特征张量只计算一次；
+# 得分对权重是线性的，每个调仓日用一次矩阵乘法 (标的, 特征) @ (特征, 权重组) 同时给数千组权重打分
+
+# 1. 搜索空间：以 index08 当前权重为中心，每个权重在 [w / WEIGHT_SPAN, w * WEIGHT_SPAN] 内按对数均匀采样
+#    （第 0 组固定为当前权重；当前为 0 的权重保持为 0）
+N_WEIGHT_SAMPLES = 2000
+WEIGHT_SPAN = 4.0
+RANDOM_SEED = 0
+
+# 2. 阈值网格（只影响“超阈值扣分”两列特征，换阈值不重算其它特征）
+RET_HOLD_SOFT_CAP_GRID = (0.08, 0.10, 0.12, 0.15, 0.20)
+BIAS_20_THRESHOLD_GRID = (0.06, 0.08, 0.10, 0.12, 0.15)
+
+# 3. 目标函数
+# - "rank_ic": 得分与未来 HOLD_DAYS 日收益的 Spearman 秩相关（各调仓日取均值）
+# - "topn":    得分前 OUTPUT_TOP_N 只的未来 HOLD_DAYS 日平均收益（不含相关性分散）
+OBJECTIVE = "rank_ic"
+
+# 4. walk-forward：前 TRAIN_DAYS 个交易日选参，随后 TEST_DAYS 个交易日样本外检验，按 TEST_DAYS 向前滚动
+TRAIN_DAYS = 250
+TEST_DAYS = 60
+
+# 5. 调仓日有效标的少于该数量时不参与评估
+MIN_CROSS_SECTION = 20
+
+# 6. 每个 fold 一个进程
+OPT_PROCESSES = 4
+
+# 7. 特征来源：None = 每次对面板现算；填库名（如 "backtest"）则读特征库，
+#    库里没有的 (标的, 日期) 先回填一次，之后反复扫描不再重算特征
+FEATURE_STORE_NAME = None
+
+# ===========================================
+
+# 特征张量的最后一维（feature_design 需要的原始特征）
+RAW_FEATURES = ("ret_hold", "ret_20", "vol_20", "mdd_20", "pos_ratio_20", "bias_20")
+
+
+def current_params():
+    """
+    index08 当前的 (权重 dict, 软上限, 乖离阈值)
+    """
+    return panel_backtest.strategy_weights(), strategy.RET_HOLD_SOFT_CAP, strategy.BIAS_20_THRESHOLD
+
+
+def sample_weight_matrix(base, n_samples=N_WEIGHT_SAMPLES, span=WEIGHT_SPAN, seed=RANDOM_SEED):
+    """
+    返回 (n_samples + 1, len(WEIGHT_KEYS)) 的权重矩阵，第 0 行为 base
+    """
+    rng = np.random.default_rng(seed)
+    base = weight_vector(base)
+    log_span = np.log(float(span))
+    factors = np.exp(rng.uniform(-log_span, log_span, size=(int(n_samples), len(base))))
+    return np.vstack([base, base * factors])
+
+
+def build_feature_tensor(panel, hold_days=None, store=None):
+    """
+    面板 -> (features, fwd, rows)：features 为 (调仓日, 标的, RAW_FEATURES) 张量，
+    fwd 为各调仓日之后 hold_days 个交易日的收益，rows 为调仓日在面板里的行号（每 hold_days 天一次）；
+    开启 FILTER_RET_HOLD_POSITIVE 时 ret_hold <= 0 的标的置为 NaN（与实盘一致，不参与排序）。
+    传入特征库 store 时从库里读取特征（缺失的先回填），否则对面板现算
+    """
+    hold = int(hold_days or strategy.HOLD_DAYS)
+    weights, cap, threshold = current_params()
+    nav = panel.to_numpy(dtype=float)
+    if store is not None:
+        codes = [str(c) for c in panel.columns]
+        # 与现算口径一致：按面板窗口（中间的缺口保留为 NaN，含缺口的窗口特征为 NaN），只裁掉首尾的空段
+        series = [panel[c].loc[panel[c].first_valid_index():panel[c].last_valid_index()] for c in panel.columns]
+        computed = backfill(store, codes, [s if len(s) else None for s in series], weights)
+        print(f"🗃️ 特征库 {store.dir}: 本次回填 {computed} 个 (标的, 日期)")
+        full = store.take(panel.index, codes, RAW_FEATURES)
+    else:
+        result = rolling_score_panel(
+            nav,
+            weights,
+            hold_days=hold,
+            ret_hold_soft_cap=cap,
+            bias_threshold=threshold,
+            enable_bias_penalty=strategy.ENABLE_BIAS_20_PENALTY,
+        )
+        full = np.stack([result[name] for name in RAW_FEATURES], axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fwd_all = np.full(nav.shape, np.nan)
+        fwd_all[:-hold] = nav[hold:] / nav[:-hold] - 1
+
+    valid_rows = np.flatnonzero(~np.isnan(full).any(axis=2).all(axis=1))
+    first = int(valid_rows[0]) if len(valid_rows) else len(nav)
+    rows = np.arange(first, len(nav) - hold, hold)
+
+    features = np.array(full[rows], dtype=float)
+    fwd = fwd_all[rows]
+    if strategy.FILTER_RET_HOLD_POSITIVE:
+        features[features[..., 0] <= 0.0] = np.nan
+    return features, fwd, rows
+
+
+def check_store_equivalence(n_funds=40, n_days=300, seed=0, store_dir=None):
+    """
+    合成面板（含晚成立与中间缺口）分别现算、经特征库回填后读取，比较两份特征张量是否逐位一致；
+    返回 (是否一致, 特征张量形状)
+    """
+    import tempfile
+
+    from bench import make_synthetic_panel
+
+    dates, codes, nav = make_synthetic_panel(n_funds, n_days, seed=seed)
+    rng = np.random.default_rng(seed)
+    for j in rng.choice(n_funds, size=max(1, n_funds // 4), replace=False):
+        start = int(rng.integers(0, n_days - 10))
+        nav[start:start + int(rng.integers(1, 8)), j] = np.nan
+    panel = pd.DataFrame(nav, index=dates, columns=codes)
+
+    _, cap, threshold = current_params()
+    direct, _, _ = build_feature_tensor(panel)
+    with tempfile.TemporaryDirectory(dir=store_dir) as tmp:
+        store = open_store("check", strategy.HOLD_DAYS, cap, threshold, strategy.ENABLE_BIAS_20_PENALTY, store_dir=tmp)
+        stored, _, _ = build_feature_tensor(panel, store=store)
+        del store
+    same = direct.shape == stored.shape and np.array_equal(direct, stored, equal_nan=True)
+    return same, direct.shape
+
+
+def _rank_ic(scores, y_rank):
+    """
+    scores (n, M) 每列与 y 的 Spearman 秩相关：得分的秩就是排序后的位置，
+    只需一次 argsort，再按各列顺序取 y 的秩与居中的位置做内积
+    """
+    n = len(y_rank)
+    pos = np.arange(n) - (n - 1) / 2.0
+    y = y_rank - y_rank.mean()
+    denom = np.sqrt((pos ** 2).sum() * (y ** 2).sum())
+    if denom == 0:
+        return np.full(scores.shape[1], np.nan)
+    return pos @ y[scores.argsort(axis=0)] / denom
+
+
+def _topn_return(scores, y, top_n):
+    """
+    scores (n, M) 每列得分前 top_n 的 y 均值
+    """
+    top_n = min(int(top_n), len(y))
+    top = np.argpartition(-scores, top_n - 1, axis=0)[:top_n]
+    return y[top].mean(axis=0)
+
+
+def evaluate(features, fwd, weight_matrix, threshold_pairs, objective=OBJECTIVE,
+             top_n=None, enable_bias_penalty=None, min_cross_section=MIN_CROSS_SECTION):
+    """
+    对 (阈值组合 P) x (权重组 M) 的全部参数计算目标函数在各调仓日上的均值，返回 (P, M)。
+    每个调仓日：前 5 列特征与阈值无关，先做一次 (n, 5) @ (5, M)；
+    每个阈值组合只再加两列“超阈值扣分”的外积
+    """
+    top_n = int(top_n or strategy.OUTPUT_TOP_N)
+    enable = strategy.ENABLE_BIAS_20_PENALTY if enable_bias_penalty is None else enable_bias_penalty
+    weight_matrix = np.asarray(weight_matrix, dtype=float)
+    total = np.zeros((len(threshold_pairs), len(weight_matrix)))
+    count = np.zeros(len(threshold_pairs))
+
+    for d in range(features.shape[0]):
+        ok = ~np.isnan(features[d]).any(axis=1) & ~np.isnan(fwd[d])
+        if ok.sum() < max(int(min_cross_section), 2):
+            continue
+        raw = {name: features[d, ok, i] for i, name in enumerate(RAW_FEATURES)}
+        y = fwd[d, ok]
+        y_rank = pd.Series(y).rank().to_numpy() if objective == "rank_ic" else None
+
+        design = feature_design(raw, 0.0, 0.0, enable)
+        base_scores = design[:, :5] @ weight_matrix[:, :5].T
+        for p, (cap, threshold) in enumerate(threshold_pairs):
+            design = feature_design(raw, cap, threshold, enable)
+            scores = base_scores + np.outer(design[:, 5], weight_matrix[:, 5]) + np.outer(design[:, 6], weight_matrix[:, 6])
+            if objective == "rank_ic":
+                values = _rank_ic(scores, y_rank)
+            elif objective == "topn":
+                values = _topn_return(scores, y, top_n)
+            else:
+                raise ValueError(f"unknown objective: {objective}")
+            total[p] += np.nan_to_num(values, nan=0.0)
+            count[p] += 1
+
+    with np.errstate(invalid="ignore"):
+        return total / np.where(count > 0, count, np.nan)[:, None]
+
+
+def walk_forward_folds(rows, train_days=TRAIN_DAYS, test_days=TEST_DAYS, hold_days=None):
+    """
+    按面板行号切分 walk-forward：返回 [(train_idx, test_idx), ...]（均为调仓日下标）。
+    训练集剔除未来收益窗口与检验期重叠的调仓日，避免前视
+    """
+    hold = int(hold_days or strategy.HOLD_DAYS)
+    rows = np.asarray(rows)
+    if len(rows) == 0:
+        return []
+
+    folds = []
+    start = int(rows[0])
+    while True:
+        test_start = start + int(train_days)
+        test_end = test_start + int(test_days)
+        if test_start > rows[-1]:
+            break
+        train_idx = np.flatnonzero((rows >= start) & (rows + hold < test_start))
+        test_idx = np.flatnonzero((rows >= test_start) & (rows < test_end))
+        if len(train_idx) and len(test_idx):
+            folds.append((train_idx, test_idx))
+        start += int(test_days)
+    return folds
+
+
+def _run_fold(features_train, fwd_train, features_test, fwd_test, weight_matrix, threshold_pairs, base_pair, objective):
+    """
+    单个 fold（进程池 worker）：训练集上全量搜索，取最优参数，与当前参数一起在检验集上评估
+    """
+    train = evaluate(features_train, fwd_train, weight_matrix, threshold_pairs, objective)
+    if np.isnan(train).all():
+        return None
+    p, m = np.unravel_index(np.nanargmax(train), train.shape)
+    base_p = threshold_pairs.index(base_pair)
+
+    test_best = evaluate(features_test, fwd_test, weight_matrix[[m]], [threshold_pairs[p]], objective)[0, 0]
+    test_base = evaluate(features_test, fwd_test, weight_matrix[[0]], [base_pair], objective)[0, 0]
+    return {
+        "weights": {k: float(v) for k, v in zip(WEIGHT_KEYS, weight_matrix[m])},
+        "ret_hold_soft_cap": float(threshold_pairs[p][0]),
+        "bias_20_threshold": float(threshold_pairs[p][1]),
+        "train_best": float(train[p, m]),
+        "train_base": float(train[base_p, 0]),
+        "test_best": float(test_best),
+        "test_base": float(test_base),
+    }
+
+
+def optimize(panel, objective=OBJECTIVE, n_samples=N_WEIGHT_SAMPLES, processes=OPT_PROCESSES):
+    """
+    walk-forward 优化主流程，返回每个 fold 的结果列表（含起止日期）
+    """
+    base_weights, base_cap, base_threshold = current_params()
+    store = None
+    if FEATURE_STORE_NAME:
+        store = open_store(FEATURE_STORE_NAME, strategy.HOLD_DAYS, base_cap, base_threshold, strategy.ENABLE_BIAS_20_PENALTY)
+    with run_metrics.stage("features"):
+        features, fwd, rows = build_feature_tensor(panel, store=store)
+    weight_matrix = sample_weight_matrix(base_weights, n_samples)
+
+    base_pair = (float(base_cap), float(base_threshold))
+    threshold_pairs = [(float(c), float(b)) for c, b in itertools.product(RET_HOLD_SOFT_CAP_GRID, BIAS_20_THRESHOLD_GRID)]
+    if base_pair not in threshold_pairs:
+        threshold_pairs.insert(0, base_pair)
+
+    folds = walk_forward_folds(rows)
+    print(f"🧮 特征张量 {features.shape} | 参数组合 {len(threshold_pairs)} x {len(weight_matrix)} | fold {len(folds)} 个 | 目标 {objective}")
+    if not folds:
+        return []
+
+    tasks = [
+        (features[tr], fwd[tr], features[te], fwd[te], weight_matrix, threshold_pairs, base_pair, objective)
+        for tr, te in folds
+    ]
+    with run_metrics.stage("optimize"):
+        processes = min(int(processes or 1), len(tasks), os.cpu_count() or 1)
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_run_fold, *zip(*tasks)))
+        else:
+            results = [_run_fold(*task) for task in tasks]
+
+    dates = panel.index
+    out = []
+    for (tr, te), res in zip(folds, results):
+        if res is None:
+            continue
+        res["train_start"] = str(dates[rows[tr[0]]].date())
+        res["test_start"] = str(dates[rows[te[0]]].date())
+        res["test_end"] = str(dates[rows[te[-1]]].date())
+        out.append(res)
+    return out
+
+
+def format_config(result):
+    """
+    把某个 fold 的最优参数格式化为可直接粘贴到配置区域的常量
+    """
+    names = {
+        "ret_hold": "SCORE_W_RET_HOLD",
+        "ret_20": "SCORE_W_RET_20",
+        "vol_20": "SCORE_W_VOL_20",
+        "mdd_20": "SCORE_W_MDD_20",
+        "pos_20": "SCORE_W_POS_20",
+        "ret_hold_cap": "SCORE_W_RET_HOLD_CAP",
+        "bias_20": "SCORE_W_BIAS_20",
+    }
+    lines = [f"{names[k]} = {result['weights'][k]:.2f}" for k in WEIGHT_KEYS]
+    lines.append(f"RET_HOLD_SOFT_CAP = {result['ret_hold_soft_cap']:.2f}")
+    lines.append(f"BIAS_20_THRESHOLD = {result['bias_20_threshold']:.2f}")
+    return lines
+
+
+def main(objective=OBJECTIVE, n_samples=N_WEIGHT_SAMPLES, processes=OPT_PROCESSES):
+    run_metrics.METRICS.reset()
+    codes = panel_backtest.UNIVERSE_CODES or panel_backtest.default_universe()
+    print(f"⏳ 正在拉取 {len(codes)} 只标的的历史数据...")
+    with run_metrics.stage("fetch"):
+        panel = panel_backtest.load_price_panel(codes)
+    if panel is None:
+        print("❌ 数据获取失败")
+        return
+
+    started = time.perf_counter()
+    results = optimize(panel, objective=objective, n_samples=n_samples, processes=processes)
+    if not results:
+        print("❌ 历史长度不足以切分 walk-forward（检查 TRAIN_DAYS / TEST_DAYS）")
+        return
+
+    print("-" * 30)
+    print(f"📊 walk-forward 权重优化（{panel.shape[1]} 只，目标 {objective}，耗时 {time.perf_counter() - started:.1f}s）")
+    for res in results:
+        print(
+            f"{res['test_start']} ~ {res['test_end']} | 训练 最优={res['train_best']:.4f} 当前={res['train_base']:.4f}"
+            f" | 样本外 最优={res['test_best']:.4f} 当前={res['test_base']:.4f}"
+        )
+    oos_best = float(np.nanmean([r["test_best"] for r in results]))
+    oos_base = float(np.nanmean([r["test_base"] for r in results]))
+    print(f"样本外均值: 优化参数={oos_best:.4f} | 当前参数={oos_base:.4f}")
+    print("最近一个 fold 的最优参数（仅供参考，样本外不占优时不要替换）：")
+    for line in format_config(results[-1]):
+        print(f"  {line}")
+
+    path = run_metrics.write_manifest("weight_opt", extra={
+        "objective": objective,
+        "samples": int(n_samples),
+        "folds": results,
+        "oos_best": oos_best,
+        "oos_base": oos_base,
+    })
+    print(f"📝 运行清单: {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SCORE_W_* 权重 walk-forward 优化")
+    parser.add_argument("--objective", default=OBJECTIVE, choices=("rank_ic", "topn"))
+    parser.add_argument("--samples", type=int, default=N_WEIGHT_SAMPLES, help="随机权重组数")
+    parser.add_argument("--processes", type=int, default=OPT_PROCESSES)
+    parser.add_argument("--check-store", action="store_true", help="核对特征库与现算的特征张量是否一致（合成数据，含缺口）")
+    args = parser.parse_args()
+    if args.check_store:
+        same, shape = check_store_equivalence()
+        print(f"{'✅' if same else '❌'} 特征库 / 现算特征张量{'一致' if same else '不一致'}: {shape}")
+        raise SystemExit(0 if same else 1)
+    main(objective=args.objective, n_samples=args.samples, processes=args.processes)